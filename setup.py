@@ -34,9 +34,12 @@ setup(name='BICPBS',
       ext_modules=[ 
           Extension("Biclustering.BitSet",
                     ["src/pyrex/BitSet.pyx"], #"src/pyrex/c_numpy.pxd", "src/pyrex/c_python.pxd"],
-                    include_dirs = [sys.prefix + '/lib/python' + 
+                    include_dirs = ['src/pyrex',
+                                    sys.prefix + '/lib/python' + 
                                     sys.version[:3] + 
-                                    '/site-packages/numpy/core/include/'])
+                                    '/site-packages/numpy/core/include/'],
+                    depends = ["src/pyrex/bitops.h"],
+                    extra_compile_args = ['-O3'])
                   ],
       cmdclass = {'build_ext': build_ext}
      )
\ No newline at end of file
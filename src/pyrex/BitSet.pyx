@@ -46,6 +46,21 @@ cdef enum:
 # python accessible 
 BITS = cBITS
 
+# vectorized word loops
+cdef extern from "bitops.h":
+    void bitAnd(unsigned int *out, unsigned int *a, unsigned int *b,
+                unsigned long size)
+    void bitOr(unsigned int *out, unsigned int *a, unsigned int *b,
+               unsigned long size)
+    void bitAndNot(unsigned int *out, unsigned int *a, unsigned int *b,
+                   unsigned long size)
+    void bitNot(unsigned int *out, unsigned int *a, unsigned long size)
+    int bitIsSubset(unsigned int *a, unsigned int *b, unsigned long size)
+    int bitEqual(unsigned int *a, unsigned int *b, unsigned long size)
+    int bitCtz(unsigned int word)
+    unsigned long bitIndices(long *out, unsigned int *words,
+                             unsigned long size, unsigned long capacity)
+
 # 32 bit population count from AMD Athlon optimization guide
 cdef unsigned int populationCount(unsigned long v):
     cdef unsigned long w
@@ -105,7 +120,7 @@ cdef class BitSet:
     cdef unsigned int _cachedPopCount
     cdef char _cached
     
-    def __init__(self, universe, initial=None, formatted=False):
+    def __init__(self, universe, initial=None, formatted=False, count=None):
         """
         BitSet(universe [, initial])
         
@@ -114,6 +129,8 @@ cdef class BitSet:
         @param formatted True if initial is already formatted to internal format
                          Only used for quick reconstructions from persistent
                          storage.  Array returned from asArray() is formatted.
+        @param count number of elements in initial if already known, such as
+                     when stored next to the set.  Saves counting on len()
         """
         
         self._universe = universe
@@ -129,7 +146,11 @@ cdef class BitSet:
             if initial is not None:
                 self.initialize(initial)
         
-        self._cached = 0
+        if count is None:
+            self._cached = 0
+        else:
+            self._cachedPopCount = count
+            self._cached = 1
     
     cdef initialize(self, initial):
         cdef unsigned int index
@@ -164,19 +185,12 @@ cdef class BitSet:
         if self._universe != bitSet._universe:
             return False
         
-        cdef unsigned int *selfData
-        cdef unsigned int *bitSetData
-        
-        selfData = <unsigned int *> self._vector.data
-        bitSetData = <unsigned int *> bitSet._vector.data
-        
-        cdef unsigned int i
-        
-        for i from 0 <= i < self._vector.size:
-            if selfData[i] != bitSetData[i]:
-                return False
+        if bitEqual(<unsigned int *> self._vector.data,
+                    <unsigned int *> bitSet._vector.data,
+                    self._vector.size):
+            return True
         
-        return True
+        return False
     
     def __ne__(self, object obj):
         return not self.__eq__(obj)
@@ -246,13 +260,15 @@ cdef class BitSet:
         if self._universe != bitSet._universe:
             raise ValueError("BitSet Universe sizes do not match")
         
-        cdef BitSet intersection
-        intersection = BitSet(self._universe)
+        cdef c_numpy.ndarray vector
+        vector = numpy.empty(self._vector.size, dtype = numpy.uint32)
         
-        # set intersection w/o constructor as data already in BitSet format
-        intersection._vector = self._vector & bitSet._vector
+        bitAnd(<unsigned int *> vector.data,
+               <unsigned int *> self._vector.data,
+               <unsigned int *> bitSet._vector.data,
+               self._vector.size)
         
-        return intersection
+        return BitSet(self._universe, vector, True)
     
     def __and__(BitSet self, object obj):
         """Returns intersection of this and bitSet
@@ -324,13 +340,15 @@ cdef class BitSet:
         if self._universe != bitSet._universe:
             raise ValueError("BitSet Universer size do not match")
         
-        cdef BitSet union
-        union = BitSet(self._universe)
+        cdef c_numpy.ndarray vector
+        vector = numpy.empty(self._vector.size, dtype = numpy.uint32)
         
-        # set union w/o constructor as data already in BitSet format
-        union._vector = self._vector | bitSet._vector
+        bitOr(<unsigned int *> vector.data,
+              <unsigned int *> self._vector.data,
+              <unsigned int *> bitSet._vector.data,
+              self._vector.size)
         
-        return union
+        return BitSet(self._universe, vector, True)
     
     def __or__(BitSet self, object obj):
         """Returns union of this and obj
@@ -340,6 +358,117 @@ cdef class BitSet:
         """
         return self.union(obj)
     
+    def difference(BitSet self, object obj):
+        """Returns elements of this that are not in obj
+        
+        @param obj bit set to remove from self
+        @return self - obj
+        """
+        
+        if not isinstance(obj, BitSet):
+            raise TypeError("Can only produce difference with another BitSet")
+        
+        cdef BitSet bitSet
+        bitSet = obj
+        
+        if self._universe != bitSet._universe:
+            raise ValueError("BitSet Universe sizes do not match")
+        
+        cdef c_numpy.ndarray vector
+        vector = numpy.empty(self._vector.size, dtype = numpy.uint32)
+        
+        bitAndNot(<unsigned int *> vector.data,
+                  <unsigned int *> self._vector.data,
+                  <unsigned int *> bitSet._vector.data,
+                  self._vector.size)
+        
+        return BitSet(self._universe, vector, True)
+    
+    def __sub__(BitSet self, object obj):
+        """Returns elements of this that are not in obj"""
+        return self.difference(obj)
+    
+    def intersectionInto(BitSet self, object obj, BitSet out):
+        """Stores intersection of this and obj in out without allocating
+        
+        @param obj bit set to intersect with self
+        @param out bit set of the same universe to overwrite.  May be self or
+                   obj
+        @return out
+        """
+        
+        if not isinstance(obj, BitSet):
+            raise TypeError("Can only produce intersection with another BitSet")
+        
+        cdef BitSet bitSet
+        bitSet = obj
+        
+        if (self._universe != bitSet._universe or
+            self._universe != out._universe):
+            raise ValueError("BitSet Universe sizes do not match")
+        
+        bitAnd(<unsigned int *> out._vector.data,
+               <unsigned int *> self._vector.data,
+               <unsigned int *> bitSet._vector.data,
+               self._vector.size)
+        out._cached = 0
+        
+        return out
+    
+    def unionInto(BitSet self, object obj, BitSet out):
+        """Stores union of this and obj in out without allocating
+        
+        @param obj bit set to union with self
+        @param out bit set of the same universe to overwrite.  May be self or
+                   obj
+        @return out
+        """
+        
+        if not isinstance(obj, BitSet):
+            raise TypeError("Can only produce union with another BitSet")
+        
+        cdef BitSet bitSet
+        bitSet = obj
+        
+        if (self._universe != bitSet._universe or
+            self._universe != out._universe):
+            raise ValueError("BitSet Universe sizes do not match")
+        
+        bitOr(<unsigned int *> out._vector.data,
+              <unsigned int *> self._vector.data,
+              <unsigned int *> bitSet._vector.data,
+              self._vector.size)
+        out._cached = 0
+        
+        return out
+    
+    def __iand__(BitSet self, object obj):
+        """Intersects this with obj in place"""
+        return self.intersectionInto(obj, self)
+    
+    def __ior__(BitSet self, object obj):
+        """Unions this with obj in place"""
+        return self.unionInto(obj, self)
+    
+    def assign(BitSet self, words, count=None):
+        """Overwrites this set with BitSet formatted words
+        
+        @param words array formatted like asArray(), such as a row read from a
+                     SetArray
+        @param count number of elements in words if already known
+        """
+        
+        if numpy.size(words) != self._vector.size:
+            raise ValueError("words are not properly formatted")
+        
+        self._vector[:] = words
+        
+        if count is None:
+            self._cached = 0
+        else:
+            self._cachedPopCount = count
+            self._cached = 1
+    
     def issubset(BitSet self, object obj):
         """Test whether every element in self is in obj"""
         if (not isinstance(obj, BitSet)):
@@ -351,19 +480,12 @@ cdef class BitSet:
         if (self._universe != bitSet._universe):
             return False
         
-        cdef unsigned int *selfData
-        cdef unsigned int *bitSetData
-        
-        selfData = <unsigned int *> self._vector.data
-        bitSetData = <unsigned int *> bitSet._vector.data
-        
-        cdef unsigned int i
-        
-        for i from 0 <= i < self._vector.size:
-            if selfData[i] & bitSetData[i] != selfData[i]:
-                return False
+        if bitIsSubset(<unsigned int *> self._vector.data,
+                       <unsigned int *> bitSet._vector.data,
+                       self._vector.size):
+            return True
         
-        return True
+        return False
     
     def __le__(BitSet self, object obj):
         """Test whether every element in self is in obj"""
@@ -380,19 +502,12 @@ cdef class BitSet:
         if (self._universe != bitSet._universe):
             return False
         
-        cdef unsigned int *selfData
-        cdef unsigned int *bitSetData
-        
-        selfData = <unsigned int *> self._vector.data
-        bitSetData = <unsigned int *> bitSet._vector.data
-        
-        cdef unsigned int i
-        
-        for i from 0 <= i < self._vector.size:
-            if selfData[i] & bitSetData[i] != bitSetData[i]:
-                return False
+        if bitIsSubset(<unsigned int *> bitSet._vector.data,
+                       <unsigned int *> self._vector.data,
+                       self._vector.size):
+            return True
         
-        return True
+        return False
     
     def __ge__(BitSet self, object obj):
         return self.issuperset(obj)
@@ -400,19 +515,24 @@ cdef class BitSet:
     def complement(BitSet self):
         """Return U - self or the complement of the set"""
         cdef c_numpy.ndarray complementVector
-        complementVector = ~self._vector
+        complementVector = numpy.empty(self._vector.size, dtype = numpy.uint32)
         
-        # clean word that is not completely filled by universe
         cdef unsigned int *data
         data = <unsigned int *> complementVector.data
         
+        bitNot(data, <unsigned int *> self._vector.data, self._vector.size)
+        
+        # clean word that is not completely filled by universe
         cdef unsigned long index
+        cdef unsigned long i
         index = self._universe >> cSHIFT
-        data[index] = data[index] & mask(self._universe & cMASK)
+        if self._universe & cMASK != 0:
+            data[index] = data[index] & mask(self._universe & cMASK)
+            index = index + 1
         
-        # make sure pad word is rezero'd
-        if self._universe < cBITS:
-            data[index + 1] = 0
+        # make sure pad words are rezero'd
+        for i from index <= i < self._vector.size:
+            data[i] = 0
         
         return BitSet(self._universe, complementVector, True)
         
@@ -456,9 +576,71 @@ cdef class BitSet:
     def asArray(self):
         return self._vector.copy()
     
+    def copy(self):
+        """Returns a new BitSet with the same members"""
+        return BitSet(self._universe, self._vector.copy(), True, len(self))
+    
+    def toIndices(self):
+        """Returns the elements of the set in increasing order as an array
+        
+        Much faster than iterating when all elements are needed.  Use
+        toIndices().tolist() to loop over python ints.  The output is sized by
+        counting the bits, not by the cached count, which may be stale if the
+        set was created with a wrong count.
+        """
+        cdef c_numpy.ndarray indices
+        cdef unsigned long count
+        cdef unsigned int *data
+        cdef unsigned int i
+        
+        data = <unsigned int *> self._vector.data
+        count = 0
+        for i from 0 <= i < self._vector.size:
+            count = count + populationCount(data[i])
+        
+        self._cachedPopCount = count
+        self._cached = 1
+        
+        indices = numpy.empty(count, dtype = numpy.int_)
+        
+        bitIndices(<long *> indices.data, data, self._vector.size, count)
+        
+        return indices
+    
     def __iter__(self):
         return BitSetIterator(self)
 
+class BitSetPool:
+    """Free list of BitSets of a single universe used as scratch space
+    
+    Sets handed out by acquire() have undefined contents, so they should only
+    be used as the out of intersectionInto() or unionInto() or be assign()ed
+    """
+    
+    def __init__(self, universe, size=8):
+        """
+        @param universe size of universe of pooled sets
+        @param size max number of released sets kept for reuse
+        """
+        self.universe = universe
+        self.size = size
+        self.free = list()
+    
+    def acquire(self):
+        """Returns a scratch BitSet, reusing a released one if possible"""
+        if len(self.free) != 0:
+            return self.free.pop()
+        
+        return BitSet(self.universe)
+    
+    def release(self, bitSet):
+        """Returns bitSet to the pool
+        
+        @param bitSet set from acquire() that is no longer referenced
+        """
+        if len(self.free) < self.size:
+            self.free.append(bitSet)
+
 cdef class BitSetIterator:
     
     # kept reference so peek at data vector is legal
@@ -467,39 +649,32 @@ cdef class BitSetIterator:
     # iterator state
     cdef unsigned int _size
     cdef unsigned int *_data
-    cdef unsigned long _base
     cdef unsigned int _wordIndex
+    # bits of the current word not returned yet
     cdef unsigned int _word
-    cdef unsigned char _bit
     
     def __init__(self, BitSet bitSet):
         self._bitSet = bitSet
         self._size = bitSet._vector.size
         self._data = <unsigned int *> bitSet._vector.data
-        self._base = 0
         self._wordIndex = 0
         self._word = self._data[0]
-        self._bit = 0
     
     def __iter__(self):
         return self
         
     def __next__(self):
-        if self._wordIndex >= self._size:
-            raise StopIteration
-        
-        retVal = -1
-        for wordIndex from self._wordIndex <= wordIndex < self._size:
-            while self._word != 0:
-                if self._word & 0x1 == 0x1:
-                    retVal = self._base + self._bit
-                self._bit = self._bit + 1
-                self._word = self._word >> 1
-                if retVal >= 0:
-                    return int(retVal)
-            self._base = self._base + cBITS
-            self._word = self._data[wordIndex + 1]
+        cdef unsigned long element
+        
+        # skip empty words
+        while self._word == 0:
+            if self._wordIndex + 1 >= self._size:
+                raise StopIteration
             self._wordIndex = self._wordIndex + 1
-            self._bit = 0
-
-        raise StopIteration
+            self._word = self._data[self._wordIndex]
+        
+        element = (self._wordIndex << cSHIFT) + bitCtz(self._word)
+        # clear lowest set bit
+        self._word = self._word & (self._word - 1)
+        
+        return int(element)
@@ -0,0 +1,181 @@
+/*
+ * Parallel Biclustering Algorithm - Fast Algorithm for finding all biclusters in a GEM
+ * Copyright (C) 2006  Luke Imhoff
+ *
+ * This program is free software; you can redistribute it and/or
+ * modify it under the terms of the GNU General Public License
+ * as published by the Free Software Foundation; either version 2
+ * of the License, or (at your option) any later version.
+ *
+ * This program is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ * GNU General Public License for more details.
+ *
+ * You should have received a copy of the GNU General Public License
+ * along with this program; if not, write to the Free Software
+ * Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+ *
+ * Contact Info:
+ *   Luke Imhoff (imho0030@umn.edu)
+ *   220 Delaware St. SE
+ *   Minneapolis, MN 55455
+ */
+/*
+ * Word loops for BitSet set algebra
+ *
+ * The loops are written so the compiler can vectorize them: no early exits
+ * inside a block and no dependence between words.  Where GCC supports it the
+ * loops are cloned for AVX2 and SSE2 and the best clone is picked at load
+ * time, so one build runs at full width on newer CPUs and still runs on older
+ * ones.  Elsewhere they are plain C, which -O3 still vectorizes for the build
+ * machine's baseline.
+ *
+ * out may be the same buffer as a or b, which is how the in-place operations
+ * are done.
+ */
+
+#ifndef BICLUSTERING_BITOPS_H
+#define BICLUSTERING_BITOPS_H
+
+#if defined(__GNUC__) && __GNUC__ >= 6 && defined(__x86_64__) && \
+    !defined(__clang__)
+#define BITOPS_CLONES __attribute__((target_clones("avx2", "sse2", "default")))
+#else
+#define BITOPS_CLONES
+#endif
+
+/* words checked between early exits of the predicate loops */
+#define BITOPS_BLOCK 16
+
+BITOPS_CLONES
+static void bitAnd(unsigned int *out, const unsigned int *a,
+                   const unsigned int *b, unsigned long size)
+{
+    unsigned long i;
+
+    for (i = 0; i < size; i++)
+        out[i] = a[i] & b[i];
+}
+
+BITOPS_CLONES
+static void bitOr(unsigned int *out, const unsigned int *a,
+                  const unsigned int *b, unsigned long size)
+{
+    unsigned long i;
+
+    for (i = 0; i < size; i++)
+        out[i] = a[i] | b[i];
+}
+
+BITOPS_CLONES
+static void bitAndNot(unsigned int *out, const unsigned int *a,
+                      const unsigned int *b, unsigned long size)
+{
+    unsigned long i;
+
+    for (i = 0; i < size; i++)
+        out[i] = a[i] & ~b[i];
+}
+
+BITOPS_CLONES
+static void bitNot(unsigned int *out, const unsigned int *a,
+                   unsigned long size)
+{
+    unsigned long i;
+
+    for (i = 0; i < size; i++)
+        out[i] = ~a[i];
+}
+
+/* Returns 1 if every bit set in a is set in b */
+BITOPS_CLONES
+static int bitIsSubset(const unsigned int *a, const unsigned int *b,
+                       unsigned long size)
+{
+    unsigned long start;
+    unsigned long stop;
+    unsigned long i;
+    unsigned int extra;
+
+    for (start = 0; start < size; start += BITOPS_BLOCK) {
+        stop = start + BITOPS_BLOCK < size ? start + BITOPS_BLOCK : size;
+
+        extra = 0;
+        for (i = start; i < stop; i++)
+            extra |= a[i] & ~b[i];
+
+        if (extra != 0)
+            return 0;
+    }
+
+    return 1;
+}
+
+/* Returns 1 if a and b have the same bits set */
+BITOPS_CLONES
+static int bitEqual(const unsigned int *a, const unsigned int *b,
+                    unsigned long size)
+{
+    unsigned long start;
+    unsigned long stop;
+    unsigned long i;
+    unsigned int difference;
+
+    for (start = 0; start < size; start += BITOPS_BLOCK) {
+        stop = start + BITOPS_BLOCK < size ? start + BITOPS_BLOCK : size;
+
+        difference = 0;
+        for (i = start; i < stop; i++)
+            difference |= a[i] ^ b[i];
+
+        if (difference != 0)
+            return 0;
+    }
+
+    return 1;
+}
+
+/* index of the lowest set bit of a non-zero word */
+#if defined(__GNUC__)
+#define bitCtz(word) __builtin_ctz(word)
+#else
+static int bitCtz(unsigned int word)
+{
+    int bit;
+
+    for (bit = 0; (word & 0x1) == 0; bit++)
+        word >>= 1;
+
+    return bit;
+}
+#endif
+
+/*
+ * Writes the index of every set bit to out in increasing order and returns
+ * the number written.  At most capacity indices are written, so out is never
+ * overrun even if capacity is less than the population count.
+ */
+static unsigned long bitIndices(long *out, const unsigned int *words,
+                                unsigned long size, unsigned long capacity)
+{
+    unsigned long count;
+    unsigned long i;
+    unsigned int word;
+
+    count = 0;
+    for (i = 0; i < size; i++) {
+        word = words[i];
+        while (word != 0) {
+            if (count == capacity)
+                return count;
+            out[count++] = (long) ((i << 5) + bitCtz(word));
+            /* clear lowest set bit */
+            word &= word - 1;
+        }
+    }
+
+    return count;
+}
+
+#endif
@@ -30,10 +30,45 @@
 # use full name for import so pylint doesn't  complain
 import numpy.core.multiarray
 
+# bits of each composite key.  Packing several narrow columns into one key
+# means lexsort() makes one pass per key instead of one per column
+KEY_BITS = 16
+
+def compositeKeys(matrix):
+    """Packs the columns of each row of a small unsigned int matrix into as few
+    KEY_BITS bit keys as possible
+    
+    Keys compare like the rows they were packed from.  Packed data from
+    GeneExpressionMatrix.packData() has few bits per column, so several
+    columns share a key and lexsort() makes fewer passes.
+    @param matrix 2D array of uint8 or uint16
+    @return list of keys, most significant first
+    """
+    rows, columns = matrix.shape
+    
+    bits = 1
+    if matrix.size != 0:
+        top = int(matrix.max())
+        while (1 << bits) <= top:
+            bits += 1
+    perKey = max(1, KEY_BITS // bits)
+    shift = numpy.uint16(bits)
+    
+    keys = list()
+    for start in xrange(0, columns, perKey):
+        key = numpy.core.multiarray.zeros(rows, dtype = numpy.uint16)
+        for column in xrange(start, min(start + perKey, columns)):
+            key <<= shift
+            key |= matrix[:, column]
+        keys.append(key)
+    
+    return keys
+
 def sortRows(matrix, columns=None):
     """Sorts rows of matrix based on columns
     
-    Should work similar to sortrows in Matlab.
+    Should work similar to sortrows in Matlab.  Packed uint8 and uint16
+    matrices are sorted on compositeKeys().
     @param matrix matrix whose rows to sort
     @type matrix 2D array
     @return (sortedMatrix, indices)
@@ -46,10 +81,15 @@ def sortRows(matrix, columns=None):
     if columns == None:
         columns = numpy.core.multiarray.arange(matrix.shape[1])
     
-    # reverse indices
-    columns = columns[::-1]
+    if matrix.dtype in (numpy.uint8, numpy.uint16):
+        # lexsort sorts by the last key first
+        lexsortable = tuple(compositeKeys(matrix[:, columns])[::-1])
+    else:
+        # reverse indices
+        columns = columns[::-1]
+        
+        lexsortable = tuple(matrix[:, columns].transpose())
     
-    lexsortable = tuple(matrix[:, columns].transpose())
     indices = numpy.core.multiarray.lexsort(lexsortable)
     
     return (matrix[indices], indices)
@@ -0,0 +1,1526 @@
+# Parallel Biclustering Algorithm - Fast Algorithm for finding all biclusters in a GEM
+# Copyright (C) 2006  Luke Imhoff
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+# Contact Info:
+#   Luke Imhoff (imho0030@umn.edu)
+#   220 Delaware St. SE
+#   Minneapolis, MN 55455
+"""Bicluster engine interface and registry
+
+An engine is a module with a Group class that stores biclusters in a
+particular layout.  Every Group provides the same interface (pool, index,
+chain, isNested, depth and flush), so GeneExpressionMatrix can pick an engine
+by name and the layouts can be benchmarked against each other on the same data.
+
+@author Luke Imhoff
+@license GPLv2
+"""
+
+import itertools
+import logging
+import numarray
+import numpy
+import os
+import tables
+import threading
+
+import Biclustering.Array
+import Biclustering.Bit
+import Biclustering.BitSet
+import Biclustering.Combinatorics
+import Biclustering.Pipeline
+import Biclustering.Sizing
+import Biclustering.Timing
+
+NESTED = tables.Enum(['nonnested', 'nested', 'unknown'])
+NESTED_ATOM = tables.EnumAtom(NESTED, dtype = 'UInt8', shape = (0,),
+                              flavor = 'numpy')
+
+# bicluster ids are stored as uint64
+ID_RANGE = 2 ** 64
+# set in the ids of full-width pattern biclusters so they never equal the id of
+# a chained bicluster
+PATTERN_ID = 1 << 63
+
+def seedId(pair, decreasing):
+    """Returns the id of a 2 condition bicluster
+    
+    @param pair index of the condition pair in xcombinations() order
+    @param decreasing True for the decreasing bicluster of the pair
+    """
+    return 2 * pair + int(decreasing)
+
+def chainId(link, head, tail, headDepth, tailDepth):
+    """Returns the id of the bicluster chained from head and tail
+    
+    Ids increase with (link, head, tail), the order serial chaining visits
+    pairs in, so rows pooled in that order are already in id order.
+    @param link condition linking chain
+    @param head index of head bicluster
+    @param tail index of tail bicluster
+    @param headDepth number of biclusters of the head width
+    @param tailDepth number of biclusters of the tail width
+    """
+    return (link * headDepth + head) * tailDepth + tail
+
+def checkChainIds(maxConditions, headDepth, tailDepth):
+    """Raises OverflowError if a chainId() of headDepth heads and tailDepth
+    tails could reach PATTERN_ID
+    
+    Ids at or past PATTERN_ID would collide with patternId() and break the
+    id order of the width, and ids past ID_RANGE can't be stored.
+    @param maxConditions number of link conditions
+    @param headDepth number of biclusters of the head width
+    @param tailDepth number of biclusters of the tail width
+    """
+    if maxConditions * headDepth * tailDepth >= PATTERN_ID:
+        raise OverflowError("%d conditions x %d heads x %d tails overflow "
+                            "the ids of chained biclusters" %
+                            (maxConditions, headDepth, tailDepth))
+
+def patternId(gene):
+    """Returns the id of a full-width pattern bicluster
+    
+    @param gene lowest gene of the pattern
+    """
+    return PATTERN_ID | gene
+
+# engine name -> module holding the engine's Group class
+ENGINES = {
+    'multiLevelIndex': 'Biclustering.GroupBicluster',
+    'singleLevelIndex': 'Biclustering.SingleLevelIndexGroupBicluster',
+    'table': 'Biclustering.TableBicluster',
+}
+DEFAULT_ENGINE = 'multiLevelIndex'
+
+def register(name, moduleName):
+    """Registers an engine
+    
+    @param name name used to select the engine
+    @param moduleName full name of module with the engine's Group class
+    """
+    ENGINES[name] = moduleName
+
+def engine(name):
+    """Returns the Group class of the engine registered as name
+    
+    Engine modules are only imported when selected.
+    @param name name of the engine
+    """
+    try:
+        moduleName = ENGINES[name]
+    except KeyError:
+        raise ValueError("Unknown bicluster engine %s.  Choose from %s" %
+                         (name, ', '.join(sorted(ENGINES))))
+    
+    module = __import__(moduleName, globals(), locals(), ['Group'])
+    
+    return module.Group
+
+class Group(object):
+    """Interface for the group node holding biclusters of all widths
+    
+    Engines implement chain() and their own WidthGroupCache.  Width groups
+    returned by the cache must have conditions, genes and nested members that
+    can be indexed by bicluster index, plus pool(), index(), flush() and
+    depth().  Engines whose chainPreCrest() can double set supportsDoubling.
+    """
+    
+    # True if chainPreCrest() can chain headWidth with headWidth biclusters
+    supportsDoubling = False
+    
+    def __init__(self, nodeFile, group, maxConditions, maxGenes, create=True,
+                 minGenes=2, shardDirectory=None):
+        """Creates Bicluster Group
+        
+        @param nodeFile file to create Group on
+        @param group group to which to attach Group
+        @param maxConditions max condition indexes in any one bicluster
+        @param maxGenes max gene indexes in any one bicluster
+        @param minGenes min genes index for a valid bicluster.  When loading,
+                        the larger of minGenes and the stored value is used
+        @param create create bilcuster Group in as child of group in file.
+                      Default = True.  If False checks for existence of group
+                      in file
+        @param shardDirectory directory, relative to nodeFile, in which to
+                              store each width group in its own file.  None to
+                              store them all in nodeFile.  Only used when
+                              creating; loading uses the stored directory
+        """
+        self.file = nodeFile
+        
+        self.maxConditions = maxConditions
+        self.maxGenes = maxGenes
+        self.minGenes = minGenes
+        
+        if create:
+            self.biclusters = self.file.createGroup(group, "biclusters")
+            self.file.setNodeAttr(self.biclusters, "minGenes",
+                                  numarray.array((self.minGenes,)))
+            if shardDirectory is not None:
+                self.file.setNodeAttr(self.biclusters, "shardDirectory",
+                                      shardDirectory)
+        else:
+            self.biclusters = self.file.getNode(group, "biclusters")
+            storedMinGenes = self.file.getNodeAttr(self.biclusters,
+                                                   "minGenes")[0]
+            # a GEM can be reopened to only grow biclusters with more genes
+            self.minGenes = max(storedMinGenes, minGenes)
+            
+            try:
+                shardDirectory = self.file.getNodeAttr(self.biclusters,
+                                                       "shardDirectory")
+            except AttributeError:
+                shardDirectory = None
+        
+        if shardDirectory is None:
+            self.shards = None
+        else:
+            fileDirectory = os.path.dirname(os.path.abspath(self.file.filename))
+            self.shards = os.path.join(fileDirectory, shardDirectory)
+        
+        self.cache = self.createCache()
+        # cached unions and bounds of evicted width groups are dropped
+        self.cache.onEvict = self.forgetWidth
+        
+        # (width, position, depth) -> linkUnions() of that width group
+        self.unions = dict()
+        # (headWidth, tailWidth) -> (headDepth, tailDepth, linkBounds())
+        self.bounds = dict()
+        
+        # scratch sets reused by the chain and prune loops
+        self.genePool = Biclustering.BitSet.BitSetPool(self.maxGenes)
+        self.conditionScratch = dict()
+        
+        # bytes of gene rows chain() may hold at once.  None to chain a pair
+        # at a time; engines that support it chain in blocked tiles otherwise
+        self.memoryLimit = None
+        
+        # held by any thread using the file while another thread may be
+        self.lock = threading.RLock()
+        
+        # Pipeline.Writer pool() hands biclusters to while started
+        self.writer = None
+        
+        # Chain Performance Monitors
+        self.widthTooBig = 0
+        self.noHeadWidth = 0
+        self.noHeadLink = 0
+        self.noTailWidth = 0
+        self.noTailLink = 0
+        self.redundantCondition = 0
+        self.insufficientGenes = 0
+        self.signatureBound = 0
+        self.linkBound = 0
+        self.headBound = 0
+    
+    def createCache(self):
+        """Returns the WidthGroupCache for this engine"""
+        raise NotImplementedError("engine must provide a WidthGroupCache")
+    
+    def scratchConditions(self, width):
+        """Returns the OrderedBitSet of width conditions used as the scratch of
+        OrderedBitSet.chain()
+        
+        Its contents are overwritten by every chain, so pool() must copy it.
+        @param width number of conditions in chained biclusters
+        """
+        if width not in self.conditionScratch:
+            orderClass = Biclustering.Sizing.sizeArray(self.maxConditions)
+            order = numpy.zeros(width, dtype = orderClass)
+            conditions = Biclustering.BitSet.BitSet(self.maxConditions)
+            self.conditionScratch[width] = \
+                Biclustering.Bit.OrderedBitSet(order, set = conditions)
+        
+        return self.conditionScratch[width]
+    
+    def pool(self, conditions, genes, id):
+        """Pool biclusters
+        
+        @param conditions condition indexes of bicluster
+        @param genes dependent indexes of the bicluster
+        @param id stable id of the bicluster from seedId(), chainId() or
+                  patternId()
+        @param returns true if biclusters valid
+        """
+        
+        if len(genes) >= self.minGenes:
+            if self.writer is not None:
+                # conditions and genes may be scratch sets reused by the caller
+                order = conditions.order.copy()
+                conditions = Biclustering.Bit.OrderedBitSet(
+                    order, set = conditions.set.copy())
+                self.writer.put((conditions, genes.copy(), id))
+            else:
+                self.poolBatch(((conditions, genes, id),))
+            return True
+        
+        return False
+    
+    def poolBatch(self, biclusters):
+        """Appends biclusters to their width groups
+        
+        @param biclusters sequence of (conditions, genes, id) of valid
+                          biclusters
+        """
+        self.lock.acquire()
+        try:
+            for conditions, genes, id in biclusters:
+                self.cache[len(conditions)].pool(conditions, genes, id)
+        finally:
+            self.lock.release()
+    
+    def extend(self, orders, genes, ids):
+        """Appends biclusters of one width given as arrays
+        
+        @param orders (biclusters, width) array of condition orders
+        @param genes 2D array with the BitSet words of each bicluster's genes
+        @param ids id of each bicluster
+        """
+        if len(orders) == 0:
+            return
+        
+        orders = numpy.asarray(orders)
+        width = orders.shape[1]
+        orderClass = Biclustering.Sizing.sizeArray(self.maxConditions)
+        
+        members = numpy.zeros((orders.shape[0], self.maxConditions),
+                              dtype = bool)
+        for position in xrange(width):
+            members[numpy.arange(orders.shape[0]), orders[:, position]] = True
+        
+        self.lock.acquire()
+        try:
+            self.cache[width].extend(orders.astype(orderClass),
+                                     Biclustering.Bit.packBits(members),
+                                     numpy.asarray(genes,
+                                                   dtype = numpy.uint32),
+                                     ids)
+        finally:
+            self.lock.release()
+    
+    def canonicalize(self, width):
+        """Puts biclusters of width conditions in increasing id order
+        
+        Rows pooled out of order, such as by tiles, threads or processes, are
+        reordered so every mode stores the same rows in the same order.
+        @param width width of biclusters
+        @return True if rows were reordered
+        """
+        if width not in self.cache:
+            return False
+        
+        self.flush()
+        
+        self.lock.acquire()
+        try:
+            reordered = self.cache[width].canonicalize()
+        finally:
+            self.lock.release()
+        
+        if reordered:
+            self.forgetWidth(width)
+            self.flush()
+        
+        return reordered
+    
+    def startWriter(self, depth=Biclustering.Pipeline.WRITE_DEPTH,
+                    batch=Biclustering.Pipeline.WRITE_BATCH):
+        """Appends pooled biclusters on a background thread until
+        stopWriter()
+        
+        The writer thread holds the lock while appending, so whatever else
+        uses the file in the meantime must hold it too.
+        @param depth max batches of biclusters waiting to be appended
+        @param batch biclusters per batch
+        """
+        self.writer = Biclustering.Pipeline.Writer(self.poolBatch, depth,
+                                                   batch)
+    
+    def stopWriter(self):
+        """Appends all biclusters pooled on the writer and stops it"""
+        writer = self.writer
+        self.writer = None
+        
+        writer.close()
+    
+    def index(self, width):
+        """Indexes biclusters of width conditions for chain()
+        
+        @param width width of biclusters to index
+        """
+        if width not in self.cache:
+            return
+        
+        self.cache[width].index()
+    
+    def chain(self, width, link):
+        """Chains biclusters of width conditions with seed biclusters
+        
+        @param width number of conditions in chained biclusters
+        @param link condition linking chain
+        @return number of valid biclusters of width + 1 conditions chained
+        """
+        raise NotImplementedError("engine must implement chain")
+    
+    def chainPreCrest(self, headWidth, link, doubling=False):
+        """Chains biclusters of headWidth with biclusters of 2 or, if
+        doubling, headWidth conditions
+        
+        Engines without doubling support only grow chains by 1 condition.
+        @param headWidth number of conditions in first bicluster
+        @param link condition linking chain
+        @param doubling True to chain headWidth with headWidth biclusters
+        @return number of valid biclusters chained
+        """
+        if doubling and headWidth != 2:
+            raise NotImplementedError("engine does not support doubling")
+        
+        return self.chain(headWidth, link)
+    
+    def chainStats(self, reset=False):
+        """Prints performance stats for chain
+        
+        @param reset [False] True to reset stats to 0.
+        """
+        logging.debug("No Head Width: %s", self.noHeadWidth)
+        logging.debug("No Head Link: %s", self.noHeadLink)
+        logging.debug("No Tail Link: %s", self.noTailLink)
+        logging.debug("Redundant Condition: %s", self.redundantCondition)
+        logging.debug("Insufficient Genes: %s", self.insufficientGenes)
+        logging.debug("Signature Bound: %s", self.signatureBound)
+        logging.debug("Link Bound: %s", self.linkBound)
+        logging.debug("Head Bound: %s", self.headBound)
+        
+        if reset:
+            self.noHeadWidth = 0
+            self.noHeadLink = 0
+            self.noTailLink = 0
+            self.redundantCondition = 0
+            self.insufficientGenes = 0
+            self.signatureBound = 0
+            self.linkBound = 0
+            self.headBound = 0
+    
+    def isNested(self, width, index):
+        """Marks the bicluster at index of width conditions if it is nested in another bicluster
+        
+        A Bicluster is considered nested if its genes are a subset of the
+        enclosing Bicluster's genes and the Bicluster's conditions are an
+        ordered subset of the enclosing Biclusters conditions.
+        @param bicluster Bicluster to test for nested-ness
+        @return True if bicluster is nested; False otherwise.
+        """
+        
+        if width not in self.cache:
+            return False
+        innerGroup = self.cache[width]
+        
+        state = self.nestedState(width, index)
+        if innerGroup.nested[index] != state:
+            innerGroup.nested[index] = state
+        
+        return state == NESTED.nested
+    
+    def nestedState(self, width, index):
+        """Returns the NESTED state of the bicluster at index of width
+        conditions without marking it
+        
+        Only reads the width group and the next wider one, so it is safe to
+        call from a process holding a read-only handle.
+        @param width number of conditions in bicluster
+        @param index index of bicluster in width group
+        @return NESTED.nested or NESTED.nonnested
+        """
+        
+        innerGroup = self.cache[width]
+        
+        # if already marked
+        state = innerGroup.nested[index]
+        if state != NESTED.unknown:
+            return state
+        
+        outerWidth = self.nextWidth(width)
+        if outerWidth is None:
+            return NESTED.nonnested
+        outerGroup = self.cache[outerWidth]
+        
+        genes = innerGroup.genes[index]
+        conditions = innerGroup.conditions[index]
+        
+        # only outer biclusters whose order contains the inner order can
+        # enclose it
+        candidates = \
+            outerGroup.orderIndex().containsSubsequence(conditions.order)
+        
+        # every outer bicluster's genes are read into the same scratch set
+        outerGenes = self.genePool.acquire()
+        try:
+            for outer in candidates.tolist():
+                # if nested genes are a subset
+                if genes.issubset(outerGroup.genes.readInto(outer,
+                                                            outerGenes)):
+                    # nested-ness is a short-circuited 'or' attribute, so as
+                    # so soon as one enclosing bicluster is found function can
+                    # exit
+                    return NESTED.nested
+        finally:
+            self.genePool.release(outerGenes)
+        
+        # bicluster can only be marked as nonnested after all possible
+        # enclosing biclusters are checked
+        return NESTED.nonnested
+    
+    def nestedFlags(self, width, start, stop):
+        """Returns the NESTED state of biclusters [start, stop) of width
+        conditions without marking them
+        
+        @param width number of conditions in biclusters
+        @param start index of first bicluster
+        @param stop index after last bicluster
+        @return array of NESTED values
+        """
+        
+        flags = numpy.empty(stop - start, dtype = numpy.uint8)
+        for index in xrange(start, stop):
+            flags[index - start] = self.nestedState(width, index)
+        
+        return flags
+    
+    def markNested(self, width, start, flags):
+        """Marks biclusters of width conditions starting at start with flags in
+        one bulk write
+        
+        @param width number of conditions in biclusters
+        @param start index of first bicluster to mark
+        @param flags array of NESTED values as returned by nestedFlags()
+        """
+        
+        if width not in self.cache:
+            return
+        
+        self.cache[width].nested[start:start + flags.size] = flags
+    
+    def depth(self, width, includeNested=True):
+        """Returns number of biclusters of width conditions
+        
+        @param width number of conditions in biclusters
+        @param includeNested True to include all biclusters; False to only
+               include biclusters not marked as nested
+        """
+        if width not in self.cache:
+            return 0
+        
+        return self.cache[width].depth(includeNested)
+    
+    def checkChainIds(self, headWidth, tailWidth):
+        """Raises OverflowError if chaining headWidth with tailWidth
+        biclusters could overflow chainId()
+        
+        @param headWidth number of conditions in head biclusters
+        @param tailWidth number of conditions in tail biclusters
+        """
+        checkChainIds(self.maxConditions, self.depth(headWidth),
+                      self.depth(tailWidth))
+    
+    def pairCount(self, headWidth, tailWidth):
+        """Returns number of head and tail pairs sharing a link condition
+        
+        Estimates the gene intersections needed to chain headWidth with
+        tailWidth biclusters from the per-link cardinalities of the heads and
+        tails.  Pairs with redundant conditions are counted too.
+        @param headWidth number of conditions in head biclusters
+        @param tailWidth number of conditions in tail biclusters
+        """
+        if headWidth not in self.cache or tailWidth not in self.cache:
+            return 0
+        
+        heads = self.cache[headWidth].linkCounts(-1)
+        tails = self.cache[tailWidth].linkCounts(0)
+        
+        return int(numpy.dot(heads, tails))
+    
+    def linkUnions(self, width, position):
+        """Returns linkUnions(position) of the width group, cached until the
+        group grows
+        
+        @param width number of conditions in biclusters
+        @param position position in condition order (0 for tails, -1 for heads)
+        """
+        widthGroup = self.cache[width]
+        key = (width, position, widthGroup.depth())
+        
+        if key not in self.unions:
+            for staleKey in [k for k in self.unions if k[:2] == key[:2]]:
+                del self.unions[staleKey]
+            self.unions[key] = widthGroup.linkUnions(position)
+        
+        return self.unions[key]
+    
+    def linkBounds(self, headWidth, tailWidth):
+        """Returns an upper bound on the genes of any chain across each link
+        
+        Every chain of a head and tail on a link has its genes in both the
+        union of the genes of the heads ending at the link and the union of the
+        genes of the tails starting at it.  Links whose bound is below minGenes
+        cannot yield a bicluster and need not be enumerated.
+        @param headWidth number of conditions in head biclusters
+        @param tailWidth number of conditions in tail biclusters
+        @return array of maxConditions bounds
+        """
+        if headWidth not in self.cache or tailWidth not in self.cache:
+            return numpy.zeros(self.maxConditions, dtype = numpy.int64)
+        
+        # chain loops ask once per link, so the bounds of every link are
+        # kept until either width group grows
+        key = (headWidth, tailWidth)
+        depths = (self.cache[headWidth].depth(), self.cache[tailWidth].depth())
+        if key in self.bounds and self.bounds[key][:2] == depths:
+            return self.bounds[key][2]
+        
+        heads = self.linkUnions(headWidth, -1)
+        tails = self.linkUnions(tailWidth, 0)
+        
+        bounds = Biclustering.Bit.popCounts(heads & tails)
+        self.bounds[key] = depths + (bounds,)
+        
+        return bounds
+    
+    def forgetWidth(self, width):
+        """Drops the cached linkUnions() and linkBounds() of width
+        
+        @param width number of conditions of an evicted or changed width group
+        """
+        for key in [key for key in self.unions if key[0] == width]:
+            del self.unions[key]
+        for key in [key for key in self.bounds if width in key]:
+            del self.bounds[key]
+    
+    def frontier(self, width):
+        """Returns linkBounds() for chain(width, link)
+        
+        @param width number of conditions in chained biclusters
+        """
+        return self.linkBounds(width, 2)
+    
+    def chainPairCount(self, width):
+        """Returns pairCount() for chain(width, link) over every link
+        
+        @param width number of conditions in chained biclusters
+        """
+        return self.pairCount(width, 2)
+    
+    def indexQueries(self):
+        """Builds the query indexes of every width group"""
+        for width in xrange(2, self.maxConditions + 1):
+            if width in self.cache:
+                self.cache[width].indexQueries()
+        
+        self.flush()
+    
+    def query(self, genes=(), conditions=(), width=None, includeNested=True):
+        """Returns biclusters containing all genes and conditions
+        
+        Each width is answered by intersecting the BitSets of the query
+        indexes, so indexQueries() must be called after the last bicluster is
+        pooled.
+        @param genes gene indexes
+        @param conditions condition indexes
+        @param width only search biclusters of width conditions.  Defaults to
+               all widths
+        @param includeNested True to include biclusters marked as nested
+        @return dict of width -> array of bicluster indexes
+        """
+        if width is None:
+            widths = xrange(2, self.maxConditions + 1)
+        else:
+            widths = (width,)
+        
+        matches = dict()
+        for width in widths:
+            if width not in self.cache:
+                continue
+            
+            indexes = self.cache[width].query(genes, conditions,
+                                              includeNested)
+            if indexes.size != 0:
+                matches[width] = indexes
+        
+        return matches
+    
+    def nextWidth(self, width):
+        """Returns smallest width greater than width with a width group
+        
+        Doubling skips widths, so biclusters may be enclosed by biclusters more
+        than 1 condition wider.
+        @param width number of conditions
+        @return next width or None if there are no wider biclusters
+        """
+        for outerWidth in xrange(width + 1, self.maxConditions + 1):
+            if outerWidth in self.cache:
+                return outerWidth
+        
+        return None
+    
+    def flush(self):
+        """Writes back in-memory state of cached width groups and flushes the
+        file
+        
+        Biclusters pooled on a started writer are appended first.
+        """
+        # waits for the writer thread, which needs the lock
+        if self.writer is not None:
+            self.writer.flush()
+        
+        self.lock.acquire()
+        try:
+            self.cache.flush()
+            self.file.flush()
+        finally:
+            self.lock.release()
+    
+    def __str__(self):
+        rows = list()
+        
+        first = True
+        for width in xrange(2, self.maxConditions + 1):
+            if width not in self.cache:
+                break
+            
+            if first:
+                first = False
+            else:
+                rows.append("\n")
+            rows.append(str(self.cache[width]))
+        
+        return ''.join(rows)
+
+class WidthGroupCache(object):
+    
+    SLOTS = 3
+    
+    def __init__(self, file, parent, maxConditions, maxGenes, shards=None):
+        """Creates a WidthGroup cache with SLOTS slots
+        
+        Cache is fully associative
+        @param maxConditions maxConditions in biclusters in width groups held in cache
+        @param shards directory with one file per width group.  None to keep
+                      width groups under parent
+        """
+        self.file = file
+        self.parent = parent
+        self.maxConditions = maxConditions
+        self.maxGenes = maxGenes
+        
+        self.shards = shards
+        # width -> open shard file.  Shards stay open as evicted groups may
+        # still be referenced
+        self.shardFiles = dict()
+        if (shards is not None and self.file.mode != "r" and
+            not os.path.isdir(shards)):
+            os.makedirs(shards)
+        
+        widthClass = Biclustering.Sizing.sizeArray(self.maxConditions)
+        self.widths = numpy.zeros(self.SLOTS,
+                                  dtype = widthClass)
+        self.groups = numpy.empty(self.SLOTS, dtype = object)
+        ageClass = Biclustering.Sizing.sizeArray(self.SLOTS)
+        self.ages = numpy.arange(self.SLOTS, dtype = ageClass)
+        
+        # called with the width of each evicted group
+        self.onEvict = None
+    
+    def widthGroup(self, width):
+        """Returns new width group of width conditions for this engine
+        
+        @param width number of conditions in biclusters of group
+        """
+        raise NotImplementedError("engine must provide width groups")
+    
+    def shardName(self, width):
+        """Returns name of the file holding the width group of width"""
+        return os.path.join(self.shards, widthGroupName(width) + ".h5")
+    
+    def location(self, width):
+        """Returns (file, parent) holding the width group of width
+        
+        @param width number of conditions in biclusters of group
+        """
+        if self.shards is None:
+            return (self.file, self.parent)
+        
+        if width not in self.shardFiles:
+            if self.file.mode == "r":
+                mode = "r"
+            else:
+                mode = "a"
+            
+            shardName = self.shardName(width)
+            self.shardFiles[width] = tables.openFile(shardName, mode = mode,
+                                                     filters = self.file.filters)
+            self.link(width)
+        
+        shardFile = self.shardFiles[width]
+        return (shardFile, shardFile.root)
+    
+    def link(self, width):
+        """Links the width group of width into parent if pytables supports
+        external links, so tools browsing the main file find it"""
+        name = widthGroupName(width)
+        if (self.file.mode == "r" or name in self.parent or
+            not hasattr(self.file, "createExternalLink")):
+            return
+        
+        fileDirectory = os.path.dirname(os.path.abspath(self.file.filename))
+        target = os.path.relpath(self.shardName(width), fileDirectory)
+        self.file.createExternalLink(self.parent, name,
+                                     "%s:/%s" % (target, name))
+    
+    def __contains__(self, width):
+        if self.shards is not None:
+            return os.path.exists(self.shardName(width))
+        
+        return widthGroupName(width) in self.parent
+    
+    def updateAges(self, slot):
+        if self.ages[slot] != 0:
+            agedSlots = numpy.where(self.ages < self.ages[slot])
+            self.ages[agedSlots] += 1
+            self.ages[slot] = 0
+    
+    def __getitem__(self, width):
+        slots = numpy.where(self.widths == width)[0]
+        # if single slot returned
+        if slots.size == 1:
+            slot = int(slots[0])
+            group = self.groups[slot]
+            
+            self.updateAges(slot)
+        else:
+            slot = int(numpy.where(self.ages == self.SLOTS - 1)[0][0])
+            
+            # evicted group's in-memory state would be lost otherwise
+            if self.groups[slot] is not None:
+                self.groups[slot].flush()
+                
+                if self.onEvict is not None:
+                    self.onEvict(int(self.widths[slot]))
+            
+            group = self.widthGroup(width)
+            
+            self.groups[slot] = group
+            self.widths[slot] = width
+            
+            self.updateAges(slot)
+        
+        return group
+    
+    def flush(self):
+        """Writes back in-memory state of all cached groups"""
+        for group in self.groups:
+            if group is not None:
+                group.flush()
+        
+        for shardFile in self.shardFiles.values():
+            shardFile.flush()
+
+def widthGroupName(width):
+    return "width" + str(width)
+
+class WidthGroup(object):
+    """Width group storing conditions, genes and nested state in separate
+    arrays"""
+    
+    # nodes of the indexes of the group, removed by dropIndexes()
+    INDEX_NODES = ("orderIndex", "geneIndex", "geneIndexCounts",
+                   "conditionIndex", "conditionIndexCounts")
+    
+    def __init__(self, file, parent, maxConditions, maxGenes, width):
+        """Returns group for storing bicluster of width conditions."""
+        self.file = file
+        self.maxConditions = maxConditions
+        self.maxGenes = maxGenes
+        self.width = width
+        
+        name = widthGroupName(width)
+        try:
+            self.group = file.getNode(parent, name)
+        except tables.NoSuchNodeError:
+            self.group = file.createGroup(parent, name)
+        
+        self.conditions = Biclustering.Bit.OrderedSetArray(file, self.group,
+                                                           "conditions", width,
+                                                           maxConditions)
+        # signatures let chaining reject pairs without reading their genes
+        self.genes = Biclustering.Bit.SetArray(file, self.group, "genes",
+                                               maxGenes, True)
+        
+        self.nested = NestedColumn(file, self.group, "nested")
+        self.ids = IdColumn(file, self.group, "ids", len(self.nested))
+        
+        # OrderIndex, built on first use
+        self.sortedOrders = None
+    
+    def pool(self, conditions, genes, id):
+        self.conditions.append(conditions)
+        self.genes.append(genes)
+        self.nested.append(NESTED.unknown)
+        self.ids.append(id)
+    
+    def extend(self, orders, conditions, genes, ids):
+        """Appends biclusters given as arrays
+        
+        @param orders (biclusters, width) array of condition orders
+        @param conditions 2D array with the BitSet words of each order's set
+        @param genes 2D array with the BitSet words of each bicluster's genes
+        @param ids id of each bicluster
+        """
+        self.conditions.extend(orders, conditions)
+        self.genes.extend(genes)
+        self.nested.extend(len(orders), NESTED.unknown)
+        self.ids.extend(ids)
+    
+    def orders(self):
+        """Returns the condition order of every bicluster as a 2D array"""
+        return self.conditions.orders[:]
+    
+    def orderIndex(self):
+        """Returns the OrderIndex of the group, rebuilt when the group grows"""
+        if (self.sortedOrders is None or
+            len(self.sortedOrders.orders) != self.depth()):
+            self.sortedOrders = OrderIndex(self)
+        
+        return self.sortedOrders
+    
+    def dropIndexes(self):
+        """Discards every index of the group after its rows are reordered
+        
+        Indexes hold bicluster indexes, which no longer name the same
+        biclusters, so every node in INDEX_NODES is removed and the cached
+        indexes are cleared.  They are rebuilt by the next index(),
+        orderIndex() or indexQueries().
+        """
+        for name in self.INDEX_NODES:
+            if name in self.group:
+                self.file.removeNode(self.group, name, recursive = True)
+        
+        self.sortedOrders = None
+        self.geneIndex = None
+        self.conditionIndex = None
+    
+    def canonicalOrder(self):
+        """Returns the order that puts rows in increasing id order, or None if
+        they already are"""
+        ids = self.ids.read()
+        if numpy.all(ids[1:] >= ids[:-1]):
+            return None
+        
+        return numpy.argsort(ids, kind = 'mergesort')
+    
+    def canonicalize(self):
+        """Rewrites every array of the group in increasing id order
+        
+        Indexes of the group are not reordered, so they are dropped and must
+        be rebuilt.
+        @return True if rows were reordered
+        """
+        order = self.canonicalOrder()
+        if order is None:
+            return False
+        
+        self.conditions.permute(order)
+        self.genes.permute(order)
+        self.nested.permute(order)
+        self.ids.permute(order)
+        self.dropIndexes()
+        
+        return True
+    
+    def index(self):
+        raise NotImplementedError("engine must implement index")
+    
+    def conditionSets(self):
+        """Returns the condition BitSets as an array with block() and len()"""
+        return self.conditions.sets
+    
+    def indexQueries(self):
+        """Builds the inverted indexes used by queryIndex()
+        
+        geneIndex has one BitSet of bicluster indexes per gene and
+        conditionIndex one per condition.  Both are rebuilt from scratch, so
+        they cover every bicluster pooled so far.
+        """
+        for name in ("geneIndex", "conditionIndex"):
+            for node in (name, name + "Counts"):
+                if node in self.group:
+                    self.file.removeNode(self.group, node)
+        
+        self.geneIndex = None
+        self.conditionIndex = None
+        
+        depth = self.depth()
+        if depth == 0:
+            return
+        
+        self.geneIndex = Biclustering.Bit.SetArray(self.file, self.group,
+                                                   "geneIndex", depth)
+        Biclustering.Bit.transposeInto(self.genes, self.maxGenes,
+                                       self.geneIndex)
+        
+        self.conditionIndex = Biclustering.Bit.SetArray(self.file, self.group,
+                                                        "conditionIndex", depth)
+        Biclustering.Bit.transposeInto(self.conditionSets(),
+                                       self.maxConditions, self.conditionIndex)
+    
+    def queryIndex(self):
+        """Returns (geneIndex, conditionIndex) built by indexQueries()
+        
+        @return None if indexQueries() has not been called since the last
+                pool()
+        """
+        if getattr(self, "geneIndex", None) is None:
+            if "geneIndex" not in self.group:
+                return None
+            
+            self.geneIndex = Biclustering.Bit.SetArray(self.file, self.group,
+                                                       "geneIndex")
+            self.conditionIndex = Biclustering.Bit.SetArray(self.file,
+                                                            self.group,
+                                                            "conditionIndex")
+        
+        # biclusters pooled since the indexes were built would be missed
+        if self.geneIndex.universe != self.depth():
+            return None
+        
+        return (self.geneIndex, self.conditionIndex)
+    
+    def query(self, genes, conditions, includeNested=True):
+        """Returns indexes of biclusters containing all genes and conditions
+        
+        @param genes gene indexes
+        @param conditions condition indexes
+        @param includeNested True to include biclusters marked as nested
+        @return array of bicluster indexes
+        """
+        if self.depth() == 0 or len(conditions) > self.width:
+            return numpy.zeros(0, dtype = numpy.int_)
+        
+        queryIndex = self.queryIndex()
+        if queryIndex is None:
+            raise ValueError("width %d has no query index.  "
+                             "Call indexQueries() first" % self.width)
+        geneIndex, conditionIndex = queryIndex
+        
+        found = None
+        for index, members in ((geneIndex, genes),
+                               (conditionIndex, conditions)):
+            for member in members:
+                # BUG FIX pytables doesn't understand numpy integer types
+                member = int(member)
+                
+                if found is None:
+                    found = index[member]
+                else:
+                    found &= index[member]
+        
+        if found is None:
+            indexes = numpy.arange(self.depth())
+        else:
+            indexes = found.toIndices()
+        
+        if not includeNested:
+            indexes = indexes[self.nested[indexes] != NESTED.nested]
+        
+        return indexes
+    
+    def flush(self):
+        """Writes back in-memory nested state"""
+        self.nested.flush()
+    
+    def __str__(self):
+        rows = list()
+        first = True
+        for conditions, genes in itertools.izip(self.conditions, self.genes):
+            if first:
+                first = False
+            else:
+                rows.append("\n")
+            
+            rows.append("Conditions: %s Genes: %s" % (conditions, genes))
+        
+        return ''.join(rows)
+    
+    def duplicateSearch(self):
+        combinations = Biclustering.Combinatorics.xcombinations(self.depth(), 2)
+        
+        progressBar = \
+            Biclustering.Timing.ProgressBar(combinations.len(),
+                                                "Duplicate Search")
+        
+        for indexes in combinations:
+            progressBar.update()
+            
+            # BUG FIX numpy ints
+            index0 = int(indexes[0])
+            index1 = int(indexes[1])
+            
+            if self.conditions[index0] != self.conditions[index1]:
+                continue
+            
+            if self.genes[index0] != self.genes[index1]:
+                logging.debug("%s and %s have same conditions", indexes[0], indexes[1])
+            else:
+                logging.debug("%s == %s", indexes[0], indexes[1])
+        
+        progressBar.finish()
+    
+    def depth(self, includeNested=True):
+        """Returns number of biclusters of width conditions
+        
+        @param width number of conditions in biclusters
+        @param includeNested True to include all biclusters; False to only
+               include biclusters not marked as nested
+        """
+        
+        if includeNested:
+            count = len(self.nested)
+        else:
+            count = len(self.nested) - self.nested.count(NESTED.nested)
+        
+        return count
+    
+    def linkCounts(self, position):
+        """Returns number of biclusters with each condition at position
+        
+        @param position position in condition order (0 for tails, -1 for heads)
+        @return float array of maxConditions counts
+        """
+        counts = numpy.zeros(self.maxConditions, dtype = numpy.float64)
+        if self.depth() == 0:
+            return counts
+        
+        found = numpy.bincount(self.conditions.positions(position))
+        counts[:found.size] = found
+        
+        return counts
+    
+    def linkUnions(self, position):
+        """Returns union of the genes of the biclusters with each condition at
+        position
+        
+        @param position position in condition order (0 for tails, -1 for heads)
+        @return (maxConditions, words) array with one BitSet formatted union
+                per condition
+        """
+        words = Biclustering.BitSet.arraySize(self.maxGenes)
+        unions = numpy.zeros((self.maxConditions, words), dtype = numpy.uint32)
+        
+        depth = self.depth()
+        if depth == 0:
+            return unions
+        
+        positions = self.conditions.positions(position)
+        for start in xrange(0, depth, Biclustering.Bit.BLOCK_ROWS):
+            stop = min(start + Biclustering.Bit.BLOCK_ROWS, depth)
+            
+            blockPositions = positions[start:stop]
+            order = numpy.argsort(blockPositions, kind = 'mergesort')
+            sortedPositions = blockPositions[order]
+            
+            # first row of each run of equal conditions
+            starts = numpy.concatenate(([0], numpy.where(
+                sortedPositions[1:] != sortedPositions[:-1])[0] + 1))
+            
+            block = self.genes.block(start, stop)[order]
+            unions[sortedPositions[starts]] |= \
+                numpy.bitwise_or.reduceat(block, starts, axis = 0)
+        
+        return unions
+
+class NestedColumn(object):
+    """Nested state of a width group held in memory
+    
+    The nested EArray is read once into a uint8 array.  Element reads and
+    writes only touch that array; the range of rows changed since the last
+    flush() is tracked and written back to the EArray in one slice assignment
+    along with any rows appended since.  Counts of each NESTED value are kept
+    up to date on every write so depth() never has to scan the column.
+    """
+    
+    def __init__(self, nodeFile, group, name):
+        """Loads or creates nested EArray name in group
+        
+        @param nodeFile file group is in
+        @param group group holding the EArray
+        @param name name of the EArray
+        """
+        try:
+            self.array = getattr(group, name)
+        except (tables.NoSuchNodeError, AttributeError):
+            self.array = nodeFile.createEArray(group, name, NESTED_ATOM)
+        
+        self.load(self.array[:])
+    
+    def load(self, flags):
+        """Replaces in-memory state with flags read from storage
+        
+        @param flags NESTED values of every stored row
+        """
+        self.flags = numpy.asarray(flags, dtype = numpy.uint8)
+        self.size = self.flags.size
+        
+        self.counts = numpy.zeros(len(NESTED), dtype = numpy.int64)
+        for flagName, flag in NESTED:
+            self.counts[flag] = numpy.sum(self.flags == flag)
+        
+        # [dirtyStart, dirtyStop) of rows already in array that have changed
+        self.dirtyStart = self.size
+        self.dirtyStop = 0
+    
+    def __len__(self):
+        return self.size
+    
+    def __getitem__(self, index):
+        return self.flags[:self.size][index]
+    
+    def __setitem__(self, index, value):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(self.size)
+            if step != 1:
+                raise IndexError("only contiguous slices are supported")
+        else:
+            start = int(index)
+            if start < 0:
+                start += self.size
+            if not 0 <= start < self.size:
+                raise IndexError("nested index out of range")
+            stop = start + 1
+        
+        if start >= stop:
+            return
+        
+        old = self.flags[start:stop]
+        for flagName, flag in NESTED:
+            self.counts[flag] -= numpy.sum(old == flag)
+        
+        self.flags[start:stop] = value
+        
+        new = self.flags[start:stop]
+        for flagName, flag in NESTED:
+            self.counts[flag] += numpy.sum(new == flag)
+        
+        self.dirtyStart = min(self.dirtyStart, start)
+        self.dirtyStop = max(self.dirtyStop, stop)
+    
+    def append(self, value):
+        """Appends a single NESTED value
+        
+        @param value NESTED value
+        """
+        if self.size == self.flags.size:
+            # grow geometrically so appends are amortized constant time
+            grown = numpy.empty(max(16, 2 * self.flags.size),
+                                dtype = numpy.uint8)
+            grown[:self.size] = self.flags[:self.size]
+            self.flags = grown
+        
+        self.flags[self.size] = value
+        self.counts[value] += 1
+        self.size += 1
+    
+    def extend(self, count, value):
+        """Appends count rows of the same NESTED value
+        
+        @param count number of rows
+        @param value NESTED value
+        """
+        if self.size + count > self.flags.size:
+            grown = numpy.empty(max(16, 2 * self.flags.size,
+                                    self.size + count),
+                                dtype = numpy.uint8)
+            grown[:self.size] = self.flags[:self.size]
+            self.flags = grown
+        
+        self.flags[self.size:self.size + count] = value
+        self.counts[value] += count
+        self.size += count
+    
+    def permute(self, order):
+        """Reorders the rows so row i is old row order[i]
+        
+        @param order permutation of the rows
+        """
+        self.flush()
+        
+        self.array = Biclustering.Bit.permuteRows(self.array, order)
+        self.load(self.flags[:self.size][order])
+    
+    def count(self, value):
+        """Returns number of rows with NESTED value
+        
+        @param value NESTED value
+        """
+        return int(self.counts[value])
+    
+    def rows(self):
+        """Returns number of rows in storage"""
+        return self.array.nrows
+    
+    def flush(self):
+        """Writes changed and appended rows back to the EArray"""
+        nrows = self.rows()
+        
+        stop = min(self.dirtyStop, nrows)
+        if self.dirtyStart < stop:
+            self.array[self.dirtyStart:stop] = self.flags[self.dirtyStart:stop]
+        
+        if nrows < self.size:
+            self.array.append(self.flags[nrows:self.size])
+        
+        self.dirtyStart = self.size
+        self.dirtyStop = 0
+
+class IdColumn(object):
+    """Stable 64-bit id of every bicluster of a width group
+    
+    Ids are derived from how a bicluster was found, not from where it was
+    stored, so runs that store biclusters in different orders give them the
+    same ids.  Rows stored before ids were are given their row index.
+    """
+    
+    def __init__(self, nodeFile, group, name, rows):
+        """Loads or creates ids EArray name in group
+        
+        @param nodeFile file group is in
+        @param group group holding the EArray
+        @param name name of the EArray
+        @param rows number of biclusters already in group
+        """
+        try:
+            self.array = getattr(group, name)
+        except (tables.NoSuchNodeError, AttributeError):
+            if nodeFile.mode == "r":
+                self.array = numpy.arange(rows, dtype = numpy.uint64)
+            else:
+                atomClass = Biclustering.Sizing.sizeAtom(ID_RANGE)
+                atom = atomClass(shape = (0,), flavor = 'numpy')
+                self.array = nodeFile.createEArray(group, name, atom)
+                
+                if rows != 0:
+                    self.array.append(numpy.arange(rows, dtype = numpy.uint64))
+    
+    def __len__(self):
+        return len(self.array)
+    
+    def __getitem__(self, index):
+        return self.array[index]
+    
+    def append(self, id):
+        """Appends a single id
+        
+        @param id id of the bicluster
+        """
+        self.array.append(numpy.array((id,), dtype = numpy.uint64))
+    
+    def extend(self, ids):
+        """Appends ids
+        
+        @param ids ids of the biclusters
+        """
+        if len(ids) != 0:
+            self.array.append(numpy.asarray(ids, dtype = numpy.uint64))
+    
+    def read(self):
+        """Returns all ids"""
+        return self.array[:]
+    
+    def permute(self, order):
+        """Reorders the ids so row i is old row order[i]
+        
+        @param order permutation of the rows
+        """
+        self.array = Biclustering.Bit.permuteRows(self.array, order)
+
+def sortedRange(rows, key):
+    """Returns the range of lexicographically sorted rows that start with key
+    
+    @param rows 2D array of sorted rows
+    @param key sequence no longer than a row
+    @return (start, stop) of the matching rows
+    """
+    key = tuple(key)
+    length = len(key)
+    
+    start = 0
+    stop = rows.shape[0]
+    if length == 0:
+        return (start, stop)
+    
+    # first row not less than key
+    low = start
+    high = stop
+    while low < high:
+        middle = (low + high) // 2
+        if tuple(rows[middle, :length].tolist()) < key:
+            low = middle + 1
+        else:
+            high = middle
+    start = low
+    
+    # first row greater than key
+    high = stop
+    while low < high:
+        middle = (low + high) // 2
+        if tuple(rows[middle, :length].tolist()) <= key:
+            low = middle + 1
+        else:
+            high = middle
+    
+    return (start, low)
+
+class OrderIndex(object):
+    """Biclusters of a width group sorted by condition order from the front and
+    from the back
+    
+    The permutations that sort the rows by order and by reversed order are
+    stored as the prefix and suffix EArrays of the orderIndex group of the
+    width group.  Orders starting with a prefix are a range of the first and
+    orders ending with a suffix a range of the second, so both are found by
+    binary search in time proportional to the matches.
+    """
+    
+    def __init__(self, widthGroup):
+        """Loads or builds the index of widthGroup
+        
+        Stored permutations of fewer rows than the group are rebuilt.  On a
+        read-only file they are only built in memory.
+        @param widthGroup width group to index
+        """
+        nodeFile = widthGroup.file
+        
+        self.orders = numpy.asarray(widthGroup.orders())
+        depth = self.orders.shape[0]
+        
+        try:
+            group = nodeFile.getNode(widthGroup.group, "orderIndex")
+            stale = group.prefix.nrows != depth
+        except tables.NoSuchNodeError:
+            group = None
+            stale = True
+        
+        if not stale:
+            self.prefix = group.prefix[:].astype(numpy.int64)
+            self.suffix = group.suffix[:].astype(numpy.int64)
+        elif depth == 0:
+            self.prefix = numpy.zeros(0, dtype = numpy.int64)
+            self.suffix = numpy.zeros(0, dtype = numpy.int64)
+        else:
+            self.prefix = Biclustering.Array.sortRows(self.orders)[1]
+            self.suffix = Biclustering.Array.sortRows(self.orders[:, ::-1])[1]
+            
+            if nodeFile.mode != "r":
+                if group is not None:
+                    nodeFile.removeNode(group, recursive = True)
+                group = nodeFile.createGroup(widthGroup.group, "orderIndex")
+                
+                atomClass = Biclustering.Sizing.sizeAtom(depth)
+                indexClass = Biclustering.Sizing.sizeArray(depth)
+                for name, permutation in (("prefix", self.prefix),
+                                          ("suffix", self.suffix)):
+                    atom = atomClass(shape = (0,), flavor = 'numpy')
+                    array = nodeFile.createEArray(group, name, atom)
+                    array.append(permutation.astype(indexClass))
+        
+        self.prefixOrders = self.orders[self.prefix]
+        # every row reversed, sorted
+        self.suffixOrders = self.orders[self.suffix][:, ::-1]
+    
+    def startsWith(self, prefix):
+        """Returns the increasing indexes of biclusters whose order starts with
+        prefix
+        
+        @param prefix sequence of conditions
+        """
+        start, stop = sortedRange(self.prefixOrders, prefix)
+        
+        return numpy.sort(self.prefix[start:stop])
+    
+    def endsWith(self, suffix):
+        """Returns the increasing indexes of biclusters whose order ends with
+        suffix
+        
+        @param suffix sequence of conditions
+        """
+        start, stop = sortedRange(self.suffixOrders, list(suffix)[::-1])
+        
+        return numpy.sort(self.suffix[start:stop])
+    
+    def containsSubsequence(self, subsequence):
+        """Returns the increasing indexes of biclusters whose order contains
+        subsequence in the same order, though not necessarily contiguously
+        
+        A subsequence one shorter than the orders, as pruning asks for, is the
+        order with one condition inserted, so each insertion point is a range
+        of the prefix or suffix order and is checked against the other end.
+        Shorter subsequences are checked against every order.
+        @param subsequence sequence of conditions
+        """
+        subsequence = numpy.asarray(subsequence, dtype = numpy.int64)
+        length = subsequence.size
+        depth, width = self.orders.shape
+        
+        if length > width:
+            return numpy.zeros(0, dtype = numpy.int64)
+        
+        if length == width:
+            return self.startsWith(subsequence.tolist())
+        
+        if length == width - 1:
+            matches = list()
+            for insertion in xrange(length + 1):
+                head = subsequence[:insertion]
+                tail = subsequence[insertion:]
+                
+                prefixStart, prefixStop = sortedRange(self.prefixOrders,
+                                                      head.tolist())
+                suffixStart, suffixStop = sortedRange(self.suffixOrders,
+                                                      tail[::-1].tolist())
+                
+                # check the smaller range against the other end
+                if prefixStop - prefixStart <= suffixStop - suffixStart:
+                    rows = self.prefix[prefixStart:prefixStop]
+                    found = self.orders[rows, insertion + 1:] == tail
+                else:
+                    rows = self.suffix[suffixStart:suffixStop]
+                    found = self.orders[rows, :insertion] == head
+                
+                matches.append(rows[found.all(axis = 1)])
+            
+            return numpy.unique(numpy.concatenate(matches))
+        
+        # position of each condition of subsequence in every order, or width
+        # where it is missing
+        positions = numpy.empty((depth, length), dtype = numpy.int64)
+        for i, condition in enumerate(subsequence.tolist()):
+            match = self.orders == condition
+            positions[:, i] = numpy.where(match.any(axis = 1),
+                                          match.argmax(axis = 1), width)
+        
+        found = (positions < width).all(axis = 1) & \
+                (numpy.diff(positions, axis = 1) > 0).all(axis = 1)
+        
+        return numpy.where(found)[0]
@@ -35,21 +35,255 @@ import numpy.core.multiarray
 import tables
 
 import Biclustering.BitSet
+import Biclustering.Sizing
+
+# rows read at once by block operations on SetArrays
+BLOCK_ROWS = 1 << 12
+
+# rows of a SetArray transposed at once by transposeInto()
+TRANSPOSE_ROWS = 1 << 15
+
+# max blocks of words summarized by a signature of a BitSet
+SIGNATURE_BLOCKS = 32
+
+def byteCounts():
+    """Returns population count of every byte value"""
+    counts = numpy.zeros(256, dtype = numpy.uint8)
+    for i in xrange(1, 256):
+        counts[i] = counts[i >> 1] + (i & 1)
+    
+    return counts
+
+BYTE_COUNTS = byteCounts()
+
+def popCounts(words):
+    """Returns population count of each row of BitSet formatted words
+    
+    @param words 2D array with one BitSet.asArray() per row
+    @return array of counts
+    """
+    words = numpy.ascontiguousarray(words, dtype = numpy.uint32)
+    # explicit widths so arrays of 0 rows reshape too
+    rowBytes = words.view(numpy.uint8).reshape(words.shape[0],
+                                               words.shape[1] * 4)
+    
+    return BYTE_COUNTS[rowBytes].sum(axis = 1)
+
+def signatureShape(universe):
+    """Returns (blocks, words per block) of signatures() of universe sized
+    BitSets
+    
+    @param universe universe size of BitSets
+    """
+    size = Biclustering.BitSet.arraySize(universe)
+    blocks = max(1, min(SIGNATURE_BLOCKS, size))
+    
+    return (blocks, -(-size // blocks))
+
+def signatures(words, universe):
+    """Returns population count of each block of words of each row
+    
+    The words of a row are split into signatureShape(universe) blocks.  The
+    intersection of two sets can't have more members in a block than the
+    smaller of their two counts, so signatureBounds() of two signatures is an
+    upper bound on the size of the intersection of their sets.
+    @param words 2D array with one BitSet.asArray() per row
+    @param universe universe size of BitSets
+    @return (rows, blocks) array of counts
+    """
+    blocks, blockWords = signatureShape(universe)
+    
+    words = numpy.asarray(words, dtype = numpy.uint32)
+    padded = numpy.zeros((words.shape[0], blocks * blockWords),
+                         dtype = numpy.uint32)
+    padded[:, :words.shape[1]] = words
+    
+    blockBytes = padded.view(numpy.uint8).reshape(words.shape[0], blocks,
+                                                  blockWords * 4)
+    
+    return BYTE_COUNTS[blockBytes].sum(axis = 2)
+
+def signatureBounds(first, second):
+    """Returns upper bounds on the intersection sizes of pairs of sets
+    
+    first and second broadcast against each other like any numpy arrays, with
+    the blocks on the last axis.
+    @param first signatures() of first sets
+    @param second signatures() of second sets
+    @return bound of each pair
+    """
+    return numpy.minimum(first, second).sum(axis = -1, dtype = numpy.int64)
+
+def readRows(array, indexes):
+    """Returns rows of array at increasing indexes
+    
+    Rows are read in contiguous runs of at most BLOCK_ROWS rows in file order,
+    so the reads are sequential even when indexes are sparse.
+    @param array EArray or any other array sliced by row
+    @param indexes increasing row indexes
+    @return array of the selected rows
+    """
+    indexes = numpy.asarray(indexes, dtype = numpy.int64)
+    if indexes.size == 0:
+        return array[0:0]
+    
+    parts = list()
+    start = 0
+    while start < indexes.size:
+        first = int(indexes[start])
+        stop = int(numpy.searchsorted(indexes, first + BLOCK_ROWS))
+        
+        run = array[first:int(indexes[stop - 1]) + 1]
+        parts.append(run[indexes[start:stop] - first])
+        start = stop
+    
+    return numpy.concatenate(parts)
+
+def permuteRows(array, order):
+    """Reorders the rows of an EArray so row i is old row order[i]
+    
+    Rows are copied BLOCK_ROWS at a time into a new EArray, which then takes
+    the place and attributes of array, so only one block is held in memory.
+    @param array EArray to reorder
+    @param order permutation of the rows of array
+    @return the reordered EArray, which replaces array in the file
+    """
+    nodeFile = array._v_file
+    name = array._v_name
+    
+    permuted = nodeFile.createEArray(array._v_parent, name + "Permuted",
+                                     array.atom)
+    for attribute in array.attrs._v_attrnamesuser:
+        nodeFile.setNodeAttr(permuted, attribute,
+                             nodeFile.getNodeAttr(array, attribute))
+    
+    order = numpy.asarray(order, dtype = numpy.int64)
+    for start in xrange(0, order.size, BLOCK_ROWS):
+        block = order[start:start + BLOCK_ROWS]
+        
+        # read in file order, then put in block order
+        sources = numpy.sort(block)
+        rows = readRows(array, sources)
+        permuted.append(rows[numpy.searchsorted(sources, block)])
+    
+    nodeFile.removeNode(array)
+    nodeFile.renameNode(permuted, name)
+    
+    return permuted
+
+def members(bitSet, elements):
+    """Returns which elements are members of bitSet
+    
+    @param bitSet BitSet to test membership in
+    @param elements array of elements in the universe of bitSet
+    @return boolean array
+    """
+    words = bitSet.asArray()
+    elements = numpy.asarray(elements, dtype = numpy.int64)
+    
+    wordBits = words[elements // Biclustering.BitSet.BITS]
+    shift = (elements % Biclustering.BitSet.BITS).astype(numpy.uint32)
+    
+    return (wordBits >> shift) & 1 == 1
+
+def unpackBits(words, universe):
+    """Returns the members of each row of BitSet formatted words as booleans
+    
+    @param words 2D array with one BitSet.asArray() per row
+    @param universe universe of the BitSets
+    @return (rows, universe) boolean array
+    """
+    words = numpy.ascontiguousarray(words, dtype = numpy.uint32)
+    shifts = numpy.arange(Biclustering.BitSet.BITS, dtype = numpy.uint32)
+    
+    bits = (words[:, :, numpy.newaxis] >> shifts) & 1
+    
+    return bits.reshape(words.shape[0], -1)[:, :universe].astype(bool)
+
+def packBits(bits):
+    """Returns each row of a boolean array as BitSet formatted words
+    
+    Inverse of unpackBits()
+    @param bits (rows, universe) boolean array
+    @return (rows, arraySize(universe)) array of words
+    """
+    rows, universe = bits.shape
+    size = Biclustering.BitSet.arraySize(universe)
+    
+    padded = numpy.zeros((rows, size * Biclustering.BitSet.BITS),
+                         dtype = numpy.uint32)
+    padded[:, :universe] = bits
+    padded.shape = (rows, size, Biclustering.BitSet.BITS)
+    
+    shifts = numpy.arange(Biclustering.BitSet.BITS, dtype = numpy.uint32)
+    
+    # bits are distinct, so summing them is or-ing them
+    return (padded << shifts).sum(axis = 2, dtype = numpy.uint32)
+
+def transposeInto(sets, universe, transposed, blockRows=TRANSPOSE_ROWS):
+    """Writes the transpose of an array of BitSets into an empty SetArray
+    
+    Row i of the transpose is a BitSet over the rows of sets with every row
+    whose BitSet contains i.  transposed is first filled with universe empty
+    rows.  Then each block of blockRows rows of sets is transposed and written
+    into the matching words of every row, so only one block of the transpose
+    is held in memory however deep sets is.
+    @param sets SetArray or anything else with block() and len()
+    @param universe universe of the BitSets in sets
+    @param transposed empty SetArray with a universe of len(sets)
+    @param blockRows rows of sets transposed at once.  A multiple of
+                     BLOCK_ROWS
+    """
+    depth = len(sets)
+    size = Biclustering.BitSet.arraySize(depth)
+    
+    empty = numpy.zeros((min(BLOCK_ROWS, universe), size),
+                        dtype = numpy.uint32)
+    for start in xrange(0, universe, BLOCK_ROWS):
+        transposed.extend(empty[:min(BLOCK_ROWS, universe - start)])
+    
+    counts = numpy.zeros(universe, dtype = numpy.int64)
+    # blockRows and BLOCK_ROWS are multiples of BITS, so every block fills
+    # whole words
+    for blockStart in xrange(0, depth, blockRows):
+        blockStop = min(blockStart + blockRows, depth)
+        
+        first = blockStart // Biclustering.BitSet.BITS
+        # arraySize() pads, so the last block may be wider than the words
+        # left in transposed
+        words = min(Biclustering.BitSet.arraySize(blockStop - blockStart),
+                    size - first)
+        block = numpy.zeros((universe, words), dtype = numpy.uint32)
+        
+        for start in xrange(blockStart, blockStop, BLOCK_ROWS):
+            stop = min(start + BLOCK_ROWS, blockStop)
+            
+            packed = packBits(unpackBits(sets.block(start, stop), universe).T)
+            
+            offset = (start - blockStart) // Biclustering.BitSet.BITS
+            # packed may have pad words past the end of block
+            packedWords = min(packed.shape[1], words - offset)
+            block[:, offset:offset + packedWords] = packed[:, :packedWords]
+        
+        transposed.assignColumns(first, block)
+        counts += popCounts(block).astype(numpy.int64)
+    
+    transposed.assignCounts(counts)
 
 class OrderedBitSet(object):
     """An ordered set (a collection of numbers where order matters but no
     repeated elements) that uses a BitSet for faster membership calculations"""
     
-    def __init__(self, order, universe=None, bitSet=None):
+    def __init__(self, order, universe=None, set=None):
         """OrderedBitSet(order, universe)
             OR
         OrderedBitSet(order, set)
         """
         self.order = order
         
-        if bitSet is None:
-            bitSet = Biclustering.BitSet.BitSet(universe, order)
-        self.set = bitSet
+        if set is None:
+            set = Biclustering.BitSet.BitSet(universe, order)
+        self.set = set
     
     def __contains__(self, element):
         return element in self.set
@@ -84,16 +318,27 @@ class OrderedBitSet(object):
         """Return new OrderedBitSet with order reverse of this one"""
         return OrderedBitSet(self.order[::-1], set = self.set)
     
-    def chain(self, tail):
+    def chain(self, tail, scratch=None):
         """Creates new OrderedBitSet with the union of self and tail sets and
         tail[-1] appended to self's order
         
         @param tail OrderedBitSet to append
+        @param scratch OrderedBitSet of the chained width to overwrite and
+                       return instead of allocating a new one
         """
-        order = numpy.core.multiarray.concatenate((self.order, tail.order[1:]))
-        bitSet = self.set | tail.set
+        if scratch is None:
+            order = numpy.core.multiarray.concatenate((self.order,
+                                                       tail.order[1:]))
+            bitSet = self.set | tail.set
+            
+            return OrderedBitSet(order, set = bitSet)
         
-        return OrderedBitSet(order, set = bitSet)
+        width = self.order.size
+        scratch.order[:width] = self.order
+        scratch.order[width:] = tail.order[1:]
+        self.set.unionInto(tail.set, scratch.set)
+        
+        return scratch
     
     def isOrderedSubset(self, orderedBitSet):
         """Returns whether orderedBitSet is an ordered subset of self
@@ -131,7 +376,7 @@ class OrderedBitSetAccessor(object):
         self.set = BitSetAccessor(name + '/set', universe)
         
         orderCol = Biclustering.Sizing.sizeCol(universe)
-    
+        
         class OrderedBitSetTable(tables.IsDescription):
             """Table of OrderedBitSets of a single width"""
             
@@ -159,7 +404,7 @@ class OrderedBitSetAccessor(object):
         """
         row[self.name + '/order'] = orderedBitSet.order
         self.set.pack(row, orderedBitSet.set)
-    
+
 class OrderedSetArray(object):
     """Array of OrderedBitSets of a single width"""
     
@@ -198,6 +443,26 @@ class OrderedSetArray(object):
         self.orders.append(order)
         self.sets.append(orderedBitSet.set)
     
+    def extend(self, orders, words):
+        """Appends rows of orders and their sets' BitSet words
+        
+        @param orders (rows, width) array of orders
+        @param words 2D array with the BitSet words of each order's set
+        """
+        if len(orders) == 0:
+            return
+        
+        self.orders.append(orders)
+        self.sets.extend(words)
+    
+    def permute(self, order):
+        """Reorders the rows so row i is old row order[i]
+        
+        @param order permutation of the rows
+        """
+        self.orders = permuteRows(self.orders, order)
+        self.sets.permute(order)
+    
     def __iter__(self):
         for order, bitSet in itertools.izip(self.orders, self.sets):
             yield OrderedBitSet(order, set = bitSet)
@@ -206,6 +471,21 @@ class OrderedSetArray(object):
         bitSet = self.sets[index]
         return OrderedBitSet(self.orders[index], set = bitSet)
     
+    def rows(self, indexes):
+        """Returns orders and set words of increasing indexes
+        
+        @param indexes increasing row indexes
+        @return (orders, words) 2D arrays with one row per index
+        """
+        return (readRows(self.orders, indexes), self.sets.rows(indexes))
+    
+    def positions(self, position):
+        """Returns the condition at position of every order
+        
+        @param position column
+        """
+        return self.orders[:, position]
+    
     def where(self, position, value):
         """Returns rows where position has value
         
@@ -220,7 +500,7 @@ class OrderedSetArray(object):
         @param value member not in set
         """
         return self.sets.whereNot(value)
-    
+
 class BitSetAccessor(object):
     """Accessor to access rows of data as BitSets"""
     
@@ -251,9 +531,17 @@ class BitSetAccessor(object):
         row[self.name] = bitSet.asArray()
 
 class SetArray(object):
-    """Array of BitSets"""
+    """Array of BitSets
     
-    def __init__(self, nodeFile, group, name, universe=None):
+    The number of members of each BitSet is stored in a name + "Counts" array
+    next to the BitSets, so BitSets are loaded with their count already known
+    and counts can be filtered without reading the BitSets.  Arrays created
+    with signatures also store the signatures() of each BitSet in a name +
+    "Signatures" array, so pairs of BitSets whose intersection is too small can
+    be rejected without reading the BitSets.
+    """
+    
+    def __init__(self, nodeFile, group, name, universe=None, signatures=False):
         """
         BitSetArray(file, group, universe)
             OR
@@ -264,6 +552,7 @@ class SetArray(object):
         @param name name of array
         @param universe universe size of BitSets in array.  Must be specified
                when creating.  If not given, then assume array is to be loaded
+        @param signatures [False] True to store signatures of the BitSets
         """
         
         self.file = nodeFile
@@ -282,6 +571,59 @@ class SetArray(object):
             self.bitSets = self.file.createEArray(group, name, atom)
             
             self.file.setNodeAttr(self.bitSets, "universe", self.universe)
+        
+        self.countType = Biclustering.Sizing.sizeArray(self.universe + 1)
+        countsName = name + "Counts"
+        try:
+            self.bitSetCounts = self.file.getNode(group, countsName)
+        except tables.NoSuchNodeError:
+            if self.file.mode == "r":
+                # arrays written before counts were stored and can't be
+                # upgraded in place
+                self.bitSetCounts = self.computeCounts()
+            else:
+                countClass = Biclustering.Sizing.sizeAtom(self.universe + 1)
+                atom = countClass(shape = (0,), flavor = 'numpy')
+                
+                self.bitSetCounts = self.file.createEArray(group, countsName,
+                                                           atom)
+                
+                # arrays written before counts were stored
+                if len(self) != 0:
+                    self.bitSetCounts.append(
+                        self.computeCounts().astype(self.countType))
+        
+        self.bitSetSignatures = None
+        if signatures:
+            self.loadSignatures(group, name + "Signatures")
+    
+    def loadSignatures(self, group, signaturesName):
+        """Loads or creates the signatures array
+        
+        @param group parent group of array
+        @param signaturesName name of signatures array
+        """
+        blocks, blockWords = signatureShape(self.universe)
+        blockRange = blockWords * Biclustering.BitSet.BITS + 1
+        self.signatureType = Biclustering.Sizing.sizeArray(blockRange)
+        
+        try:
+            self.bitSetSignatures = self.file.getNode(group, signaturesName)
+        except tables.NoSuchNodeError:
+            if self.file.mode == "r":
+                # arrays written before signatures were stored and can't be
+                # upgraded in place
+                self.bitSetSignatures = self.computeSignatures()
+            else:
+                signatureClass = Biclustering.Sizing.sizeAtom(blockRange)
+                atom = signatureClass(shape = (0, blocks), flavor = 'numpy')
+                
+                self.bitSetSignatures = \
+                    self.file.createEArray(group, signaturesName, atom)
+                
+                # arrays written before signatures were stored
+                if len(self) != 0:
+                    self.bitSetSignatures.append(self.computeSignatures())
     
     def append(self, bitSet):
         """Appends bitSet to array
@@ -294,14 +636,123 @@ class SetArray(object):
         bitSetArray.shape = (1, bitSetArray.size)
         
         self.bitSets.append(bitSetArray)
+        self.bitSetCounts.append(numpy.array((len(bitSet),),
+                                             dtype = self.countType))
+        if self.bitSetSignatures is not None:
+            self.bitSetSignatures.append(
+                signatures(bitSetArray,
+                           self.universe).astype(self.signatureType))
     
     def __iter__(self):
-        for row in self.bitSets:
-            yield Biclustering.BitSet.BitSet(self.universe, row, True)
+        for row, count in itertools.izip(self.bitSets, self.bitSetCounts):
+            yield Biclustering.BitSet.BitSet(self.universe, row, True,
+                                             int(count))
     
     def __getitem__(self, index):
         return Biclustering.BitSet.BitSet(self.universe, self.bitSets[index],
-                                          True)
+                                          True, int(self.bitSetCounts[index]))
+    
+    def extend(self, words):
+        """Appends rows of BitSet formatted words
+        
+        @param words 2D array with one BitSet.asArray() per row
+        """
+        if len(words) == 0:
+            return
+        
+        self.bitSets.append(words)
+        self.bitSetCounts.append(popCounts(words).astype(self.countType))
+        if self.bitSetSignatures is not None:
+            self.bitSetSignatures.append(
+                signatures(words, self.universe).astype(self.signatureType))
+    
+    def __len__(self):
+        return self.bitSets.nrows
+    
+    def assignColumns(self, first, words):
+        """Overwrites words [first, first + words.shape[1]) of every row
+        
+        Counts and signatures are not updated.
+        @param first first word
+        @param words (len(self), columns) array of words
+        """
+        self.bitSets[:, first:first + words.shape[1]] = words
+    
+    def assignCounts(self, counts):
+        """Overwrites the stored count of every row
+        
+        @param counts number of members of every BitSet in the array
+        """
+        self.bitSetCounts[:] = numpy.asarray(counts, dtype = self.countType)
+    
+    def readInto(self, index, out):
+        """Loads the BitSet at index into out instead of a new BitSet
+        
+        @param index index of BitSet
+        @param out BitSet of the same universe to overwrite
+        @return out
+        """
+        out.assign(self.bitSets[index], int(self.bitSetCounts[index]))
+        
+        return out
+    
+    def block(self, start, stop):
+        """Returns rows [start, stop) as a 2D array of BitSet words
+        
+        @param start first row
+        @param stop row after last row
+        """
+        return self.bitSets[start:stop]
+    
+    def rows(self, indexes):
+        """Returns rows at increasing indexes as a 2D array of BitSet words
+        
+        @param indexes increasing row indexes
+        """
+        return readRows(self.bitSets, indexes)
+    
+    def signatureRows(self, indexes):
+        """Returns signatures of the rows at increasing indexes
+        
+        @param indexes increasing row indexes
+        @return (rows, blocks) array of signatures() of each row
+        """
+        return readRows(self.bitSetSignatures, indexes)
+    
+    def permute(self, order):
+        """Reorders the rows so row i is old row order[i]
+        
+        @param order permutation of the rows
+        """
+        self.bitSets = permuteRows(self.bitSets, order)
+        self.bitSetCounts = permuteRows(self.bitSetCounts, order)
+        if self.bitSetSignatures is not None:
+            self.bitSetSignatures = permuteRows(self.bitSetSignatures, order)
+    
+    def counts(self):
+        """Returns number of members of every BitSet in the array"""
+        return self.bitSetCounts[:].astype(numpy.int64)
+    
+    def computeCounts(self):
+        """Returns number of members of every BitSet by counting the bits"""
+        counts = numpy.zeros(len(self), dtype = numpy.int64)
+        for start in xrange(0, len(self), BLOCK_ROWS):
+            stop = min(start + BLOCK_ROWS, len(self))
+            counts[start:stop] = popCounts(self.block(start, stop))
+        
+        return counts
+    
+    def computeSignatures(self):
+        """Returns signatures() of every BitSet by counting the bits"""
+        blocks, blockWords = signatureShape(self.universe)
+        
+        computed = numpy.zeros((len(self), blocks), dtype = self.signatureType)
+        for start in xrange(0, len(self), BLOCK_ROWS):
+            stop = min(start + BLOCK_ROWS, len(self))
+            computed[start:stop] = signatures(self.block(start, stop),
+                                              self.universe)
+        
+        return computed
     
     def whereNot(self, value):
         """Returns array of indexes where value is not a member of the set
@@ -312,4 +763,3 @@ class SetArray(object):
         index, mask = divmod(value, Biclustering.BitSet.BITS)
         return numpy.core.multiarray.where(self.bitSets[:, index] & 
                            numpy.uint32(1 << mask) == 0)
-        
\ No newline at end of file
@@ -44,6 +44,17 @@ def nChooseK(n, k):
     
     return numerator / factorial(min(n - k, k), exact = 1)
 
+def pairIndex(first, second, setSize):
+    """Returns the index of the pair (first, second) in
+    xcombinations(setSize, 2) order
+    
+    @param first smaller element of the pair
+    @param second larger element of the pair
+    @param setSize number of elements in set pairs are selected from
+    @return number of pairs before (first, second)
+    """
+    return first * (2 * setSize - first - 1) // 2 + second - first - 1
+
 class xcombinations(object):
     """Returns all combinations of subsetSize number from [0, setSize)
     
@@ -26,7 +26,9 @@
 """
 
 import datetime
+import logging
 import numpy
+import os
 import tables
 import time
 
@@ -35,6 +37,8 @@ import Biclustering.Bicluster
 import Biclustering.Bit
 import Biclustering.BitSet
 import Biclustering.Combinatorics
+import Biclustering.Parallel
+import Biclustering.Pipeline
 import Biclustering.Sizing
 import Biclustering.Timing
 
@@ -60,31 +64,104 @@ def fullCoverageData(conditions, minGenes=2):
 def packData(data):
     """Compacts data by converting it to the minimum int size
     
+    Each value is replaced by its rank in its row.  Rows are independent, so
+    data can be packed in chunks of rows.
     @param data data to compact
     @return compacted data
     """
     
     compact = Biclustering.Sizing.sizeArray(data.shape[1])
     
-    return data.argsort().argsort().astype(compact)
+    # the ranks are the inverse of the sort order, so scattering the positions
+    # through the order replaces the second argsort
+    order = data.argsort()
+    packed = numpy.empty(data.shape, dtype = compact)
+    rows = numpy.arange(data.shape[0])[:, numpy.newaxis]
+    packed[rows, order] = numpy.arange(data.shape[1], dtype = compact)
+    
+    return packed
+
+def conditionOrder(packed):
+    """Returns the conditions of each row of packed data in increasing order
+    
+    The inverse of the ranks of packData(), like Bcc in bfbc.m
+    @param packed data from packData()
+    @return array of the same shape and type as packed
+    """
+    order = numpy.empty(packed.shape, dtype = packed.dtype)
+    rows = numpy.arange(packed.shape[0])[:, numpy.newaxis]
+    order[rows, packed] = numpy.arange(packed.shape[1], dtype = packed.dtype)
+    
+    return order
+
+def benchmarkEngines(name, data, path=None, minGenes=2, engines=None):
+    """Finds all biclusters in data with each engine
+    
+    Each engine gets its own GEM named name-engine.
+    @param name prefix of the GEM names
+    @param data data to find biclusters in
+    @param path directory of the files.  Defaults to PWD
+    @param minGenes min genes for a valid bicluster
+    @param engines names of engines to time.  Defaults to all registered
+    @return dict of engine name -> seconds taken by allBiclusters()
+    """
+    
+    if engines is None:
+        engines = sorted(Biclustering.Bicluster.ENGINES)
+    
+    times = dict()
+    for engine in engines:
+        gem = GeneExpressionMatrix("%s-%s" % (name, engine), data, path,
+                                   minGenes, engine = engine)
+        
+        startTime = time.time()
+        gem.allBiclusters()
+        times[engine] = time.time() - startTime
+        
+        logging.info("%s: %s", engine, datetime.timedelta(seconds = times[engine]))
+        gem.file.close()
+    
+    return times
 
 class GeneExpressionMatrix(object):
     
     FILE_EXTENSION = "gem"
     FILTERS = tables.Filters(complevel = 1, complib= 'lzo')
     
-    def __init__(self, name, data=None, path=None, minGenes=2, filters=None):
+    def __init__(self, name, data=None, path=None, minGenes=2, filters=None,
+                 engine=None, readOnly=False, sharded=False):
+        """Creates or reopens a GEM
+        
+        @param name name of GEM.  Used for the file name
+        @param data data to create the GEM from.  None to reopen
+        @param path directory of the file.  Defaults to PWD
+        @param minGenes min genes for a valid bicluster
+        @param filters pytables Filters for the file
+        @param engine name of bicluster engine (see Biclustering.Bicluster).
+                      Defaults to the engine the GEM was created with or
+                      Biclustering.Bicluster.DEFAULT_ENGINE
+        @param readOnly True to reopen the GEM without write access, so any
+                        number of processes can open it at once.  Only
+                        queries and stats work on a read-only GEM
+        @param sharded True to store biclusters of each width in their own
+                       file in the directory name.gem.d next to the GEM.  Only
+                       used when creating; reopened GEMs keep their layout
+        """
         self.name = name
         
         if path is None:
             # default to PWD
             path = "./"
-            
+        
         fileName = path + name + "." + GeneExpressionMatrix.FILE_EXTENSION
+        self.fileName = fileName
         
         if filters is None:
             filters = self.FILTERS
         
+        if readOnly and data is not None:
+            raise ValueError("cannot create a read-only GEM")
+        
         # if creating this GEM
         if data is not None:
             self.file = tables.openFile(fileName, mode = "w",
@@ -95,26 +172,83 @@ class GeneExpressionMatrix(object):
             # save raw version in case it's needed for algorithm enhancements
             self.file.createArray(group, "raw", data)
             self.data = packData(data)
+            # reopening reads the ranks instead of packing raw again
+            self.file.createArray(group, "packed", self.data)
+            self.file.createArray(group, "permutation",
+                                  conditionOrder(self.data))
             
             createBiclusters = True
         else:
-            self.file = tables.openFile(fileName, mode = "r+",
+            if readOnly:
+                mode = "r"
+            else:
+                mode = "r+"
+            
+            self.file = tables.openFile(fileName, mode = mode,
                                         filters = filters)
             
             group = self.file.getNode("/", "gem")
-            raw = self.file.getNode(group, "raw")
-            self.data = packData(raw[:])
+            try:
+                self.data = self.file.getNode(group, "packed")[:]
+            except tables.NoSuchNodeError:
+                raw = self.file.getNode(group, "raw")
+                self.data = packData(raw[:])
+                
+                # GEMs created before the ranks were stored only pack once
+                if not readOnly:
+                    self.file.createArray(group, "packed", self.data)
+                    self.file.createArray(group, "permutation",
+                                          conditionOrder(self.data))
             
-            createBiclusters = False
+            # ingested GEMs have no biclusters yet
+            createBiclusters = "biclusters" not in self.file.root
+            if createBiclusters and readOnly:
+                raise ValueError("%s has no biclusters" % fileName)
         
         self.maxConditions = self.data.shape[1]
         self.maxGenes = self.data.shape[0]
         
-        self.biclusters = Biclustering.Bicluster.Group(self.file, "/",
-                                                       self.maxConditions,
-                                                       self.maxGenes,
-                                                       createBiclusters,
-                                                       minGenes)
+        if createBiclusters:
+            if engine is None:
+                engine = Biclustering.Bicluster.DEFAULT_ENGINE
+        else:
+            try:
+                storedEngine = self.file.getNodeAttr("/biclusters", "engine")
+            except AttributeError:
+                # GEMs created before engines were selectable
+                storedEngine = Biclustering.Bicluster.DEFAULT_ENGINE
+            
+            if engine is None:
+                engine = storedEngine
+            elif engine != storedEngine:
+                raise ValueError("%s was created with the %s engine, not %s" %
+                                 (fileName, storedEngine, engine))
+        
+        if createBiclusters and sharded:
+            shardDirectory = os.path.basename(fileName) + ".d"
+        else:
+            shardDirectory = None
+        
+        self.engine = engine
+        groupClass = Biclustering.Bicluster.engine(engine)
+        self.biclusters = groupClass(self.file, "/", self.maxConditions,
+                                     self.maxGenes, createBiclusters, minGenes,
+                                     shardDirectory)
+        self.minGenes = self.biclusters.minGenes
+        
+        if createBiclusters:
+            self.file.setNodeAttr(self.biclusters.biclusters, "engine", engine)
+    
+    def conditionOrders(self):
+        """Returns the conditions of each gene in increasing order of
+        expression
+        
+        @return (genes, conditions) array
+        """
+        try:
+            return self.file.getNode("/gem", "permutation")[:]
+        except tables.NoSuchNodeError:
+            return conditionOrder(self.data)
     
     def splitSubset(self, conditions):
         """Identifies all biclusters with a given subset of 2 conditions
@@ -129,22 +263,36 @@ class GeneExpressionMatrix(object):
         increasing = numpy.where(self.data[:, conditions[0]] < self.data[:, conditions[1]])
         increasingGenes = Biclustering.BitSet.BitSet(self.data.shape[0], increasing)
         
+        pair = Biclustering.Combinatorics.pairIndex(int(conditions[0]),
+                                                    int(conditions[1]),
+                                                    self.data.shape[1])
+        
         count = 0
         # increasing set
         increasingConditions = Biclustering.Bit.OrderedBitSet(conditions, self.data.shape[1])
-        if self.biclusters.pool(increasingConditions, increasingGenes):
+        if self.biclusters.pool(increasingConditions, increasingGenes,
+                                Biclustering.Bicluster.seedId(pair, False)):
             count += 1
         
         # decreasing set
         
         decreasingConditions = increasingConditions.reverse()
-        if self.biclusters.pool(decreasingConditions, ~increasingGenes):
+        if self.biclusters.pool(decreasingConditions, ~increasingGenes,
+                                Biclustering.Bicluster.seedId(pair, True)):
             count += 1
         
         return count
     
-    def splitBiclusters(self):
-        """Finds all biclusters with 2 conditions"""
+    def splitBiclusters(self, processes=None):
+        """Finds all biclusters with 2 conditions
+        
+        @param processes number of processes to split with.  None to split
+               serially in this process
+        @return number of valid biclusters found
+        """
+        
+        if processes is not None:
+            return Biclustering.Parallel.splitBiclusters(self, processes)
         
         combinations = Biclustering.Combinatorics.xcombinations(self.maxConditions, 2)
         
@@ -159,7 +307,45 @@ class GeneExpressionMatrix(object):
             count += self.splitSubset(conditions)
         
         progressBar.finish()
-        self.file.flush()
+        self.biclusters.flush()
+        
+        return count
+    
+    def patternBiclusters(self):
+        """Finds all biclusters with every condition
+        
+        Python version of bfbc.m.  Genes with the same condition order form a
+        bicluster with every condition, so sorting the orders and splitting
+        them where they change finds all of them in O(genes log genes) instead
+        of chaining width by width up to full width.  They don't bound the
+        genes of narrower chains, since genes with different full orders can
+        share a shorter one, so chaining only uses them to stop a width short.
+        @return number of valid biclusters found
+        """
+        
+        orders, genes = Biclustering.Array.sortRows(self.conditionOrders())
+        
+        # first row of each run of equal orders
+        changes = numpy.where((orders[1:] != orders[:-1]).any(axis = 1))[0] + 1
+        starts = numpy.concatenate(([0], changes))
+        stops = numpy.concatenate((changes, [orders.shape[0]]))
+        
+        count = 0
+        for start, stop in zip(starts.tolist(), stops.tolist()):
+            if stop - start < self.minGenes:
+                continue
+            
+            conditions = Biclustering.Bit.OrderedBitSet(orders[start].copy(),
+                                                        self.maxConditions)
+            patternGenes = Biclustering.BitSet.BitSet(self.maxGenes,
+                                                      genes[start:stop])
+            id = Biclustering.Bicluster.patternId(int(genes[start:stop].min()))
+            if self.biclusters.pool(conditions, patternGenes, id):
+                count += 1
+        
+        # runs are in order of condition order, not of id
+        self.biclusters.canonicalize(self.maxConditions)
+        self.biclusters.flush()
         
         return count
     
@@ -172,32 +358,95 @@ class GeneExpressionMatrix(object):
         """
         self.biclusters.index(width)
     
-    def chainBiclusters(self, tailWidth):
+    def chainableLinks(self, bounds):
+        """Returns links whose gene bound can still reach minGenes
+        
+        @param bounds per-link gene bounds from the bicluster Group
+        @return array of links
+        """
+        return numpy.where(bounds >= self.minGenes)[0]
+    
+    def chainBiclusters(self, tailWidth, prefetch=False, writeBehind=False):
         """Chains biclusters into larger biclusters
         
         Chained biclusters are formed by chaining one bicluster of tailWidth
         with a bicluster of width 2.  
         @param tailWidth number of conditions in first array of biclusters
+        @param prefetch True to read the heads and tails of the next links on
+               a background thread while the current link is chained.  Only
+               engines with linkTiles() can prefetch
+        @param writeBehind True to append chained biclusters on a background
+               thread, so compressing and writing them overlaps with chaining.
+               Only engines with linkTiles() can write behind
         @return number of biclusters found
         """
         
+        # fail before any link is chained
+        self.biclusters.checkChainIds(2, tailWidth)
+        
         title = "(%d %d) => (%d)" % (2, tailWidth,
                                      tailWidth + 1)
-        progressBar = \
-            Biclustering.Timing.ProgressBar(self.maxConditions, title)
+        
+        links = self.chainableLinks(self.biclusters.frontier(tailWidth))
+        progressBar = Biclustering.Timing.ProgressBar(links.size, title)
+        
+        if ((prefetch or writeBehind) and
+            not hasattr(self.biclusters, "linkTiles")):
+            logging.warning("%s engine can't prefetch or write behind, "
+                            "chaining without them", self.engine)
+            prefetch = False
+            writeBehind = False
+        
+        if writeBehind:
+            self.biclusters.startWriter()
         
         count = 0
-        for link in xrange(self.maxConditions):
-            progressBar.update()
-            
-            count += self.biclusters.chain(tailWidth, link)
+        tiles = None
+        try:
+            if prefetch:
+                tiles = Biclustering.Pipeline.Prefetcher(
+                    self.linkTiles(tailWidth, links))
+                for heads, tails in tiles:
+                    # start of the next link
+                    if heads is None:
+                        progressBar.update()
+                        self.biclusters.flush()
+                        continue
+                    
+                    count += self.biclusters.chainTile(heads, tails)
+            else:
+                for link in links:
+                    progressBar.update()
+                    
+                    count += self.biclusters.chain(tailWidth, int(link))
+        finally:
+            # a failed tile must not leave the thread reading tiles
+            if tiles is not None:
+                tiles.close()
+            if writeBehind:
+                self.biclusters.stopWriter()
         
         progressBar.finish()
-        self.file.flush()
+        # tiles pool a link's pairs out of id order
+        self.biclusters.canonicalize(tailWidth + 1)
+        self.biclusters.flush()
         
         return count
     
     
+    def linkTiles(self, tailWidth, links):
+        """Yields the tiles of every link for chainBiclusters()
+        
+        (None, None) is yielded before the tiles of each link.
+        @param tailWidth number of conditions in first array of biclusters
+        @param links links to chain through
+        """
+        for link in links:
+            yield (None, None)
+            
+            for tiles in self.biclusters.linkTiles(tailWidth, int(link)):
+                yield tiles
+    
     def chainBiclustersPreCrest(self, headWidth, doubling = False):
         """Chains biclusters into larger biclusters
         
@@ -209,32 +458,48 @@ class GeneExpressionMatrix(object):
         """
         
         if doubling:
+            # fail before any link is chained
+            if headWidth != 2 and not self.biclusters.supportsDoubling:
+                raise NotImplementedError("%s engine does not support "
+                                          "doubling" % self.engine)
             tailWidth = headWidth
         else:
             tailWidth = 2
         
+        self.biclusters.checkChainIds(headWidth, tailWidth)
+        
         title = "(%d %d) => (%d)" % (headWidth, tailWidth,
                                      headWidth + tailWidth - 1)
-        progressBar = \
-            Biclustering.Timing.ProgressBar(self.maxConditions, title)
+        
+        bounds = self.biclusters.linkBounds(headWidth, tailWidth)
+        links = self.chainableLinks(bounds)
+        progressBar = Biclustering.Timing.ProgressBar(links.size, title)
         
         count = 0
-        for link in xrange(self.maxConditions):
+        for link in links:
             progressBar.update()
             
-            count += self.biclusters.chainPreCrest(headWidth, link, doubling)
+            count += self.biclusters.chainPreCrest(headWidth, int(link),
+                                                   doubling)
         
         progressBar.finish()
-        self.file.flush()
+        self.biclusters.canonicalize(headWidth + tailWidth - 1)
+        self.biclusters.flush()
         
         return count
     
-    def pruneBiclusters(self, width):
+    def pruneBiclusters(self, width, processes=None):
         """Prunes biclusters of width conditions that are nested
         
         @param width number of conditions in biclusters to prune
+        @param processes number of processes to prune with.  None to prune
+               serially in this process
         """
         
+        if processes is not None:
+            Biclustering.Parallel.pruneBiclusters(self, (width,), processes)
+            return
+        
         indexes = xrange(self.biclusters.depth(width))
         
         title = "(%d not in %d)" % (width, width + 1)
@@ -246,7 +511,7 @@ class GeneExpressionMatrix(object):
             self.biclusters.isNested(width, index)
         
         progressBar.finish()
-        self.file.flush()
+        self.biclusters.flush()
     
     def biclusterCount(self, includeNested=True):
         """Returns total number of biclusters
@@ -262,19 +527,81 @@ class GeneExpressionMatrix(object):
         
         return count
     
-    def allBiclusters(self):
-        """Finds all biclusters in the GEM"""
+    def chainSchedule(self, width, maxConditions=None):
+        """Returns whether (width width) doubling should be used instead of
+        (width 2) chaining for the next pass
+        
+        The cost of each strategy is estimated as the number of head and tail
+        pairs whose genes would be intersected, from the per-link cardinalities
+        of the indexes.  Doubling gains width - 1 conditions in a pass, so it is
+        picked when it costs fewer pairs per condition gained and does not
+        overshoot maxConditions.  width must be indexed.  Engines that can't
+        double always chain.
+        @param width number of conditions in biclusters to chain
+        @param maxConditions most conditions to reach.  Defaults to all
+        @return True to double
+        """
+        
+        if maxConditions is None:
+            maxConditions = self.maxConditions
+        
+        # (2 2) doubling is (2 2) chaining
+        if width == 2 or 2 * width - 1 > maxConditions:
+            return False
+        
+        if not self.biclusters.supportsDoubling:
+            logging.warning("%s engine can't double, chaining instead",
+                            self.engine)
+            return False
+        
+        single = self.biclusters.chainPairCount(width)
+        doubled = self.biclusters.pairCount(width, width)
+        
+        logging.debug("(%d 2) pairs: %d (%d %d) pairs: %d",
+                      width, single, width, width, doubled)
+        
+        return doubled < single * (width - 1)
+    
+    def allBiclusters(self, processes=None, doubling=False, memoryLimit=None,
+                      prefetch=False, writeBehind=False):
+        """Finds all biclusters in the GEM
+        
+        @param processes number of processes to split and prune with.  None
+               to split and prune serially in this process
+        @param doubling True to let chainSchedule() pick (x 2) chaining or
+               (x x) doubling for each width.  Widths skipped by doubling are
+               not searched
+        @param memoryLimit bytes of gene rows (x 2) chaining may hold at once
+               when chaining heads and tails in blocked tiles.  None to chain
+               a pair at a time
+        @param prefetch True to read the heads and tails of the next links on
+               a background thread during (x 2) chaining
+        @param writeBehind True to append biclusters found by (x 2) chaining on
+               a background thread
+        """
         
         totalStartTime = time.time()
+        self.biclusters.memoryLimit = memoryLimit
+        
+        if doubling and not self.biclusters.supportsDoubling:
+            logging.warning("%s engine can't double, chaining instead",
+                            self.engine)
+            doubling = False
         
         # seed clusters need 2 conditions so biclusters
         # can be grown by 1 condition if needed
         # 0 biclusters is unlikely, but may occur to too high of minGenes
-        if self.splitBiclusters() == 0:
+        if self.splitBiclusters(processes) == 0:
             logging.error("No seed biclusters found.  "
                           "Perhaps minimum genes (%d) is too high?",
                           self.minGenes)
         
+        # biclusters with every condition are found directly, so chaining
+        # stops short of full width.  With 2 conditions they are the seeds
+        patterns = self.maxConditions > 2
+        if patterns:
+            logging.info("Full width patterns: %d", self.patternBiclusters())
+        
         logging.info("Chaining")
         
         # search for valid bicluster with most conditions
@@ -283,13 +610,38 @@ class GeneExpressionMatrix(object):
         # smaller than the known maxConditions that may still yield genes
         progressBar = \
             Biclustering.Timing.ProgressBar(maxConditions - 2, "Chaining")
-        for i in xrange(2, maxConditions + 1):
+        width = 2
+        while width <= maxConditions:
             progressBar.update()
             
-            self.indexBiclusters(i)
-            if self.chainBiclusters(i) == 0:
-                maxConditions = i
+            # if no link can reach minGenes no wider bicluster exists, so
+            # neither indexing nor chaining is needed
+            if self.chainableLinks(self.biclusters.frontier(width)).size == 0:
+                maxConditions = width
+                break
+            
+            self.indexBiclusters(width)
+            double = doubling and self.chainSchedule(width)
+            if double:
+                nextWidth = 2 * width - 1
+            else:
+                nextWidth = width + 1
+            
+            if patterns and nextWidth == self.maxConditions:
+                if self.biclusters.depth(self.maxConditions) == 0:
+                    maxConditions = width
                 break
+            
+            if double:
+                found = self.chainBiclustersPreCrest(width, True)
+            else:
+                found = self.chainBiclusters(width, prefetch, writeBehind)
+            
+            if found == 0:
+                maxConditions = width
+                break
+            
+            width = nextWidth
         
         progressBar.finish()
         
@@ -297,21 +649,84 @@ class GeneExpressionMatrix(object):
                      self.biclusterCount(), maxConditions)
         logging.info("Pruning nested Biclusters")
         
-        progressBar = \
-            Biclustering.Timing.ProgressBar(maxConditions - 2, "Pruning")
-        
-        for i in xrange(2, maxConditions):
-            progressBar.update()
+        if processes is not None:
+            # widths are independent, so all of them are pruned by one pool
+            Biclustering.Parallel.pruneBiclusters(self,
+                                                  xrange(2, maxConditions),
+                                                  processes)
+        else:
+            progressBar = \
+                Biclustering.Timing.ProgressBar(maxConditions - 2, "Pruning")
             
-            self.pruneBiclusters(i)
-        
-        progressBar.finish()
+            for i in xrange(2, maxConditions):
+                progressBar.update()
+                
+                self.pruneBiclusters(i)
+            
+            progressBar.finish()
         
         logging.info("Nested Biclusters pruned.  Biclusters: %s ",
                      self.biclusterCount(False)) 
+        
+        logging.info("Indexing queries")
+        self.indexQueries()
         logging.info("Total Time: %s",
                     datetime.timedelta(seconds = time.time() - totalStartTime))
     
+    def indexQueries(self):
+        """Builds the gene and condition indexes used by query()
+        
+        Must be called again after biclusters are added.  allBiclusters()
+        calls it when it finishes.
+        """
+        self.biclusters.indexQueries()
+    
+    def query(self, genes=(), conditions=(), width=None, includeNested=True):
+        """Returns biclusters containing all of genes and conditions
+        
+        @param genes gene indexes
+        @param conditions condition indexes
+        @param width only search biclusters of width conditions.  Defaults to
+               all widths
+        @param includeNested True to include nested (pruned) biclusters
+        @return list of (width, index) of matching biclusters
+        """
+        matches = self.biclusters.query(genes, conditions, width,
+                                        includeNested)
+        
+        found = list()
+        for width in sorted(matches):
+            found.extend([(width, index) for index in matches[width].tolist()])
+        
+        return found
+    
+    def bicluster(self, width, index):
+        """Returns (conditions, genes) of a bicluster
+        
+        @param width number of conditions in bicluster
+        @param index index of bicluster among those of width conditions
+        @return (OrderedBitSet of conditions, BitSet of genes)
+        """
+        widthGroup = self.biclusters.cache[width]
+        # BUG FIX pytables doesn't understand numpy integer types
+        index = int(index)
+        
+        return (widthGroup.conditions[index], widthGroup.genes[index])
+    
+    def biclusterIds(self, width):
+        """Returns the stable id of every bicluster of width conditions
+        
+        Ids depend on the biclusters a bicluster was chained from, not on the
+        order it was stored in, so serial, tiled, threaded and multiprocess
+        runs give the same ids.
+        @param width number of conditions in biclusters
+        @return uint64 array in row order, which is increasing id order
+        """
+        if width not in self.biclusters.cache:
+            return numpy.zeros(0, dtype = numpy.uint64)
+        
+        return self.biclusters.cache[width].ids.read()
+    
     def stats(self):
         """Prints stats on GEM
         
@@ -355,7 +770,7 @@ class Annotation(dict):
             self.universe = universe
         else:
             raise ValueError("Could not load or create Annotation with given arguments")
-            
+    
     
     def __setitem__(self, key, value):
         if not isinstance(value, Biclustering.BitSet.BitSet):
@@ -365,11 +780,11 @@ class Annotation(dict):
     
     def categories(self):
         return self.keys()
-
+    
     def saveTo(self, file, where, name):
         """Creates SetArray which is a pickled version of this annotation
         """
         
         atom = tables.StringAtom(flavor = 'numpy')
         node = file.createVLArray(where, name, atom)
-        
+
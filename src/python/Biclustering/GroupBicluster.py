@@ -19,137 +19,180 @@
 #   Luke Imhoff (imho0030@umn.edu)
 #   220 Delaware St. SE
 #   Minneapolis, MN 55455
-"""Bicluster class and Group (for use with Pytables)
+"""Multi-level index engine: Group with head, tail and non-member indexes
 
 @author Luke Imhoff
 @license GPLv2
 """
 
-import itertools
-import numarray
 import numpy
-import sys
 import tables
 
-import Biclustering.Array
+import Biclustering.Bicluster
 import Biclustering.Bit
+import Biclustering.BitSet
 import Biclustering.Sizing
+import Biclustering.Timing
 
-NESTED = tables.Enum(['nonnested', 'nested', 'unknown'])
-NESTED_ATOM = tables.EnumAtom(NESTED, dtype = 'UInt8', shape = (0,),
-                              flavor = 'numpy')
+NESTED = Biclustering.Bicluster.NESTED
 
-class Group(object):
-    
-    def __init__(self, file, group, maxConditions, maxGenes, create=True, minGenes=2):
-        """Creates Bicluster Table
-        
-        @param file file to create Table on
-        @param group group to which to attach Group
-        @param maxConditions max condition indexes in any one bicluster
-        @param maxGenes max gene indexes in any one bicluster
-        @param minGenes min genes index for a valid bicluster
-        @param create create bilcuster Table in as child of group in file.
-                      Default = True.  If False checks for existence of table in file
-        """
-        self.file = file
-        
-        self.maxConditions = maxConditions
-        self.maxGenes = maxGenes
-        self.minGenes = minGenes
-        
-        if create:
-            self.biclusters = file.createGroup(group, "biclusters")
-            self.file.setNodeAttr(self.biclusters, "minGenes",
-                                  numarray.array((self.minGenes,)))
-        else:
-            self.biclusters = file.getNode(group, "biclusters")
-            self.minGenes = self.file.getNodeAttr(self.biclusters, "minGenes")[0]
-        
-        self.cache = WidthGroupCache(self.file, self.biclusters,
-                                     self.maxConditions, self.maxGenes)
-        
-        # Chain Performance Monitors
-        self.widthTooBig = 0
-        self.noHeadWidth = 0
-        self.noHeadLink = 0
-        self.noTailWidth = 0
-        self.noTailLink = 0
-        self.redundantCondition = 0
-        self.insufficientGenes = 0
-    
-    def pool(self, conditions, genes):
-        """Pool biclusters
-        
-        @param conditions condition indexes of bicluster
-        @param genes dependent indexes of the bicluster
-        @param returns true if biclusters valid
-        """
-        
-        if len(genes) >= self.minGenes:
-            self.cache[len(conditions)].pool(conditions, genes)
-            return True
-        
-        return False
+class Group(Biclustering.Bicluster.Group):
+    """Group whose width groups are indexed by head, tail and non-member
+    conditions"""
     
-    def index(self, width):
-        if width not in self.cache:
-            return
+    # bytes of gene rows held by a tile pair when there is no memoryLimit
+    TILE_MEMORY = 1 << 26
+    
+    supportsDoubling = True
+    
+    def createCache(self):
+        return WidthGroupCache(self.file, self.biclusters,
+                               self.maxConditions, self.maxGenes, self.shards)
+    
+    def frontier(self, width):
+        # seeds are the heads in chain()
+        return self.linkBounds(2, width)
+    
+    def chainPairCount(self, width):
+        # seeds are the heads in chain()
+        return self.pairCount(2, width)
+    
+    def tailUnion(self, tailWidth, link):
+        """Returns union of the genes of tailWidth biclusters starting with link
+        as a BitSet
         
-        self.cache[width].index()
+        @param tailWidth number of conditions in tail biclusters
+        @param link first condition of tails
+        """
+        unions = self.linkUnions(tailWidth, 0)
+        return Biclustering.BitSet.BitSet(self.maxGenes, unions[link].copy(),
+                                          True)
     
-    def chain(self, tailWidth, link):
-        """Chains biclusters
+    def linkSets(self, tailWidth, link):
+        """Returns the heads and tails chain() chains through link
         
+        Links that can't chain are counted in the chain performance monitors.
         @param tailWidth number of condition in second bicluster
-                         (seed biclusters are used head widht)
         @param link condition linking chain
+        @return (headGroup, headSet, tailGroup, liveTails, tailUnion) or None
+                if no bicluster can be chained through link
         """
         
         # chain too big
         if tailWidth + 1 > self.maxConditions:
             self.widthTooBig += 1
-            return 0
+            return None
         
         if 2 not in self.cache:
             self.noHeadWidth += 1
-            return 0
+            return None
         headGroup = self.cache[2]
         headSet = headGroup.heads[link]
         
         if len(headSet) == 0:
             self.noHeadLink += 1
-            return 0
+            return None
         
         if tailWidth not in self.cache:
             self.noTailWidth += 1
-            return 0
+            return None
         tailGroup = self.cache[tailWidth]
         tailSet = tailGroup.tails[link]
         
         if len(tailSet) == 0:
             self.noTailLink += 1
+            return None
+        
+        if self.linkBounds(2, tailWidth)[link] < self.minGenes:
+            self.linkBound += 1
+            return None
+        tailUnion = self.tailUnion(tailWidth, link)
+        
+        # tails are sorted by decreasing gene count, so all tails after the
+        # first one with fewer than minGenes genes are skipped at once
+        tailOrder, tailCounts = tailGroup.tailsByCount[link]
+        liveTails = tailOrder[:tailGroup.tailsByCount.live(tailCounts,
+                                                           self.minGenes)]
+        if liveTails.size == 0:
+            self.insufficientGenes += len(tailSet)
+            return None
+        
+        return (headGroup, headSet, tailGroup, liveTails, tailUnion)
+    
+    def chain(self, tailWidth, link):
+        """Chains biclusters
+        
+        @param tailWidth number of condition in second bicluster
+                         (seed biclusters are used head widht)
+        @param link condition linking chain
+        """
+        
+        # a writer thread may be using the file, which only the tiles read
+        # under the lock
+        if self.memoryLimit is not None or self.writer is not None:
+            count = 0
+            for heads, tails in self.linkTiles(tailWidth, link):
+                count += self.chainTile(heads, tails)
+            
+            self.flush()
+            
+            return count
+        
+        sets = self.linkSets(tailWidth, link)
+        if sets is None:
             return 0
+        headGroup, headSet, tailGroup, liveTails, tailUnion = sets
         
         progressBar = \
             Biclustering.Timing.ProgressBar(len(headSet),
                                             "  Link %d" % link)
         
+        # scratch sets overwritten by every pair instead of allocating
+        scratchGenes = self.genePool.acquire()
+        scratchConditions = self.scratchConditions(tailWidth + 1)
+        
+        headDepth = headGroup.depth()
+        tailDepth = tailGroup.depth()
+        
+        # extracting all indexes at once is faster than iterating the BitSet
+        headIndexes = headSet.toIndices()
+        headSignatures = headGroup.genes.signatureRows(headIndexes)
+        
+        liveTails = numpy.sort(liveTails)
+        tailSignatures = tailGroup.genes.signatureRows(liveTails)
+        
         count = 0
-        for headIndex in headSet:
+        for headRow, headIndex in enumerate(headIndexes.tolist()):
             progressBar.update()
             
             headGenes = headGroup.genes[headIndex]
             
+            # no tail can share enough genes with this head
+            reachable = headGenes.intersectionInto(tailUnion, scratchGenes)
+            if len(reachable) < self.minGenes:
+                self.headBound += 1
+                continue
+            
             headConditions = headGroup.conditions[headIndex]
             # BUG FIX cast for pytables compatibility
             nonLinkingCondition = int(headConditions[0])
-            chainableSet = tailSet & tailGroup.nonMembers[nonLinkingCondition]
+            nonMembers = tailGroup.nonMembers[nonLinkingCondition]
+            # increasing tail order pools in increasing chainId() order
+            chainable = \
+                numpy.where(Biclustering.Bit.members(nonMembers, liveTails))[0]
             
-            for tailIndex in chainableSet:
+            # tails whose signatures bound the common genes below minGenes
+            bounds = Biclustering.Bit.signatureBounds(
+                headSignatures[headRow], tailSignatures[chainable])
+            possible = bounds >= self.minGenes
+            self.signatureBound += int(chainable.size - possible.sum())
+            
+            for tailIndex in liveTails[chainable[possible]]:
+                # BUG FIX pytables doesn't understand numpy integer types
+                tailIndex = int(tailIndex)
                 tailGenes = tailGroup.genes[tailIndex]
                 
-                genes = headGenes & tailGenes
+                genes = headGenes.intersectionInto(tailGenes, scratchGenes)
                 
                 # if not enough common genes for valid bicluster
                 geneCount = len(genes)
@@ -157,9 +200,14 @@ class Group(object):
                     self.insufficientGenes += 1
                     continue
                 
-                conditions = headConditions.chain(tailGroup.conditions[tailIndex])
+                tailConditions = tailGroup.conditions[tailIndex]
+                conditions = headConditions.chain(tailConditions,
+                                                  scratchConditions)
                 
-                self.pool(conditions, genes)
+                id = Biclustering.Bicluster.chainId(link, headIndex,
+                                                    tailIndex, headDepth,
+                                                    tailDepth)
+                self.pool(conditions, genes, id)
                 count += 1
                 # under special conditions merged biclusters can be pruned
                 if geneCount == len(headGenes):
@@ -168,10 +216,167 @@ class Group(object):
                     tailGroup.nested[tailIndex] = NESTED.nested
         
         progressBar.finish()
-        self.file.flush()
+        self.genePool.release(scratchGenes)
+        self.flush()
         
         return count
+    
+    def tileRows(self):
+        """Returns the number of heads and of tails in one tile of linkTiles()
+        
+        A tile pair needs its head rows, its tail rows and the head x tail
+        intersections, which dominate, so a tile is the square root of the
+        memory limit in gene rows.  Without a memoryLimit TILE_MEMORY is used.
+        """
+        memoryLimit = self.memoryLimit
+        if memoryLimit is None:
+            memoryLimit = self.TILE_MEMORY
+        
+        rowBytes = 4 * Biclustering.BitSet.arraySize(self.maxGenes)
+        
+        return max(1, int(numpy.sqrt(memoryLimit // rowBytes)))
+    
+    def linkTiles(self, tailWidth, link):
+        """Yields the heads and tails of link a tile at a time
+        
+        Heads and tails are read in tiles of tileRows() rows, in increasing
+        index order so the reads are sequential.  Each head tile is paired
+        with every tail tile, so only the tiles of one pair are in memory and
+        the heads and tails of a link can be larger than memory.  The file is
+        only read while holding the lock, so tiles can be produced on another
+        thread.
+        @param tailWidth number of condition in second bicluster
+        @param link condition linking chain
+        @return generator of (heads, tails) Tiles for chainTile()
+        """
+        self.lock.acquire()
+        try:
+            sets = self.linkSets(tailWidth, link)
+        finally:
+            self.lock.release()
+        if sets is None:
+            return
+        headGroup, headSet, tailGroup, liveTails, tailUnion = sets
+        
+        tile = self.tileRows()
+        heads = headSet.toIndices()
+        # increasing order so tails are read sequentially
+        tails = numpy.sort(liveTails)
+        union = tailUnion.asArray()
+        
+        for headStart in xrange(0, heads.size, tile):
+            headIndexes = heads[headStart:headStart + tile]
+            
+            self.lock.acquire()
+            try:
+                headGenes = headGroup.genes.rows(headIndexes)
+                
+                # no tail can share enough genes with these heads
+                reachable = Biclustering.Bit.popCounts(headGenes & union) >= \
+                            self.minGenes
+                self.headBound += int(headIndexes.size - reachable.sum())
+                if not reachable.any():
+                    continue
+                
+                headTile = Tile(headGroup, headIndexes[reachable],
+                                headGenes[reachable])
+            finally:
+                self.lock.release()
+            
+            for tailStart in xrange(0, tails.size, tile):
+                self.lock.acquire()
+                try:
+                    tailTile = Tile(tailGroup,
+                                    tails[tailStart:tailStart + tile])
+                finally:
+                    self.lock.release()
+                
+                yield (headTile, tailTile)
+    
+    def chainTile(self, heads, tails):
+        """Chains every head of a tile with every tail of another tile
+        
+        The signature bounds are computed for the whole tile pair at once and
+        only the pairs they don't reject are intersected.  Only marking nested
+        heads and tails holds the lock; pool() takes it itself.
+        @param heads Tile of heads
+        @param tails Tile of tails of the same link
+        @return number of valid biclusters chained
+        """
+        # tails must not contain the non-linking condition of heads
+        tailMembers = Biclustering.Bit.unpackBits(tails.conditions,
+                                                  self.maxConditions)
+        chainable = ~tailMembers[:, heads.orders[:, 0]].T
+        
+        # only pairs whose signatures allow minGenes common genes are
+        # intersected
+        bounds = Biclustering.Bit.signatureBounds(
+            heads.signatures[:, numpy.newaxis, :],
+            tails.signatures[numpy.newaxis, :, :])
+        possible = bounds >= self.minGenes
+        self.signatureBound += int((chainable & ~possible).sum())
+        
+        pairHeads, pairTails = numpy.where(chainable & possible)
+        # no pair left to intersect, so nothing is pooled or nested
+        if pairHeads.size == 0:
+            return 0
+        
+        genes = heads.genes[pairHeads] & tails.genes[pairTails]
+        geneCounts = Biclustering.Bit.popCounts(genes)
+        
+        sufficient = geneCounts >= self.minGenes
+        self.insufficientGenes += int((~sufficient).sum())
+        
+        survivorHeads = pairHeads[sufficient]
+        survivorTails = pairTails[sufficient]
+        survivorGenes = genes[sufficient]
+        survivorCounts = geneCounts[sufficient]
+        
+        count = 0
+        for pair in xrange(survivorHeads.size):
+            head = survivorHeads[pair]
+            tail = survivorTails[pair]
+            geneCount = int(survivorCounts[pair])
+            
+            pairGenes = \
+                Biclustering.BitSet.BitSet(self.maxGenes,
+                                           survivorGenes[pair].copy(),
+                                           True, geneCount)
+            order = numpy.concatenate((heads.orders[head],
+                                       tails.orders[tail][1:]))
+            conditionSet = \
+                Biclustering.BitSet.BitSet(self.maxConditions,
+                                           heads.conditions[head] |
+                                           tails.conditions[tail],
+                                           True)
+            conditions = Biclustering.Bit.OrderedBitSet(order,
+                                                        set = conditionSet)
+            
+            # heads have width 2, so the link ends their order
+            id = Biclustering.Bicluster.chainId(int(heads.orders[head, -1]),
+                                                int(heads.indexes[head]),
+                                                int(tails.indexes[tail]),
+                                                heads.depth, tails.depth)
+            self.pool(conditions, pairGenes, id)
+            count += 1
+        
+        # under special conditions merged biclusters can be pruned
+        nestedHeads = \
+            survivorHeads[survivorCounts == heads.counts[survivorHeads]]
+        nestedTails = \
+            survivorTails[survivorCounts == tails.counts[survivorTails]]
+        
+        self.lock.acquire()
+        try:
+            for head in numpy.unique(nestedHeads):
+                heads.group.nested[int(heads.indexes[head])] = NESTED.nested
+            for tail in numpy.unique(nestedTails):
+                tails.group.nested[int(tails.indexes[tail])] = NESTED.nested
+        finally:
+            self.lock.release()
         
+        return count
+    
     
     def chainPreCrest(self, headWidth, link, doubling = False):
         """Chains biclusters
@@ -223,22 +428,49 @@ class Group(object):
             self.noTailLink += 1
             return 0
         
+        if self.linkBounds(headWidth, tailWidth)[link] < self.minGenes:
+            self.linkBound += 1
+            return 0
+        tailUnion = self.tailUnion(tailWidth, link)
+        
         progressBar = \
             Biclustering.Timing.ProgressBar(len(headIndexes),
                                             "  Link %d" % link)
         
+        # scratch sets overwritten by every pair instead of allocating
+        scratchGenes = self.genePool.acquire()
+        scratchConditions = self.scratchConditions(headWidth + tailWidth - 1)
+        
+        # extracting all indexes at once is faster than iterating the BitSets
+        tailArray = tailIndexes.toIndices()
+        tailSignatures = tailGroup.genes.signatureRows(tailArray)
+        
+        headArray = headIndexes.toIndices()
+        headSignatures = headGroup.genes.signatureRows(headArray)
+        
+        headDepth = headGroup.depth()
+        tailDepth = tailGroup.depth()
+        
         count = 0
-        for headIndex in headIndexes:
+        for headRow, headIndex in enumerate(headArray.tolist()):
             progressBar.update()
             
-            # BUG FIX pytables doesn't understand numpy integer types
-            headIndex = int(headIndex)
-            headConditions = headGroup.conditions[headIndex]
             headGenes = headGroup.genes[headIndex]
-            for tailIndex in tailIndexes:
-                # BUG FIX pytables doesn't understand numpy integer types
-                tailIndex = int(tailIndex)
-                
+            
+            # no tail can share enough genes with this head
+            reachable = headGenes.intersectionInto(tailUnion, scratchGenes)
+            if len(reachable) < self.minGenes:
+                self.headBound += 1
+                continue
+            
+            # tails whose signatures bound the common genes below minGenes
+            bounds = Biclustering.Bit.signatureBounds(headSignatures[headRow],
+                                                      tailSignatures)
+            possible = bounds >= self.minGenes
+            self.signatureBound += int(tailArray.size - possible.sum())
+            
+            headConditions = headGroup.conditions[headIndex]
+            for tailIndex in tailArray[possible].tolist():
                 tailConditions = tailGroup.conditions[tailIndex]
                 
                 # if reduntant conditions besides linking condition
@@ -247,7 +479,7 @@ class Group(object):
                     continue
                 
                 tailGenes = tailGroup.genes[tailIndex]
-                genes = headGenes & tailGenes
+                genes = headGenes.intersectionInto(tailGenes, scratchGenes)
                 
                 # if not enough common genes for valid bicluster
                 geneCount = len(genes)
@@ -255,9 +487,13 @@ class Group(object):
                     self.insufficientGenes += 1
                     continue
                 
-                conditions = headConditions.chain(tailConditions)
+                conditions = headConditions.chain(tailConditions,
+                                                  scratchConditions)
                 
-                self.pool(conditions, genes)
+                id = Biclustering.Bicluster.chainId(link, headIndex,
+                                                    tailIndex, headDepth,
+                                                    tailDepth)
+                self.pool(conditions, genes, id)
                 count += 1
                 # under special conditions merged biclusters can be pruned
                 if geneCount == len(headGenes):
@@ -266,309 +502,312 @@ class Group(object):
                     tailGroup.nested[tailIndex] = NESTED.nested
         
         progressBar.finish()
-        self.file.flush()
+        self.genePool.release(scratchGenes)
+        self.flush()
         
         return count
+
+class Tile(object):
+    """Rows of a width group read as 2D arrays for Group.chainTile()"""
     
-    def chainStats(self, reset=False):
-        """Prints performance stats for chain
+    def __init__(self, group, indexes, genes=None):
+        """Reads the rows of indexes
         
-        @param reset [False] True to reset stats to 0.
-        """
-        logging.debug("No Head Width: %s", self.noHeadWidth)
-        logging.debug("No Head Link: %s", self.noHeadLink)
-        logging.debug("No Tail Link: %s", self.noTailLink)
-        logging.debug("Redundant Condition: %s", self.redundantCondition)
-        logging.debug("Insufficient Genes: %s", self.insufficientGenes)
-        
-        if reset:
-            self.noHeadWidth = 0
-            self.noHeadLink = 0
-            self.noTailLink = 0
-            self.redundantCondition = 0
-            self.insufficientGenes = 0
-    
-    def isNested(self, width, index):
-        """Marks the bicluster at index of width conditions if it is nested in another bicluster
-        
-        A Bicluster is considered nested if its genes are a subset of the
-        enclosing Bicluster's genes and the Bicluster's conditions are an
-        ordered subset of the enclosing Biclusters conditions.
-        @param bicluster Bicluster to test for nested-ness
-        @return True if bicluster is nested; False otherwise.
+        @param group width group to read
+        @param indexes increasing row indexes
+        @param genes gene words of indexes if already read
         """
+        self.group = group
+        self.indexes = indexes
         
-        if width not in self.cache:
-            return False
-        innerGroup = self.cache[width]
-        
-        # if already marked
-        if innerGroup.nested[index] == NESTED.nested:
-            return True
-        elif innerGroup.nested[index] == NESTED.nonnested:
-            return False
-        
-        if width + 1 not in self.cache:
-            innerGroup.nested[index] = NESTED.nonnested
-            return False
-        outerGroup = self.cache[width]
-        
-        genes = innerGroup.genes[index]
-        conditions = innerGroup.conditions[index]
-        
-        for outer in xrange(outerGroup.depth()):
-            # if nested genes are a subset
-            if (genes.issubset(outerGroup.genes[outer]) and
-                conditions.isOrderedSubset(outerGroup.conditions[outer])):
-                # nested-ness is a short-circuited 'or' attribute, so as so soon
-                # as one enclosing bicluster is found function can exit
-                innerGroup.nested[index] = NESTED.nested
-                return True
-        
-        # bicluster can only be marked as nonnested after all possible
-        # enclosing biclusters are checked
-        innerGroup.nested[index] = NESTED.nonnested
-        return False
-    
-    def depth(self, width, includeNested=True):
-        """Returns number of biclusters of width conditions
-        
-        @param width number of conditions in biclusters
-        @param includeNested True to include all biclusters; False to only
-               include biclusters not marked as nested
-        """
-        if width not in self.cache:
-            return 0
+        if genes is None:
+            genes = group.genes.rows(indexes)
+        self.genes = genes
+        self.counts = Biclustering.Bit.popCounts(genes)
+        self.signatures = group.genes.signatureRows(indexes)
+        self.depth = group.depth()
         
-        return self.cache[width].depth(includeNested)
+        self.orders, self.conditions = group.conditions.rows(indexes)
+
+class WidthGroupCache(Biclustering.Bicluster.WidthGroupCache):
     
-    def __str__(self):
-        rows = list()
-        
-        first = True
-        for width in xrange(2, self.maxConditions + 1):
-            if width not in self.cache:
-                break
-            
-            if first:
-                first = False
-            else:
-                rows.append("\n")
-            rows.append(str(self.cache[width]))
-        
-        return ''.join(rows)
+    def widthGroup(self, width):
+        nodeFile, parent = self.location(width)
+        return WidthGroup(nodeFile, parent, self.maxConditions,
+                          self.maxGenes, width)
 
-class WidthGroupCache(object):
+class WidthGroup(Biclustering.Bicluster.WidthGroup):
+    
+    # link indexes opened by index() and the nodes each one stores
+    LINK_INDEXES = {
+        "heads": ("heads", "headsCounts", "headsRows"),
+        "tails": ("tails", "tailsCounts", "tailsRows"),
+        "nonMembers": ("nonMemebers", "nonMemebersCounts",
+                       "nonMemebersRows"),
+        "tailsByCount": ("tailsByCount", "tailsByCountRows"),
+    }
+    INDEX_NODES = Biclustering.Bicluster.WidthGroup.INDEX_NODES + \
+                  tuple([node for nodes in LINK_INDEXES.values()
+                         for node in nodes])
     
-    SLOTS = 3
+    def __init__(self, file, parent, maxConditions, maxGenes, width):
+        super(WidthGroup, self).__init__(file, parent, maxConditions, maxGenes,
+                                         width)
+        
+        # reload indexes built before this group was last evicted from cache
+        if hasattr(self.group, "heads"):
+            self.index()
     
-    def __init__(self, file, parent, maxConditions, maxGenes):
-        """Creates a WidthGroup cache with 2 slots
+    def index(self):
+        """Opens the indexes used by chain()
         
-        Cache is fully associative
-        @param maxConditions maxConditions in biclusters in width groups held in cache
+        Entries are only built when chain() first reads their link.
         """
-        self.file = file
-        self.parent = parent
-        self.maxConditions = maxConditions
-        self.maxGenes = maxGenes
-        
-        widthClass = Biclustering.Sizing.sizeArray(self.maxConditions)
-        self.widths = numpy.zeros(self.SLOTS,
-                                  dtype = widthClass)
-        self.groups = numpy.zeros(self.SLOTS, dtype = WidthGroup)
-        ageClass = Biclustering.Sizing.sizeArray(self.SLOTS)
-        self.ages = numpy.arange(self.SLOTS, dtype = ageClass)
-    
-    def __contains__(self, width):
-        return widthGroupName(width) in self.parent
-    
-    def updateAges(self, slot):
-        if self.ages[slot] != 0:
-            agedSlots = numpy.where(self.ages < self.ages[slot])
-            self.ages[agedSlots] += 1
-            self.ages[slot] = 0
-    
-    def __getitem__(self, width):
-        slot = numpy.where(self.widths == width)
-        # if single slot returned
-        if len(slot) == 1:
-            slot = slot[0]
-            group = self.groups[slot]
-            
-            self.updateAges(slot)
-        else:
-            group = WidthGroup(self.file, self.parent, self.maxConditions,
-                               self.maxGenes, width)
-            
-            slot = numpy.where(self.ages == self.SLOTS - 1)
-            self.groups[slot] = group
-            self.widths[slot] = width
-            
-            self.updateAges(slot)
+        self.heads = PositionIndex(self, "heads", -1)
+        self.tails = PositionIndex(self, "tails", 0)
+        self.nonMembers = NonMemberIndex(self, "nonMemebers")
+        self.tailsByCount = CountOrderIndex(self, "tailsByCount", 0)
+    
+    def dropIndexes(self):
+        super(WidthGroup, self).dropIndexes()
         
-        return group
-
-def widthGroupName(width):
-    return "width" + str(width)
-
-class WidthGroup(object):
+        for attribute in self.LINK_INDEXES:
+            if hasattr(self, attribute):
+                delattr(self, attribute)
 
-    def __init__(self, file, parent, maxConditions, maxGenes, width):
-        """Returns group for storing bicluster of width conditions."""
-        self.file = file
-        self.maxConditions = maxConditions
-        self.maxGenes = maxGenes
-        self.width = width
+class LinkIndex(object):
+    """Index with one entry per link, built the first time the link is read
+    
+    Entries are appended to storage in the order they are built and the
+    name + "Rows" EArray maps each link to the row of its entry, or -1 until it
+    is built, so links chain() never reads are never built.  Entries built on
+    a read-only file are only kept in memory.
+    """
+    
+    def __init__(self, outer, name):
+        """Loads or creates index name of width group outer
         
-        name = widthGroupName(width)
-        try:
-            self.group = file.getNode(parent, name)
-        except tables.NoSuchNodeError:
-            self.group = file.createGroup(parent, name)
+        @param outer width group being indexed
+        @param name name of the index in the width group
+        """
+        self.outer = outer
+        self.name = name
+        self.writable = outer.file.mode != "r"
+        
+        # link -> entry built on a read-only file
+        self.built = dict()
         
-        self.conditions = Biclustering.Bit.OrderedSetArray(file, self.group,
-                                                           "conditions", width,
-                                                           maxConditions)
-        self.genes = Biclustering.Bit.SetArray(file, self.group, "genes",
-                                               maxGenes)
+        self.open()
         
+        rowsName = name + "Rows"
         try:
-            self.nested = self.group.nested
+            self.rowArray = outer.file.getNode(outer.group, rowsName)
+            self.rows = self.rowArray[:]
         except tables.NoSuchNodeError:
-            self.nested = file.createEArray(self.group,
-                                            "nested",
-                                            NESTED_ATOM)
+            if self.stored() == outer.maxConditions:
+                # built for every link before links were built on demand
+                self.rows = numpy.arange(outer.maxConditions,
+                                         dtype = numpy.int64)
+            else:
+                self.rows = -numpy.ones(outer.maxConditions,
+                                        dtype = numpy.int64)
+            
+            if self.writable:
+                atom = tables.Int64Atom(shape = (0,), flavor = 'numpy')
+                self.rowArray = outer.file.createEArray(outer.group, rowsName,
+                                                        atom)
+                self.rowArray.append(self.rows)
     
-    def pool(self, conditions, genes):
-        self.conditions.append(conditions)
-        self.genes.append(genes)
-        self.nested.append((NESTED.unknown,))
+    def open(self):
+        """Loads or creates the storage of the entries"""
+        raise NotImplementedError("index must provide storage")
     
-    def index(self):
-        self.heads = PositionIndex(self, "heads", -1)
-        self.tails = PositionIndex(self, "tails", 0)
-        self.nonMembers = NonMemberIndex(self, "nonMemebers")
+    def stored(self):
+        """Returns number of entries in storage"""
+        raise NotImplementedError("index must provide storage")
     
-    def __str__(self):
-        rows = list()
-        first = True
-        for conditions, genes in itertools.izip(self.conditions, self.genes):
-            if first:
-                first = False
-            else:
-                rows.append("\n")
-            
-            rows.append("Conditions: %s Genes: %s" % (conditions, genes))
-        
-        return ''.join(rows)
+    def store(self, entry):
+        """Appends entry to storage and returns its row"""
+        raise NotImplementedError("index must provide storage")
     
-    def duplicateSearch(self):
-        combinations = Biclustering.Combinatorics.xcombinations(self.depth(), 2)
+    def load(self, row):
+        """Returns the entry in row of storage"""
+        raise NotImplementedError("index must provide storage")
+    
+    def build(self, link):
+        """Returns the entry of link computed from the width group"""
+        raise NotImplementedError("index must build entries")
+    
+    def __getitem__(self, link):
+        link = int(link)
+        
+        row = self.rows[link]
+        if row >= 0:
+            return self.load(int(row))
+        
+        if link in self.built:
+            return self.built[link]
+        
+        entry = self.build(link)
+        if self.writable:
+            row = self.store(entry)
+            self.rows[link] = row
+            self.rowArray[link:link + 1] = numpy.array((row,),
+                                                       dtype = numpy.int64)
+        else:
+            self.built[link] = entry
         
+        return entry
+    
+    def refresh(self):
+        """Builds the entry of every link not built yet"""
         progressBar = \
-            Biclustering.Timing.ProgressBar(combinations.len(),
-                                                "Duplicate Search")
+            Biclustering.Timing.ProgressBar(self.outer.maxConditions, self.name)
         
-        for indexes in combinations:
+        for link in xrange(self.outer.maxConditions):
             progressBar.update()
             
-            # BUG FIX numpy ints
-            index0 = int(indexes[0])
-            index1 = int(indexes[1])
-            
-            if self.conditions[index0] != self.conditions[index1]:
-                continue
-            
-            if self.genes[index0] != self.genes[index1]:
-                logging.debug("%s and %s have same conditions", indexes[0], indexes[1])
-            else:
-                logging.debug("%s == %s", indexes[0], indexes[1])
+            self[link]
         
         progressBar.finish()
+
+class SetIndex(LinkIndex):
+    """LinkIndex whose entries are BitSets of bicluster indexes"""
     
-    def depth(self, includeNested=True):
-        """Returns number of biclusters of width conditions
-        
-        @param width number of conditions in biclusters
-        @param includeNested True to include all biclusters; False to only
-               include biclusters not marked as nested
-        """
-        
-        if includeNested:
-            count = self.nested.nrows
+    def open(self):
+        if self.writable or hasattr(self.outer.group, self.name):
+            self.index = Biclustering.Bit.SetArray(self.outer.file,
+                                                   self.outer.group,
+                                                   self.name,
+                                                   self.outer.depth())
         else:
-            count = len(numpy.where(self.nested[:] != NESTED.nested))
+            self.index = None
+    
+    def stored(self):
+        if self.index is None:
+            return 0
         
-        return count
-
-class PositionIndex(object):
+        return len(self.index)
+    
+    def store(self, entry):
+        self.index.append(entry)
+        
+        return len(self.index) - 1
+    
+    def load(self, row):
+        return self.index[row]
 
-    def __init__(self, outer, name, position, generateIndex=False):
+class PositionIndex(SetIndex):
+    """Biclusters with each condition at a position of their order"""
+    
+    def __init__(self, outer, name, position):
         """Returns index based on condition value at position"""
-        self.outer = outer
-        self.name = name
         self.position = position
+        # condition at position of every bicluster, read on first build
+        self.positions = None
         
-        if not hasattr(outer.group, name):
-            generateIndex = True
+        super(PositionIndex, self).__init__(outer, name)
+    
+    def build(self, link):
+        # the first or last condition is a range of the OrderIndex
+        if self.position == 0:
+            entry = self.outer.orderIndex().startsWith((link,))
+        elif self.position == -1:
+            entry = self.outer.orderIndex().endsWith((link,))
+        else:
+            if self.positions is None:
+                self.positions = self.outer.conditions.positions(self.position)
+            entry = numpy.where(self.positions == link)[0]
         
-        self.index = Biclustering.Bit.SetArray(outer.file,
-                                               outer.group,
-                                               name,
-                                               outer.depth())
+        return Biclustering.BitSet.BitSet(self.outer.depth(), entry)
+
+class NonMemberIndex(SetIndex):
+    """Biclusters without each condition"""
+    
+    def build(self, link):
+        entry = self.outer.conditions.whereNot(link)[0]
         
-        if generateIndex:
-            self.refresh()
+        return Biclustering.BitSet.BitSet(self.outer.depth(), entry)
+
+class CountOrderIndex(LinkIndex):
+    """Biclusters with each condition at a position of their order, sorted by
+    decreasing gene count
     
-    def __getitem__(self, value):
-        return self.index[value]
+    Gene counts are stored next to the indexes so chain() can cut off all
+    biclusters with too few genes without reading them.
+    """
     
-    def refresh(self):
+    def __init__(self, outer, name, position):
+        """Returns index based on condition value at position"""
+        self.position = position
+        # condition at position and gene count of every bicluster, read on
+        # first build
+        self.positions = None
+        self.geneCounts = None
         
-        progressBar = \
-            Biclustering.Timing.ProgressBar(self.outer.maxConditions, self.name)
+        super(CountOrderIndex, self).__init__(outer, name)
+    
+    def open(self):
+        outer = self.outer
         
-        for i in xrange(self.outer.maxConditions):
-            progressBar.update()
+        try:
+            group = outer.file.getNode(outer.group, self.name)
+            self.indexes = group.indexes
+            self.counts = group.counts
+        except tables.NoSuchNodeError:
+            if not self.writable:
+                self.indexes = self.counts = None
+                return
             
-            entry = self.outer.conditions.where(self.position, i)
-            entrySet = Biclustering.BitSet.BitSet(self.outer.depth(), entry)
-            self.index.append(entrySet)
-        
-        progressBar.finish()
-
-class NonMemberIndex(object):
-
-    def __init__(self, outer, name, generateIndex=False):
-        """Returns index based on condition value at position"""
-        self.outer = outer
-        self.name = name
-        
-        if not hasattr(outer.group, name):
-            generateIndex = True
+            try:
+                group = outer.file.getNode(outer.group, self.name)
+            except tables.NoSuchNodeError:
+                group = outer.file.createGroup(outer.group, self.name)
+            
+            indexAtom = Biclustering.Sizing.sizeAtom(max(outer.depth(), 1))
+            self.indexes = outer.file.createVLArray(group, "indexes",
+                                                    indexAtom(flavor = 'numpy'))
+            countAtom = Biclustering.Sizing.sizeAtom(outer.maxGenes + 1)
+            self.counts = outer.file.createVLArray(group, "counts",
+                                                   countAtom(flavor = 'numpy'))
+    
+    def stored(self):
+        if self.indexes is None:
+            return 0
         
-        self.index = Biclustering.Bit.SetArray(outer.file,
-                                               outer.group,
-                                               name,
-                                               outer.depth())
+        return self.indexes.nrows
+    
+    def store(self, entry):
+        indexes, counts = entry
+        self.indexes.append(indexes)
+        self.counts.append(counts)
         
-        if generateIndex:
-            self.refresh()
+        return self.indexes.nrows - 1
     
-    def __getitem__(self, value):
-        return self.index[value]
+    def load(self, row):
+        """Returns (indexes, counts) of biclusters with value at position"""
+        return (self.indexes[row], self.counts[row])
     
-    def refresh(self):
+    def live(self, counts, minGenes):
+        """Returns number of leading entries of counts with at least minGenes
         
-        progressBar = \
-            Biclustering.Timing.ProgressBar(self.outer.maxConditions, self.name)
+        @param counts gene counts in decreasing order
+        @param minGenes min genes for a valid bicluster
+        """
+        return int(numpy.searchsorted(-counts.astype(numpy.int64), -minGenes,
+                                      'right'))
+    
+    def build(self, link):
+        if self.geneCounts is None:
+            self.geneCounts = self.outer.genes.counts()
         
-        for i in xrange(self.outer.maxConditions):
-            progressBar.update()
-            
-            entry = self.outer.conditions.whereNot(i)
-            entrySet = Biclustering.BitSet.BitSet(self.outer.depth(), entry)
-            self.index.append(entrySet)
+        if self.position == 0:
+            entry = self.outer.orderIndex().startsWith((link,))
+        else:
+            if self.positions is None:
+                self.positions = self.outer.conditions.positions(self.position)
+            entry = numpy.where(self.positions == link)[0]
+        # decreasing count, then index
+        entry = entry[numpy.argsort(-self.geneCounts[entry], kind = 'mergesort')]
         
-        progressBar.finish()
+        return (entry, self.geneCounts[entry])
@@ -0,0 +1,257 @@
+# Parallel Biclustering Algorithm - Fast Algorithm for finding all biclusters in a GEM
+# Copyright (C) 2006  Luke Imhoff
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+# Contact Info:
+#   Luke Imhoff (imho0030@umn.edu)
+#   220 Delaware St. SE
+#   Minneapolis, MN 55455
+"""Streaming creation of GEMs from expression files
+
+Expression files are read in chunks of rows (genes).  Each chunk is appended
+to the raw EArray and packed into per-row condition ranks and condition orders
+that are appended to the packed and permutation EArrays, so the full float
+matrix is never held in memory, let alone twice.  Ranks only depend on the
+values in their own row, so packing by chunk gives the same ranks as packing
+the whole matrix.
+
+@author Luke Imhoff
+@license GPLv2
+"""
+
+import csv
+import itertools
+import numpy
+import os
+import tables
+
+import Biclustering.GeneExpressionMatrix
+import Biclustering.Sizing
+
+# rows read, packed and written at once
+CHUNK_ROWS = 1 << 12
+
+def readDelimited(fileName, delimiter=None, skipRows=0, skipColumns=0,
+                  chunkRows=CHUNK_ROWS):
+    """Yields chunks of rows of a delimited text file
+    
+    @param fileName name of the file
+    @param delimiter column delimiter.  Defaults to ',' for .csv files and tab
+                     otherwise
+    @param skipRows number of header rows to skip
+    @param skipColumns number of leading columns to skip, such as gene names
+    @param chunkRows rows per chunk
+    @return generator of 2D float arrays
+    """
+    if delimiter is None:
+        if fileName.lower().endswith(".csv"):
+            delimiter = ","
+        else:
+            delimiter = "\t"
+    
+    source = open(fileName, "rb")
+    try:
+        for i in xrange(skipRows):
+            source.readline()
+        
+        reader = csv.reader(source, delimiter = delimiter)
+        while True:
+            rows = [[float(value) for value in row[skipColumns:]]
+                    for row in itertools.islice(reader, chunkRows)
+                    if len(row) != 0]
+            if len(rows) == 0:
+                break
+            
+            yield numpy.array(rows, dtype = numpy.float64)
+    finally:
+        source.close()
+
+def readHDF5(fileName, node=None, chunkRows=CHUNK_ROWS, transposed=False):
+    """Yields chunks of rows of a 2D array in an HDF5 file
+    
+    @param fileName name of the file
+    @param node path of the array.  Defaults to the first array in the file
+    @param chunkRows rows per chunk
+    @param transposed True if the array is stored with one column per row of
+                      the matrix, as MATLAB 7.3 files store matrices
+    @return generator of 2D float arrays
+    """
+    source = tables.openFile(fileName, mode = "r")
+    try:
+        if node is None:
+            for array in source.walkNodes("/", "Array"):
+                # MATLAB keeps the targets of references under /#refs#
+                if not array._v_pathname.startswith("/#"):
+                    break
+            else:
+                raise ValueError("%s has no arrays" % fileName)
+        else:
+            array = source.getNode(node)
+        
+        if transposed:
+            # a block of columns of the array is a chunk of rows of the matrix
+            rows = array.shape[1]
+            for start in xrange(0, rows, chunkRows):
+                stop = min(start + chunkRows, rows)
+                yield numpy.ascontiguousarray(array[:, start:stop].T,
+                                              dtype = numpy.float64)
+        else:
+            rows = array.shape[0]
+            for start in xrange(0, rows, chunkRows):
+                stop = min(start + chunkRows, rows)
+                yield numpy.asarray(array[start:stop], dtype = numpy.float64)
+    finally:
+        source.close()
+
+def readMat(fileName, variable=None, chunkRows=CHUNK_ROWS):
+    """Yields chunks of rows of a matrix in a MATLAB .mat file
+    
+    Version 7.3 files are HDF5 and are streamed.  MATLAB writes matrices
+    column-major, so their HDF5 arrays hold the transpose of the matrix and are
+    read a block of columns at a time.  Older versions can only be loaded
+    whole, so only the packing and writing are chunked.
+    @param fileName name of the file
+    @param variable name of the matrix.  Defaults to the first one in the file
+    @param chunkRows rows per chunk
+    @return generator of 2D float arrays
+    """
+    if tables.isHDF5File(fileName):
+        if variable is None:
+            node = None
+        else:
+            node = "/" + variable
+        
+        for chunk in readHDF5(fileName, node, chunkRows, True):
+            yield chunk
+        return
+    
+    import scipy.io
+    
+    variables = scipy.io.loadmat(fileName)
+    if variable is None:
+        names = sorted([name for name in variables
+                        if not name.startswith("__")])
+        if len(names) == 0:
+            raise ValueError("%s has no variables" % fileName)
+        variable = names[0]
+    
+    matrix = variables[variable]
+    del variables
+    
+    for start in xrange(0, matrix.shape[0], chunkRows):
+        yield numpy.asarray(matrix[start:start + chunkRows],
+                            dtype = numpy.float64)
+
+# file extension -> reader
+READERS = {
+    '.csv': readDelimited,
+    '.tsv': readDelimited,
+    '.txt': readDelimited,
+    '.h5': readHDF5,
+    '.hdf': readHDF5,
+    '.hdf5': readHDF5,
+    '.mat': readMat,
+}
+
+def reader(fileName, chunkRows=CHUNK_ROWS, **options):
+    """Returns chunks of rows of fileName with the reader for its extension
+    
+    @param fileName name of the file
+    @param chunkRows rows per chunk
+    @param options options of the reader, such as skipColumns
+    @return generator of 2D float arrays
+    """
+    extension = os.path.splitext(fileName)[1].lower()
+    if extension not in READERS:
+        raise ValueError("no reader for %s files" % extension)
+    
+    return READERS[extension](fileName, chunkRows = chunkRows, **options)
+
+def writeChunks(nodeFile, group, chunks):
+    """Appends chunks to the raw, packed and permutation EArrays of group
+    
+    @param nodeFile file of group
+    @param group /gem group
+    @param chunks iterable of 2D float arrays with the same number of columns
+    @return (genes, conditions)
+    """
+    raw = None
+    for chunk in chunks:
+        if raw is None:
+            conditions = chunk.shape[1]
+            
+            rawAtom = tables.Float64Atom(shape = (0, conditions),
+                                         flavor = 'numpy')
+            raw = nodeFile.createEArray(group, "raw", rawAtom)
+            
+            packedClass = Biclustering.Sizing.sizeAtom(conditions)
+            packedAtom = packedClass(shape = (0, conditions), flavor = 'numpy')
+            packed = nodeFile.createEArray(group, "packed", packedAtom)
+            permutation = nodeFile.createEArray(group, "permutation",
+                                                packedAtom)
+        elif chunk.shape[1] != conditions:
+            raise ValueError("rows have %d conditions, not %d" %
+                             (chunk.shape[1], conditions))
+        
+        raw.append(chunk)
+        
+        ranks = Biclustering.GeneExpressionMatrix.packData(chunk)
+        packed.append(ranks)
+        permutation.append(
+            Biclustering.GeneExpressionMatrix.conditionOrder(ranks))
+    
+    if raw is None:
+        raise ValueError("no rows to ingest")
+    
+    return (raw.nrows, conditions)
+
+def ingest(name, source, path=None, minGenes=2, filters=None, engine=None,
+           sharded=False, chunkRows=CHUNK_ROWS, **options):
+    """Creates a GEM from an expression file without loading it whole
+    
+    @param name name of GEM.  Used for the file name
+    @param source expression file (.csv, .tsv, .txt, .h5, .hdf5 or .mat) with
+                  one row per gene and one column per condition
+    @param path directory of the GEM.  Defaults to PWD
+    @param minGenes min genes for a valid bicluster
+    @param filters pytables Filters for the file
+    @param engine name of bicluster engine
+    @param sharded True to store each width in its own file
+    @param chunkRows rows read at once
+    @param options options of the reader (see readDelimited(), readHDF5() and
+                   readMat())
+    @return GeneExpressionMatrix
+    """
+    GeneExpressionMatrix = \
+        Biclustering.GeneExpressionMatrix.GeneExpressionMatrix
+    
+    if path is None:
+        path = "./"
+    
+    if filters is None:
+        filters = GeneExpressionMatrix.FILTERS
+    
+    fileName = path + name + "." + GeneExpressionMatrix.FILE_EXTENSION
+    nodeFile = tables.openFile(fileName, mode = "w", title = name,
+                               filters = filters)
+    try:
+        group = nodeFile.createGroup("/", "gem")
+        writeChunks(nodeFile, group, reader(source, chunkRows, **options))
+    finally:
+        nodeFile.close()
+    
+    return GeneExpressionMatrix(name, None, path, minGenes, filters, engine,
+                                sharded = sharded)
@@ -0,0 +1,238 @@
+# Parallel Biclustering Algorithm - Fast Algorithm for finding all biclusters in a GEM
+# Copyright (C) 2006  Luke Imhoff
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+# Contact Info:
+#   Luke Imhoff (imho0030@umn.edu)
+#   220 Delaware St. SE
+#   Minneapolis, MN 55455
+"""Multiprocess versions of the PBA stages
+
+Workers open their own read-only handle on the GEM file, or memory-map the
+packed matrix, compute results for a range of biclusters or condition pairs and
+send them back to the parent, which is the only process that writes to the
+file.
+
+@author Luke Imhoff
+@license GPLv2
+"""
+
+import multiprocessing
+import numpy
+import os
+import tables
+import tempfile
+
+import Biclustering.Bicluster
+import Biclustering.Bit
+
+# number of index ranges handed to each process so a slow range does not leave
+# the other processes idle
+RANGES_PER_PROCESS = 4
+
+# condition pairs compared at once by splitRange
+SPLIT_PAIRS = 256
+
+# per-process state set up by initializeWorker
+workerFile = None
+workerGroup = None
+
+# per-process state set up by initializeSplitWorker
+workerMatrix = None
+workerMinGenes = None
+
+def initializeWorker(fileName, groupClass, maxConditions, maxGenes):
+    """Opens a read-only Group on fileName for the worker process
+    
+    @param fileName name of the GEM file
+    @param groupClass class of the Group holding the biclusters
+    @param maxConditions max condition indexes in any one bicluster
+    @param maxGenes max gene indexes in any one bicluster
+    """
+    global workerFile, workerGroup
+    
+    workerFile = tables.openFile(fileName, mode = "r")
+    workerGroup = groupClass(workerFile, "/", maxConditions, maxGenes, False)
+
+def pruneRange(task):
+    """Returns the nested state of a range of biclusters of a single width
+    
+    @param task (width, start, stop)
+    @return (width, start, flags)
+    """
+    width, start, stop = task
+    
+    return (width, start, workerGroup.nestedFlags(width, start, stop))
+
+def ranges(depth, processes):
+    """Splits [0, depth) into contiguous ranges for processes
+    
+    @param depth number of biclusters
+    @param processes number of worker processes
+    @return list of (start, stop)
+    """
+    step = max(1, -(-depth // (processes * RANGES_PER_PROCESS)))
+    
+    return [(start, min(start + step, depth))
+            for start in xrange(0, depth, step)]
+
+def pruneBiclusters(gem, widths, processes=None):
+    """Prunes nested biclusters of each width in widths with a pool of processes
+    
+    Nested-ness of a width only depends on that width and the next one, so
+    every index range of every width is an independent task.  The NESTED flags
+    of each width are gathered and written back in one bulk write.
+    @param gem GeneExpressionMatrix whose biclusters to prune
+    @param widths widths of biclusters to prune
+    @param processes number of worker processes.  Defaults to cpu count
+    """
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    
+    tasks = list()
+    for width in widths:
+        for start, stop in ranges(gem.biclusters.depth(width), processes):
+            tasks.append((width, start, stop))
+    
+    if len(tasks) == 0:
+        return
+    
+    # workers load the stored order indexes instead of each sorting the orders
+    for width in widths:
+        outerWidth = gem.biclusters.nextWidth(width)
+        if outerWidth is not None:
+            gem.biclusters.cache[outerWidth].orderIndex()
+    
+    # workers read from their own handles, so everything must be on disk
+    gem.biclusters.flush()
+    
+    pool = multiprocessing.Pool(processes, initializeWorker,
+                                (gem.fileName, gem.biclusters.__class__,
+                                 gem.maxConditions, gem.maxGenes))
+    try:
+        # map keeps results in task order, so ranges are already sorted
+        results = pool.map(pruneRange, tasks)
+    finally:
+        pool.close()
+        pool.join()
+    
+    for width in widths:
+        flags = [rangeFlags for rangeWidth, start, rangeFlags in results
+                 if rangeWidth == width]
+        
+        if len(flags) != 0:
+            gem.biclusters.markNested(width, 0, numpy.concatenate(flags))
+    
+    gem.biclusters.flush()
+
+def initializeSplitWorker(matrixName, minGenes):
+    """Memory-maps the packed matrix for the worker process
+    
+    @param matrixName name of the .npy file of the packed matrix
+    @param minGenes min genes for a valid bicluster
+    """
+    global workerMatrix, workerMinGenes
+    
+    workerMatrix = numpy.load(matrixName, mmap_mode = "r")
+    workerMinGenes = minGenes
+
+def splitRange(task):
+    """Returns the valid 2 condition biclusters of a range of condition pairs
+    
+    Pairs are numbered in xcombinations() order.  Each pair gives its
+    increasing bicluster and then its decreasing one, like splitSubset().
+    @param task (start, stop) of pairs
+    @return (orders, words, ids) of the valid biclusters in that order, with
+            the gene BitSet words of each bicluster in a row of words
+    """
+    start, stop = task
+    
+    first, second = numpy.triu_indices(workerMatrix.shape[1], 1)
+    
+    orders = list()
+    words = list()
+    ids = list()
+    for blockStart in xrange(start, stop, SPLIT_PAIRS):
+        block = slice(blockStart, min(blockStart + SPLIT_PAIRS, stop))
+        
+        increasing = (workerMatrix[:, first[block]] <
+                      workerMatrix[:, second[block]]).T
+        
+        # increasing and decreasing bicluster of each pair side by side
+        bits = numpy.empty((2 * increasing.shape[0], increasing.shape[1]),
+                           dtype = bool)
+        bits[0::2] = increasing
+        bits[1::2] = ~increasing
+        
+        pairOrders = numpy.empty((bits.shape[0], 2), dtype = numpy.int64)
+        pairOrders[0::2, 0] = pairOrders[1::2, 1] = first[block]
+        pairOrders[0::2, 1] = pairOrders[1::2, 0] = second[block]
+        
+        pairs = numpy.arange(block.start, block.stop, dtype = numpy.uint64)
+        pairIds = numpy.empty(bits.shape[0], dtype = numpy.uint64)
+        pairIds[0::2] = Biclustering.Bicluster.seedId(pairs, False)
+        pairIds[1::2] = Biclustering.Bicluster.seedId(pairs, True)
+        
+        valid = bits.sum(axis = 1) >= workerMinGenes
+        orders.append(pairOrders[valid])
+        words.append(Biclustering.Bit.packBits(bits[valid]))
+        ids.append(pairIds[valid])
+    
+    return (numpy.concatenate(orders), numpy.concatenate(words),
+            numpy.concatenate(ids))
+
+def splitBiclusters(gem, processes=None):
+    """Finds all biclusters with 2 conditions with a pool of processes
+    
+    The condition pairs are split into contiguous ranges.  Workers share the
+    packed matrix through a memory-mapped .npy file next to the GEM.  Ranges
+    come back in order and are appended in bulk, so the biclusters are in the
+    same order as serial splitting.
+    @param gem GeneExpressionMatrix to split
+    @param processes number of worker processes.  Defaults to cpu count
+    @return number of valid biclusters found
+    """
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    
+    pairs = gem.maxConditions * (gem.maxConditions - 1) // 2
+    
+    directory = os.path.dirname(os.path.abspath(gem.fileName))
+    handle, matrixName = tempfile.mkstemp(".npy", "packed", directory)
+    os.close(handle)
+    
+    count = 0
+    try:
+        numpy.save(matrixName, gem.data)
+        
+        pool = multiprocessing.Pool(processes, initializeSplitWorker,
+                                    (matrixName, gem.minGenes))
+        try:
+            # imap keeps results in task order and lets the parent append
+            # finished ranges while later ones are split
+            for orders, words, ids in pool.imap(splitRange,
+                                                ranges(pairs, processes)):
+                gem.biclusters.extend(orders, words, ids)
+                count += len(orders)
+        finally:
+            pool.close()
+            pool.join()
+    finally:
+        os.remove(matrixName)
+    
+    gem.biclusters.flush()
+    
+    return count
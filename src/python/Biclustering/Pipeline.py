@@ -0,0 +1,197 @@
+# Parallel Biclustering Algorithm - Fast Algorithm for finding all biclusters in a GEM
+# Copyright (C) 2006  Luke Imhoff
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+# Contact Info:
+#   Luke Imhoff (imho0030@umn.edu)
+#   220 Delaware St. SE
+#   Minneapolis, MN 55455
+"""Background threads that overlap file I/O with chaining
+
+pytables handles are not thread safe, so every thread here reads or writes the
+file only while holding the lock of the bicluster Group.  The work they overlap
+with is the numpy intersection of gene rows, which runs without the lock.
+
+@author Luke Imhoff
+@license GPLv2
+"""
+
+import Queue
+import sys
+import threading
+
+# items a Prefetcher reads ahead of the one in use
+PREFETCH_DEPTH = 2
+
+# pooled biclusters handed to a Writer at once
+WRITE_BATCH = 256
+# batches queued before pooling waits for a Writer
+WRITE_DEPTH = 8
+
+# marks the end of the items in a queue
+END = object()
+
+class Prefetcher(object):
+    """Iterates over items produced on a background thread
+    
+    The thread stays at most depth items ahead of the consumer, so at most
+    depth items are held in memory besides the one in use.  An exception
+    raised while producing is raised again by the consumer.  A consumer that
+    stops early must close() the Prefetcher, or the thread waits forever to
+    queue its next item.
+    """
+    
+    def __init__(self, items, depth=PREFETCH_DEPTH):
+        """Starts producing items
+        
+        @param items iterable to produce on the background thread
+        @param depth max items produced but not yet consumed
+        """
+        self.items = items
+        self.queue = Queue.Queue(depth)
+        self.error = None
+        # set by close() to stop producing
+        self.stopped = False
+        # set once END is taken off the queue
+        self.finished = False
+        
+        self.thread = threading.Thread(target = self.run)
+        # a consumer that stops early must not keep the process alive
+        self.thread.setDaemon(True)
+        self.thread.start()
+    
+    def run(self):
+        try:
+            try:
+                for item in self.items:
+                    if self.stopped:
+                        break
+                    
+                    self.queue.put(item)
+            except:
+                self.error = sys.exc_info()
+        finally:
+            self.queue.put(END)
+    
+    def __iter__(self):
+        while True:
+            item = self.queue.get()
+            if item is END:
+                self.finished = True
+                break
+            
+            yield item
+        
+        self.thread.join()
+        
+        if self.error is not None:
+            raise self.error[0], self.error[1], self.error[2]
+    
+    def close(self):
+        """Stops producing and waits for the thread
+        
+        Items produced but not consumed are dropped.  Safe to call after the
+        items are all consumed.
+        """
+        self.stopped = True
+        
+        # taking items off the queue frees a put() waiting on a full queue,
+        # after which the thread stops and queues END
+        while not self.finished:
+            if self.queue.get() is END:
+                self.finished = True
+        
+        self.thread.join()
+
+class Writer(object):
+    """Writes batches of items on a background thread
+    
+    Items are gathered into batches, which are queued for the thread.  When
+    depth batches are queued put() waits for the thread, so a slow file holds
+    back the producer instead of filling memory.  An exception raised while
+    writing is raised again by the next put(), flush() or close().
+    """
+    
+    def __init__(self, write, depth=WRITE_DEPTH, batch=WRITE_BATCH):
+        """Starts the writing thread
+        
+        @param write function called on the thread with each list of items
+        @param depth max batches queued but not yet written
+        @param batch items per batch
+        """
+        self.write = write
+        self.queue = Queue.Queue(depth)
+        self.batchSize = batch
+        self.batch = list()
+        self.error = None
+        
+        self.thread = threading.Thread(target = self.run)
+        self.thread.setDaemon(True)
+        self.thread.start()
+    
+    def run(self):
+        while True:
+            batch = self.queue.get()
+            try:
+                if batch is END:
+                    return
+                
+                # batches after an error are dropped
+                if self.error is None:
+                    try:
+                        self.write(batch)
+                    except:
+                        self.error = sys.exc_info()
+            finally:
+                self.queue.task_done()
+    
+    def check(self):
+        """Raises the exception of a failed write"""
+        if self.error is not None:
+            error = self.error
+            self.error = None
+            raise error[0], error[1], error[2]
+    
+    def put(self, item):
+        """Queues item to be written
+        
+        @param item item, which must not change after it is put
+        """
+        self.batch.append(item)
+        if len(self.batch) >= self.batchSize:
+            self.send()
+    
+    def send(self):
+        """Queues the partial batch"""
+        self.check()
+        
+        if len(self.batch) != 0:
+            self.queue.put(self.batch)
+            self.batch = list()
+    
+    def flush(self):
+        """Waits until every item put is written"""
+        self.send()
+        self.queue.join()
+        self.check()
+    
+    def close(self):
+        """Writes every item put and stops the thread"""
+        try:
+            self.flush()
+        finally:
+            self.queue.put(END)
+            self.thread.join()
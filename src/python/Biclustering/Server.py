@@ -0,0 +1,328 @@
+# Parallel Biclustering Algorithm - Fast Algorithm for finding all biclusters in a GEM
+# Copyright (C) 2006  Luke Imhoff
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+# Contact Info:
+#   Luke Imhoff (imho0030@umn.edu)
+#   220 Delaware St. SE
+#   Minneapolis, MN 55455
+"""Read-only query service over finished GEMs
+
+Each worker process of a QueryServer opens its own read-only handle on the GEM,
+so pytables handles are never shared between requests.  The query indexes and
+nested flags are exported once to .npy files that every worker memory-maps, so
+queries are answered from pages the OS shares between the workers instead of
+each worker reading the indexes out of the GEM.
+
+@author Luke Imhoff
+@license GPLv2
+"""
+
+import multiprocessing
+import os
+import re
+import SimpleXMLRPCServer
+import SocketServer
+import numpy
+import numpy.lib.format
+import tempfile
+
+import Biclustering.Bicluster
+import Biclustering.Bit
+import Biclustering.GeneExpressionMatrix
+
+NESTED = Biclustering.Bicluster.NESTED
+
+# names of the arrays exported for each width
+INDEXES = ("geneIndex", "conditionIndex", "nested")
+
+# per-process state set up by initializeWorker
+workerGem = None
+workerIndexes = None
+
+def indexDirectory(fileName):
+    """Returns directory holding the exported indexes of the GEM in fileName"""
+    return fileName + ".query"
+
+def indexFileName(directory, width, name):
+    return os.path.join(directory, "width%d-%s.npy" % (width, name))
+
+# matches indexFileName() and captures the width
+INDEX_FILE = re.compile(r"^width(\d+)-(%s)\.npy$" % "|".join(INDEXES))
+
+def saveRows(fileName, shape, dtype, rows):
+    """Writes an array to a .npy file a block of rows at a time
+    
+    The rows are written to a temporary file in the same directory, which is
+    then renamed to fileName, so a server sharing the directory never maps a
+    partly written file.
+    @param fileName name of the .npy file
+    @param shape shape of the array
+    @param dtype dtype of the array
+    @param rows function returning rows [start, stop) of the array
+    """
+    handle, temporary = tempfile.mkstemp(".npy", "export",
+                                         os.path.dirname(fileName))
+    os.close(handle)
+    
+    renamed = False
+    try:
+        array = numpy.lib.format.open_memmap(temporary, mode = "w+",
+                                             dtype = dtype, shape = shape)
+        for start in xrange(0, shape[0], Biclustering.Bit.BLOCK_ROWS):
+            stop = min(start + Biclustering.Bit.BLOCK_ROWS, shape[0])
+            array[start:stop] = rows(start, stop)
+        array.flush()
+        del array
+        
+        os.rename(temporary, fileName)
+        renamed = True
+    finally:
+        if not renamed:
+            os.remove(temporary)
+
+def removeStale(directory, widths):
+    """Removes exported files of widths that are no longer exported
+    
+    @param directory directory of the files
+    @param widths widths whose files are current
+    """
+    for fileName in os.listdir(directory):
+        match = INDEX_FILE.match(fileName)
+        if match is not None and int(match.group(1)) not in widths:
+            os.remove(os.path.join(directory, fileName))
+
+def exportIndexes(gem, directory=None):
+    """Writes the query indexes and nested flags of every width of gem to .npy
+    files
+    
+    Files newer than the GEM are kept, so only the first server started on a
+    finished GEM pays for the export.  Files of widths without biclusters are
+    removed.  Only the files are written, so the GEM may be on a read-only
+    mount when directory is elsewhere.
+    @param gem GeneExpressionMatrix with query indexes (see indexQueries())
+    @param directory directory of the files.  Defaults to indexDirectory() of
+                     the GEM
+    @return directory of the files
+    """
+    if directory is None:
+        directory = indexDirectory(gem.fileName)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    
+    gemTime = os.path.getmtime(gem.fileName)
+    
+    widths = set()
+    for width in xrange(2, gem.maxConditions + 1):
+        if width not in gem.biclusters.cache:
+            continue
+        
+        widthGroup = gem.biclusters.cache[width]
+        if widthGroup.depth() == 0:
+            continue
+        
+        queryIndex = widthGroup.queryIndex()
+        if queryIndex is None:
+            raise ValueError("width %d of %s has no query index" %
+                             (width, gem.fileName))
+        geneIndex, conditionIndex = queryIndex
+        widths.add(width)
+        
+        nested = widthGroup.nested[:]
+        arrays = [(setArray.bitSets.shape, numpy.uint32, setArray.block)
+                  for setArray in (geneIndex, conditionIndex)]
+        arrays.append((nested.shape, nested.dtype,
+                       lambda start, stop: nested[start:stop]))
+        for name, (shape, dtype, rows) in zip(INDEXES, arrays):
+            fileName = indexFileName(directory, width, name)
+            if (os.path.exists(fileName) and
+                os.path.getmtime(fileName) >= gemTime):
+                continue
+            
+            saveRows(fileName, shape, dtype, rows)
+    
+    removeStale(directory, widths)
+    
+    return directory
+
+def loadIndexes(directory, maxConditions):
+    """Memory-maps the indexes written by exportIndexes()
+    
+    @param directory directory of the files
+    @param maxConditions number of conditions in the GEM
+    @return dict of width -> (geneIndex, conditionIndex, nested)
+    """
+    indexes = dict()
+    for width in xrange(2, maxConditions + 1):
+        fileNames = [indexFileName(directory, width, name) for name in INDEXES]
+        if not os.path.exists(fileNames[0]):
+            continue
+        
+        indexes[width] = tuple([numpy.load(fileName, mmap_mode = 'r')
+                                for fileName in fileNames])
+    
+    return indexes
+
+def initializeWorker(name, path, directory):
+    """Opens the GEM read-only and maps its indexes for the worker process
+    
+    @param name name of the GEM
+    @param path directory of the GEM
+    @param directory directory of the exported indexes
+    """
+    global workerGem, workerIndexes
+    
+    workerGem = Biclustering.GeneExpressionMatrix.GeneExpressionMatrix(
+        name, None, path, readOnly = True)
+    workerIndexes = loadIndexes(directory, workerGem.maxConditions)
+
+def query(indexes, genes, conditions, width=None, includeNested=True):
+    """Returns biclusters containing all genes and conditions
+    
+    Same as GeneExpressionMatrix.query(), but answered from the mapped indexes
+    @param indexes indexes as returned by loadIndexes()
+    @param genes gene indexes
+    @param conditions condition indexes
+    @param width only search biclusters of width conditions.  Defaults to all
+    @param includeNested True to include nested (pruned) biclusters
+    @return list of (width, index) of matching biclusters
+    """
+    if width is None:
+        widths = sorted(indexes)
+    elif width in indexes:
+        widths = (width,)
+    else:
+        widths = ()
+    
+    found = list()
+    for width in widths:
+        if len(conditions) > width:
+            continue
+        
+        geneIndex, conditionIndex, nested = indexes[width]
+        
+        rows = [geneIndex[int(gene)] for gene in genes]
+        rows.extend([conditionIndex[int(condition)]
+                     for condition in conditions])
+        
+        if len(rows) == 0:
+            matches = numpy.arange(nested.size)
+        else:
+            words = numpy.bitwise_and.reduce(numpy.array(rows), axis = 0)
+            members = Biclustering.Bit.unpackBits(words[numpy.newaxis],
+                                                  nested.size)[0]
+            matches = numpy.where(members)[0]
+        
+        if not includeNested:
+            matches = matches[nested[matches] != NESTED.nested]
+        
+        found.extend([(width, index) for index in matches.tolist()])
+    
+    return found
+
+def queryTask(task):
+    genes, conditions, width, includeNested = task
+    
+    return query(workerIndexes, genes, conditions, width, includeNested)
+
+def statsTask(task):
+    return workerGem.stats()
+
+def biclusterTask(task):
+    """Returns (conditions, genes) of a bicluster as lists of indexes
+    
+    @param task (width, index)
+    """
+    width, index = task
+    conditions, genes = workerGem.bicluster(width, index)
+    
+    return (conditions.order.tolist(), list(genes))
+
+class QueryServer(object):
+    """Pool of processes answering queries on one finished GEM"""
+    
+    def __init__(self, name, path=None, processes=None, directory=None):
+        """Starts the worker processes
+        
+        @param name name of the GEM
+        @param path directory of the GEM.  Defaults to PWD
+        @param processes number of worker processes.  Defaults to cpu count
+        @param directory directory to export the indexes to.  Defaults to
+                         next to the GEM
+        """
+        if path is None:
+            path = "./"
+        
+        gem = Biclustering.GeneExpressionMatrix.GeneExpressionMatrix(
+            name, None, path, readOnly = True)
+        try:
+            directory = exportIndexes(gem, directory)
+        finally:
+            gem.file.close()
+        
+        if processes is None:
+            processes = multiprocessing.cpu_count()
+        
+        self.pool = multiprocessing.Pool(processes, initializeWorker,
+                                         (name, path, directory))
+    
+    def query(self, genes=(), conditions=(), width=None, includeNested=True):
+        """Returns biclusters containing all genes and conditions
+        
+        @see GeneExpressionMatrix.query()
+        """
+        return self.pool.apply(queryTask, ((list(genes), list(conditions),
+                                            width, includeNested),))
+    
+    def stats(self):
+        """Returns GeneExpressionMatrix.stats() of the GEM"""
+        return self.pool.apply(statsTask, (None,))
+    
+    def bicluster(self, width, index):
+        """Returns (conditions, genes) of a bicluster as lists of indexes"""
+        return self.pool.apply(biclusterTask, ((width, index),))
+    
+    def close(self):
+        """Stops the worker processes"""
+        self.pool.close()
+        self.pool.join()
+    
+    def serve(self, host="localhost", port=8000):
+        """Answers query, stats and bicluster calls over XML-RPC until
+        interrupted
+        
+        Each request is handled in its own thread, so requests are answered
+        concurrently by the worker processes.
+        @param host interface to listen on
+        @param port port to listen on
+        """
+        server = ThreadingXMLRPCServer((host, port), logRequests = False,
+                                       allow_none = True)
+        server.register_function(self.query, "query")
+        server.register_function(self.stats, "stats")
+        server.register_function(self.bicluster, "bicluster")
+        
+        try:
+            server.serve_forever()
+        finally:
+            server.server_close()
+            self.close()
+
+class ThreadingXMLRPCServer(SocketServer.ThreadingMixIn,
+                            SimpleXMLRPCServer.SimpleXMLRPCServer):
+    """XML-RPC server handling each request in a new thread"""
+    
+    daemon_threads = True
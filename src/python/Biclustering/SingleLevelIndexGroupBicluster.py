@@ -19,84 +19,25 @@
 #   Luke Imhoff (imho0030@umn.edu)
 #   220 Delaware St. SE
 #   Minneapolis, MN 55455
-"""Bicluster class and Group (for use with Pytables)
+"""Single-level index engine: Group with head and tail position indexes
 
 @author Luke Imhoff
 @license GPLv2
 """
 
-import itertools
-import numarray
-import numpy
-import sys
-import tables
-
-import Biclustering.Array
-import Biclustering.Bit
+import Biclustering.Bicluster
 import Biclustering.Sizing
+import Biclustering.Timing
 
-NESTED = tables.Enum(['nonnested', 'nested', 'unknown'])
-NESTED_ATOM = tables.EnumAtom(NESTED, dtype = 'UInt8', shape = (0,),
-                              flavor = 'numpy')
+NESTED = Biclustering.Bicluster.NESTED
 
-class Group(object):
-    
-    def __init__(self, file, group, maxConditions, maxGenes, create=True, minGenes=2):
-        """Creates Bicluster Table
-        
-        @param file file to create Table on
-        @param group group to which to attach Group
-        @param maxConditions max condition indexes in any one bicluster
-        @param maxGenes max gene indexes in any one bicluster
-        @param minGenes min genes index for a valid bicluster
-        @param create create bilcuster Table in as child of group in file.
-                      Default = True.  If False checks for existence of table in file
-        """
-        self.file = file
-        
-        self.maxConditions = maxConditions
-        self.maxGenes = maxGenes
-        self.minGenes = minGenes
-        
-        if create:
-            self.biclusters = file.createGroup(group, "biclusters")
-            self.file.setNodeAttr(self.biclusters, "minGenes",
-                                  numarray.array((self.minGenes,)))
-        else:
-            self.biclusters = file.getNode(group, "biclusters")
-            self.minGenes = self.file.getNodeAttr(self.biclusters, "minGenes")[0]
-        
-        self.cache = WidthGroupCache(self.file, self.biclusters,
-                                     self.maxConditions, self.maxGenes)
-        
-        # Chain Performance Monitors
-        self.widthTooBig = 0
-        self.noHeadWidth = 0
-        self.noHeadLink = 0
-        self.noTailWidth = 0
-        self.noTailLink = 0
-        self.redundantCondition = 0
-        self.insufficientGenes = 0
-    
-    def pool(self, conditions, genes):
-        """Pool biclusters
-        
-        @param conditions condition indexes of bicluster
-        @param genes dependent indexes of the bicluster
-        @param returns true if biclusters valid
-        """
-        
-        if len(genes) >= self.minGenes:
-            self.cache[len(conditions)].pool(conditions, genes)
-            return True
-        
-        return False
+class Group(Biclustering.Bicluster.Group):
+    """Group whose width groups index row numbers by head and tail
+    condition"""
     
-    def index(self, width):
-        if width not in self.cache:
-            return
-        
-        self.cache[width].index()
+    def createCache(self):
+        return WidthGroupCache(self.file, self.biclusters,
+                               self.maxConditions, self.maxGenes, self.shards)
     
     def chain(self, headWidth, link, doubling = False):
         """Chains biclusters
@@ -152,6 +93,13 @@ class Group(object):
             Biclustering.Timing.ProgressBar(headIndexes.size,
                                             "  Link %d" % link)
         
+        # scratch sets overwritten by every pair instead of allocating
+        scratchGenes = self.genePool.acquire()
+        scratchConditions = self.scratchConditions(headWidth + tailWidth - 1)
+        
+        headDepth = headGroup.depth()
+        tailDepth = tailGroup.depth()
+        
         count = 0
         for headIndex in headIndexes:
             progressBar.update()
@@ -172,7 +120,7 @@ class Group(object):
                     continue
                 
                 tailGenes = tailGroup.genes[tailIndex]
-                genes = headGenes & tailGenes
+                genes = headGenes.intersectionInto(tailGenes, scratchGenes)
                 
                 # if not enough common genes for valid bicluster
                 geneCount = len(genes)
@@ -180,9 +128,13 @@ class Group(object):
                     self.insufficientGenes += 1
                     continue
                 
-                conditions = headConditions.chain(tailConditions)
+                conditions = headConditions.chain(tailConditions,
+                                                  scratchConditions)
                 
-                self.pool(conditions, genes)
+                id = Biclustering.Bicluster.chainId(link, headIndex,
+                                                    tailIndex, headDepth,
+                                                    tailDepth)
+                self.pool(conditions, genes, id)
                 count += 1
                 # under special conditions merged biclusters can be pruned
                 if geneCount == len(headGenes) == len(tailGenes):
@@ -190,187 +142,34 @@ class Group(object):
                     tailGroup.nested[tailIndex] = NESTED.nested
         
         progressBar.finish()
-        self.file.flush()
+        self.genePool.release(scratchGenes)
+        self.flush()
         
         return count
     
-    def chainStats(self, reset=False):
-        """Prints performance stats for chain
-        
-        @param reset [False] True to reset stats to 0.
-        """
-        print "No Head Width:", self.noHeadWidth
-        print "No Head Link:", self.noHeadLink
-        print "No Tail Link:", self.noTailLink
-        print "Redundant Condition", self.redundantCondition
-        print "Insufficient Genes", self.insufficientGenes
-        
-        if reset:
-            self.noHeadWidth = 0
-            self.noHeadLink = 0
-            self.noTailLink = 0
-            self.redundantCondition = 0
-            self.insufficientGenes = 0
-    
-    def isNested(self, width, index):
-        """Marks the bicluster at index of width conditions if it is nested in another bicluster
-        
-        A Bicluster is considered nested if its genes are a subset of the
-        enclosing Bicluster's genes and the Bicluster's conditions are an
-        ordered subset of the enclosing Biclusters conditions.
-        @param bicluster Bicluster to test for nested-ness
-        @return True if bicluster is nested; False otherwise.
-        """
-        
-        if width not in self.cache:
-            return False
-        innerGroup = self.cache[width]
-        
-        # if already marked
-        if innerGroup.nested[index] == NESTED.nested:
-            return True
-        elif innerGroup.nested[index] == NESTED.nonnested:
-            return False
-        
-        if width + 1 not in self.cache:
-            innerGroup.nested[index] = NESTED.nonnested
-            return False
-        outerGroup = self.cache[width]
-        
-        genes = innerGroup.genes[index]
-        conditions = innerGroup.conditions[index]
-        
-        for outer in xrange(outerGroup.depth()):
-            # if nested genes are a subset
-            if (genes.issubset(outerGroup.genes[outer]) and
-                conditions.isOrderedSubset(outerGroup.conditions[outer])):
-                # nested-ness is a short-circuited 'or' attribute, so as so soon
-                # as one enclosing bicluster is found function can exit
-                innerGroup.nested[index] = NESTED.nested
-                return True
-        
-        # bicluster can only be marked as nonnested after all possible
-        # enclosing biclusters are checked
-        innerGroup.nested[index] = NESTED.nonnested
-        return False
-    
-    def depth(self, width, includeNested=True):
-        """Returns number of biclusters of width conditions
-        
-        @param width number of conditions in biclusters
-        @param includeNested True to include all biclusters; False to only
-               include biclusters not marked as nested
-        """
-        if width not in self.cache:
-            return 0
-        
-        return self.cache[width].depth(includeNested)
-    
-    def __str__(self):
-        rows = list()
-        
-        for width in xrange(2, self.maxConditions + 1):
-            if width not in self.cache:
-                break
-            
-            rows.append(str(self.cache[width]))
-        
-        return ''.join(rows)
+    # chain() already supports doubling
+    chainPreCrest = chain
+    supportsDoubling = True
 
-class WidthGroupCache(object):
-    
-    SLOTS = 3
+class WidthGroupCache(Biclustering.Bicluster.WidthGroupCache):
     
-    def __init__(self, file, parent, maxConditions, maxGenes):
-        """Creates a WidthGroup cache with 2 slots
-        
-        Cache is fully associative
-        @param maxConditions maxConditions in biclusters in width groups held in cache
-        """
-        self.file = file
-        self.parent = parent
-        self.maxConditions = maxConditions
-        self.maxGenes = maxGenes
-        
-        widthClass = Biclustering.Sizing.sizeArray(self.maxConditions)
-        self.widths = numpy.zeros(self.SLOTS,
-                                  dtype = widthClass)
-        self.groups = numpy.zeros(self.SLOTS, dtype = WidthGroup)
-        ageClass = Biclustering.Sizing.sizeArray(self.SLOTS)
-        self.ages = numpy.arange(self.SLOTS, dtype = ageClass)
-    
-    def __contains__(self, width):
-        return widthGroupName(width) in self.parent
-    
-    def updateAges(self, slot):
-        if self.ages[slot] != 0:
-            agedSlots = numpy.where(self.ages < self.ages[slot])
-            self.ages[agedSlots] += 1
-            self.ages[slot] = 0
-    
-    def __getitem__(self, width):
-        slot = numpy.where(self.widths == width)
-        # if single slot returned
-        if len(slot) == 1:
-            slot = slot[0]
-            group = self.groups[slot]
-            
-            self.updateAges(slot)
-        else:
-            group = WidthGroup(self.file, self.parent, self.maxConditions,
-                               self.maxGenes, width)
-            
-            slot = numpy.where(self.ages == self.SLOTS - 1)
-            self.groups[slot] = group
-            self.widths[slot] = width
-            
-            self.updateAges(slot)
-        
-        return group
-
-def widthGroupName(width):
-    return "width" + str(width)
-
-class WidthGroup(object):
+    def widthGroup(self, width):
+        nodeFile, parent = self.location(width)
+        return WidthGroup(nodeFile, parent, self.maxConditions,
+                          self.maxGenes, width)
 
-    def __init__(self, file, parent, maxConditions, maxGenes, width):
-        """Returns group for storing bicluster of width conditions."""
-        self.file = file
-        self.maxConditions = maxConditions
-        self.maxGenes = maxGenes
-        self.width = width
-        
-        name = widthGroupName(width)
-        try:
-            self.group = file.getNode(parent, name)
-        except tables.NoSuchNodeError:
-            self.group = file.createGroup(parent, name)
-        
-        self.conditions = Biclustering.Bit.OrderedSetArray(file, self.group,
-                                                           "conditions", width,
-                                                           maxConditions)
-        self.genes = Biclustering.Bit.SetArray(file, self.group, "genes",
-                                               maxGenes)
-        
-        try:
-            self.nested = self.group.nested
-        except tables.NoSuchNodeError:
-            self.nested = file.createEArray(self.group,
-                                            "nested",
-                                            NESTED_ATOM)
+class WidthGroup(Biclustering.Bicluster.WidthGroup):
+    
+    INDEX_NODES = Biclustering.Bicluster.WidthGroup.INDEX_NODES + \
+                  ("heads", "tails")
     
     def __getitem__(self, link):
         return getattr(self.group, link[0])[link[1]]
     
-    def pool(self, conditions, genes):
-        self.conditions.append(conditions)
-        self.genes.append(genes)
-        self.nested.append((NESTED.unknown,))
-    
     def indexPosition(self, name, position):
         atomClass = Biclustering.Sizing.sizeAtom(self.maxConditions)
         atom = atomClass(flavor = 'numpy')
-        expectedSizeInMB = atom.atomsize() * self.nested.nrows / float(1 << 20)
+        expectedSizeInMB = atom.atomsize() * len(self.nested) / float(1 << 20)
         indexArray = \
             self.file.createVLArray(self.group, name, atom,
                                     expectedsizeinMB = expectedSizeInMB)
@@ -391,55 +190,3 @@ class WidthGroup(object):
     def index(self):
         self.indexPosition("heads", -1)
         self.indexPosition("tails", 0)
-    
-    def __str__(self):
-        rows = list()
-        first = True
-        for conditions, genes in itertools.izip(self.conditions, self.genes):
-            if first:
-                first = False
-            else:
-                rows.append("\n")
-            
-            rows.append("Conditions: %s Genes: %s" % (conditions, genes))
-        
-        return ''.join(rows)
-    
-    def duplicateSearch(self):
-        combinations = Biclustering.Combinatorics.xcombinations(self.depth(), 2)
-        
-        progressBar = \
-            Biclustering.Timing.ProgressBar(combinations.len(),
-                                                "Duplicate Search")
-        
-        for indexes in combinations:
-            progressBar.update()
-            
-            # BUG FIX numpy ints
-            index0 = int(indexes[0])
-            index1 = int(indexes[1])
-            
-            if self.conditions[index0] != self.conditions[index1]:
-                continue
-            
-            if self.genes[index0] != self.genes[index1]:
-                print indexes[0], "have same conditions", indexes[1]
-            else:
-                print indexes[0], "==", indexes[1]
-        
-        progressBar.finish()
-    
-    def depth(self, includeNested=True):
-        """Returns number of biclusters of width conditions
-        
-        @param width number of conditions in biclusters
-        @param includeNested True to include all biclusters; False to only
-               include biclusters not marked as nested
-        """
-        
-        if includeNested:
-            count = self.nested.nrows
-        else:
-            count = len(numpy.where(self.nested[:] != NESTED.nested))
-        
-        return count
@@ -21,91 +21,30 @@
 #   Luke Imhoff (imho0030@umn.edu)
 #   3480 Golfview Dr Apt 1208
 #   Eagan, MN 55123
-"""Bicluster class and Group (for use with Pytables)
+"""Table engine: Group storing each width in a single bicluster Table
 
 @author Luke Imhoff
 @license GPLv2
 """
 
 import itertools
-import numarray
 import numpy
-import sys
 import tables
 
-import Biclustering.Array
+import Biclustering.Bicluster
 import Biclustering.Bit
+import Biclustering.BitSet
 import Biclustering.Sizing
+import Biclustering.Timing
 
-NESTED_LIST = ['nonnested', 'nested', 'unknown']
-NESTED = tables.Enum(NESTED_LIST)
-NESTED_ATOM = tables.EnumAtom(NESTED, dtype = 'UInt8', shape = (0,),
-                              flavor = 'numpy')
+NESTED = Biclustering.Bicluster.NESTED
 
-class Group(object):
+class Group(Biclustering.Bicluster.Group):
     """Group node for holding bilcusters"""
     
-    def __init__(self, nodeFile, group, maxConditions, maxGenes, create=True,
-                 minGenes=2):
-        """Creates Bicluster Table
-        
-        @param nodeFile file to create Table on
-        @param group group to which to attach Group
-        @param maxConditions max condition indexes in any one bicluster
-        @param maxGenes max gene indexes in any one bicluster
-        @param minGenes min genes index for a valid bicluster
-        @param create create bilcuster Table in as child of group in file.
-                      Default = True.  If False checks for existence of table
-                      in file
-        """
-        self.file = nodeFile
-        
-        self.maxConditions = maxConditions
-        self.maxGenes = maxGenes
-        self.minGenes = minGenes
-        
-        if create:
-            self.biclusters = self.file.createGroup(group, "biclusters")
-            self.file.setNodeAttr(self.biclusters, "minGenes",
-                                  numarray.array((self.minGenes,)))
-        else:
-            self.biclusters = self.file.getNode(group, "biclusters")
-            self.minGenes = self.file.getNodeAttr(self.biclusters,
-                                                  "minGenes")[0]
-        
-        self.cache = WidthGroupCache(self.file, self.biclusters,
-                                     self.maxConditions, self.maxGenes)
-        
-        # Chain Performance Monitors
-        self.noHeadWidth = 0
-        self.noHeadLink = 0
-        self.noTailLink = 0
-        self.redundantCondition = 0
-        self.insufficientGenes = 0
-    
-    def pool(self, conditions, genes):
-        """Pool biclusters
-        
-        @param conditions condition indexes of bicluster
-        @param genes dependent indexes of the bicluster
-        @param returns true if biclusters valid
-        """
-        
-        if len(genes) >= self.minGenes:
-            self.cache[len(conditions)].pool(conditions, genes)
-            return True
-        
-        return False
-    
-    def index(self, width):
-        """Returns index of width biclusters
-        
-        @param width width of biclusters to index
-        """
-        if width not in self.cache:
-            return
-        
-        self.cache[width].index()
+    def createCache(self):
+        return WidthGroupCache(self.file, self.biclusters,
+                               self.maxConditions, self.maxGenes, self.shards)
     
     def chain(self, headWidth, link):
         """Chains biclusters
@@ -134,6 +73,13 @@ class Group(object):
             Biclustering.Timing.ProgressBar(headIndexes.size,
                                             "  Link %d" % link)
         
+        # scratch sets overwritten by every pair instead of allocating
+        scratchGenes = self.genePool.acquire()
+        scratchConditions = self.scratchConditions(headWidth + 1)
+        
+        headDepth = headGroup.depth()
+        tailDepth = tailGroup.depth()
+        
         count = 0
         for headIndex in headIndexes:
             progressBar.update()
@@ -154,7 +100,7 @@ class Group(object):
                     continue
                 
                 tailGenes = tailGroup.genes[tailIndex]
-                genes = headGenes & tailGenes
+                genes = headGenes.intersectionInto(tailGenes, scratchGenes)
                 
                 # if not enough common genes for valid bicluster
                 geneCount = len(genes)
@@ -162,9 +108,13 @@ class Group(object):
                     self.insufficientGenes += 1
                     continue
                 
-                conditions = headConditions.chain(tailConditions)
+                conditions = headConditions.chain(tailConditions,
+                                                  scratchConditions)
                 
-                self.pool(conditions, genes)
+                id = Biclustering.Bicluster.chainId(link, headIndex,
+                                                    tailIndex, headDepth,
+                                                    tailDepth)
+                self.pool(conditions, genes, id)
                 count += 1
                 # under special conditions merged biclusters can be pruned
                 if geneCount == len(headGenes) == len(tailGenes):
@@ -172,148 +122,21 @@ class Group(object):
                     tailGroup.nested[tailIndex] = NESTED.nested
         
         progressBar.finish()
-        self.file.flush()
+        self.genePool.release(scratchGenes)
+        self.flush()
         
         return count
-    
-    def chainStats(self, reset=False):
-        """Prints performance stats for chain
-        
-        @param reset [False] True to reset stats to 0.
-        """
-        print "No Head Width:", self.noHeadWidth
-        print "No Head Link:", self.noHeadLink
-        print "No Tail Link:", self.noTailLink
-        print "Redundant Condition", self.redundantCondition
-        print "Insufficient Genes", self.insufficientGenes
-        
-        if reset:
-            self.noHeadWidth = 0
-            self.noHeadLink = 0
-            self.noTailLink = 0
-            self.redundantCondition = 0
-            self.insufficientGenes = 0
-    
-    def isNested(self, width, index):
-        """Marks the bicluster at index of width conditions if it is nested in
-        another bicluster
-        
-        A Bicluster is considered nested if its genes are a subset of the
-        enclosing Bicluster's genes and the Bicluster's conditions are an
-        ordered subset of the enclosing Biclusters conditions.
-        @param bicluster Bicluster to test for nested-ness
-        @return True if bicluster is nested; False otherwise.
-        """
-        
-        if width not in self.cache:
-            return False
-        innerGroup = self.cache[width]
-        
-        # if already marked
-        if innerGroup.nested[index] == NESTED.nested:
-            return True
-        elif innerGroup.nested[index] == NESTED.nonnested:
-            return False
-        
-        if width + 1 not in self.cache:
-            innerGroup.nested[index] = NESTED.nonnested
-            return False
-        outerGroup = self.cache[width]
-        
-        genes = innerGroup.genes[index]
-        conditions = innerGroup.conditions[index]
-        
-        for outer in xrange(outerGroup.depth()):
-            # if nested genes are a subset
-            if (genes.issubset(outerGroup.genes[outer]) and
-                conditions.isOrderedSubset(outerGroup.conditions[outer])):
-                # nested-ness is a short-circuited 'or' attribute, so as so soon
-                # as one enclosing bicluster is found function can exit
-                innerGroup.nested[index] = NESTED.nested
-                return True
-        
-        # bicluster can only be marked as nonnested after all possible
-        # enclosing biclusters are checked
-        innerGroup.nested[index] = NESTED.nonnested
-        return False
-    
-    def depth(self, width, includeNested=True):
-        """Returns number of biclusters of width conditions
-        
-        @param width number of conditions in biclusters
-        @param includeNested True to include all biclusters; False to only
-               include biclusters not marked as nested
-        """
-        if width not in self.cache:
-            return 0
-        
-        return self.cache[width].depth(includeNested)
-    
-    def __str__(self):
-        rows = list()
-        
-        for width in xrange(2, self.maxConditions + 1):
-            if width not in self.cache:
-                break
-            
-            rows.append(str(self.cache[width]))
-        
-        return ''.join(rows)
 
-class WidthGroupCache(object):
-    
-    SLOTS = 3
+class WidthGroupCache(Biclustering.Bicluster.WidthGroupCache):
     
-    def __init__(self, file, parent, maxConditions, maxGenes):
-        """Creates a WidthGroup cache with 2 slots
-        
-        Cache is fully associative
-        @param maxConditions maxConditions in biclusters in width groups held in cache
-        """
-        self.file = file
-        self.parent = parent
-        self.maxConditions = maxConditions
-        self.maxGenes = maxGenes
-        
-        widthClass = Biclustering.Sizing.sizeArray(self.maxConditions)
-        self.widths = numpy.zeros(self.SLOTS,
-                                  dtype = widthClass)
-        self.groups = numpy.zeros(self.SLOTS, dtype = WidthGroup)
-        ageClass = Biclustering.Sizing.sizeArray(self.SLOTS)
-        self.ages = numpy.arange(self.SLOTS, dtype = ageClass)
-    
-    def __contains__(self, width):
-        return widthGroupName(width) in self.parent
-    
-    def updateAges(self, slot):
-        if self.ages[slot] != 0:
-            agedSlots = numpy.where(self.ages < self.ages[slot])
-            self.ages[agedSlots] += 1
-            self.ages[slot] = 0
-    
-    def __getitem__(self, width):
-        slot = numpy.where(self.widths == width)
-        # if single slot returned
-        if len(slot) == 1:
-            slot = slot[0]
-            group = self.groups[slot]
-            
-            self.updateAges(slot)
-        else:
-            if width == 2:
-                group = SeedGroup(self.file, self.parent, self.maxConditions,
-                                  self.maxGenes)
-            else:
-                group = WidthGroup(self.file, self.parent, self.maxConditions,
-                                   self.maxGenes, width)
-            
-            slot = numpy.where(self.ages == self.SLOTS - 1)
-            self.groups[slot] = group
-            self.widths[slot] = width
-            
-            self.updateAges(slot)
-        
-        return group
+    def widthGroup(self, width):
+        nodeFile, parent = self.location(width)
+        if width == 2:
+            return SeedGroup(nodeFile, parent, self.maxConditions,
+                             self.maxGenes)
+        
+        return WidthGroup(nodeFile, parent, self.maxConditions,
+                          self.maxGenes, width)
 
 class BiclusterTableAccessor(object):
     
@@ -356,11 +179,13 @@ class BiclusterTableAccessor(object):
         except AttributeError:
             row[name] = data
 
-def widthGroupName(width):
-    return "width" + str(width)
-
-class WidthGroup(object):
-
+class WidthGroup(Biclustering.Bicluster.WidthGroup):
+    """Width group storing conditions, genes and nested state as columns of
+    one Table"""
+    
+    INDEX_NODES = Biclustering.Bicluster.WidthGroup.INDEX_NODES + \
+                  ("heads", "tails")
+    
     def __init__(self, file, parent, maxConditions, maxGenes, width):
         """Returns group for storing bicluster of width conditions."""
         self.file = file
@@ -368,7 +193,7 @@ class WidthGroup(object):
         self.maxGenes = maxGenes
         self.width = width
         
-        name = widthGroupName(width)
+        name = Biclustering.Bicluster.widthGroupName(width)
         
         try:
             self.group = file.getNode(parent, name)
@@ -378,25 +203,97 @@ class WidthGroup(object):
         self.biclusterPoolAccessor = BiclusterTableAccessor(maxGenes,
                                                             maxConditions,
                                                             width)
-        self.biclusterPool = \
-            file.createTable(self.group, "biclusterPool",
-                             self.biclusterPoolAccessor.dictDescription)
+        try:
+            self.biclusterPool = self.group.biclusterPool
+        except tables.NoSuchNodeError:
+            self.biclusterPool = \
+                file.createTable(self.group, "biclusterPool",
+                                 self.biclusterPoolAccessor.description)
+        
+        self.conditions = PoolColumn(self.biclusterPool,
+                                     self.biclusterPoolAccessor, 'conditions')
+        self.genes = PoolColumn(self.biclusterPool,
+                                self.biclusterPoolAccessor, 'genes')
+        self.nested = PoolNestedColumn(self.biclusterPool)
+        self.ids = Biclustering.Bicluster.IdColumn(file, self.group, "ids",
+                                                   len(self.nested))
+        
+        # OrderIndex, built on first use
+        self.sortedOrders = None
     
     def __getitem__(self, link):
         return self.group.heads[link]
     
-    def pool(self, conditions, genes):
+    def conditionSets(self):
+        return PoolColumn(self.biclusterPool, self.biclusterPoolAccessor,
+                          'conditions/set')
+    
+    def pool(self, conditions, genes, id):
         row = self.biclusterPool.row
         
         self.biclusterPoolAccessor.pack(row, 'conditions', conditions)
         self.biclusterPoolAccessor.pack(row, 'genes', genes)
         
         row.append()
+        self.nested.append(NESTED.unknown)
+        self.ids.append(id)
+    
+    def extend(self, orders, conditions, genes, ids):
+        """Appends biclusters given as arrays a row at a time
+        
+        @param orders (biclusters, width) array of condition orders
+        @param conditions 2D array with the BitSet words of each order's set
+        @param genes 2D array with the BitSet words of each bicluster's genes
+        @param ids id of each bicluster
+        """
+        for order, conditionWords, geneWords, id in \
+                itertools.izip(orders, conditions, genes, ids):
+            conditionSet = Biclustering.BitSet.BitSet(self.maxConditions,
+                                                      conditionWords.copy(),
+                                                      True)
+            self.pool(Biclustering.Bit.OrderedBitSet(order.copy(),
+                                                     set = conditionSet),
+                      Biclustering.BitSet.BitSet(self.maxGenes,
+                                                 geneWords.copy(), True),
+                      int(id))
+    
+    def orders(self):
+        return self.biclusterPool.col('conditions/order')
+    
+    def canonicalize(self):
+        """Rewrites the Table in increasing id order
+        
+        The Table is read whole and written back a block at a time.
+        @return True if rows were reordered
+        """
+        order = self.canonicalOrder()
+        if order is None:
+            return False
+        
+        self.flush()
+        
+        rows = self.biclusterPool.read()
+        for start in xrange(0, order.size, Biclustering.Bit.BLOCK_ROWS):
+            block = order[start:start + Biclustering.Bit.BLOCK_ROWS]
+            self.biclusterPool.modifyRows(start, start + block.size,
+                                          rows = rows[block])
+        self.biclusterPool.flush()
+        
+        self.nested.load(self.biclusterPool.col('nested'))
+        self.ids.permute(order)
+        self.dropIndexes()
+        
+        return True
+    
+    def flush(self):
+        """Writes pending rows and in-memory nested state"""
+        self.biclusterPool.flush()
+        self.nested.flush()
     
     def indexPosition(self, name, position):
         atomClass = Biclustering.Sizing.sizeAtom(self.maxConditions)
         atom = atomClass(flavor = 'numpy')
-        expectedSizeInMB = atom.atomsize() * self.nested.nrows / float(1 << 20)
+        expectedSizeInMB = atom.atomsize() * len(self.nested) / float(1 << 20)
         indexArray = \
             self.file.createVLArray(self.group, name, atom,
                                     expectedsizeinMB = expectedSizeInMB)
@@ -415,6 +312,7 @@ class WidthGroup(object):
         indexArray.flush()
     
     def index(self):
+        self.flush()
         self.indexPosition("heads", -1)
     
     def __str__(self):
@@ -431,21 +329,6 @@ class WidthGroup(object):
             rows.append("Conditions: %s Genes: %s" % (conditions, genes))
         
         return ''.join(rows)
-    
-    def depth(self, includeNested=True):
-        """Returns number of biclusters of width conditions
-        
-        @param width number of conditions in biclusters
-        @param includeNested True to include all biclusters; False to only
-               include biclusters not marked as nested
-        """
-        
-        if includeNested:
-            count = self.nested.nrows
-        else:
-            count = len(numpy.where(self.nested[:] != NESTED.nested))
-        
-        return count
 
 class SeedGroup(WidthGroup):
     
@@ -464,3 +347,92 @@ class SeedGroup(WidthGroup):
     def index(self):
         super(SeedGroup, self).index()
         self.indexPosition("tails", 0)
+
+class PoolColumn(object):
+    """Column of a bicluster Table presented like the arrays of the other
+    engines"""
+    
+    def __init__(self, table, accessor, name):
+        """
+        @param table bicluster Table
+        @param accessor BiclusterTableAccessor for table
+        @param name name of column
+        """
+        self.table = table
+        self.accessor = accessor
+        self.name = name
+    
+    def __getitem__(self, index):
+        # BUG FIX pytables doesn't understand numpy integer types
+        index = int(index)
+        for row in self.table.iterrows(index, index + 1):
+            return self.accessor.unpack(row, self.name)
+        
+        raise IndexError("bicluster index out of range")
+    
+    def __iter__(self):
+        for row in self.table.iterrows():
+            yield self.accessor.unpack(row, self.name)
+    
+    def __len__(self):
+        return self.table.nrows
+    
+    def readInto(self, index, out):
+        """Loads the BitSet in row index into out instead of a new BitSet
+        
+        @param index row
+        @param out BitSet of the same universe to overwrite
+        @return out
+        """
+        out.assign(self.block(index, index + 1)[0])
+        
+        return out
+    
+    def block(self, start, stop):
+        """Returns rows [start, stop) of the column as a 2D array
+        
+        @param start first row
+        @param stop row after last row
+        """
+        return self.table.read(start, stop, field = self.name)
+    
+    def counts(self):
+        """Returns number of members of the BitSet in every row"""
+        counts = numpy.zeros(len(self), dtype = numpy.int64)
+        for start in xrange(0, len(self), Biclustering.Bit.BLOCK_ROWS):
+            stop = min(start + Biclustering.Bit.BLOCK_ROWS, len(self))
+            counts[start:stop] = Biclustering.Bit.popCounts(self.block(start,
+                                                                       stop))
+        
+        return counts
+    
+    def positions(self, position):
+        """Returns the condition at position of every order
+        
+        @param position column
+        """
+        return self.table.col(self.name + '/order')[:, position]
+    
+    def where(self, position, value):
+        """Returns rows where position of the order has value
+        
+        @param position column
+        @param value value for which to search
+        """
+        orders = self.table.col(self.name + '/order')
+        return numpy.where(orders[:, position] == value)
+
+class PoolNestedColumn(Biclustering.Bicluster.NestedColumn):
+    """Nested column of a bicluster Table held in memory
+    
+    Rows are appended to the Table by pool(), so flush() only has to write back
+    changed flags.
+    """
+    
+    def __init__(self, table):
+        self.table = table
+        self.array = table.cols.nested
+        self.load(table.col('nested'))
+    
+    def rows(self):
+        return self.table.nrows
@@ -29,8 +29,26 @@ Adapted from public domain code released on ASPN
 """
 
 import datetime
+import logging
 import time
 
+def pytime(function, args=(), kwargs=None, repeat=3):
+    """Returns average seconds taken by function(*args, **kwargs)
+    
+    @param function function to time
+    @param args positional arguments of function
+    @param kwargs keyword arguments of function
+    @param repeat number of calls to average
+    """
+    if kwargs is None:
+        kwargs = dict()
+    
+    start = time.time()
+    for i in xrange(repeat):
+        function(*args, **kwargs)
+    
+    return (time.time() - start) / repeat
+
 class ProgressBar(object): 
     """Text Progress bar for console apps with ETF
     
@@ -49,7 +67,7 @@ class ProgressBar(object):
     def update(self):
         if self.start is None:
             self.start = time.time()
-            logging.info("  Starting at", time.asctime())
+            logging.info("  Starting at %s", time.asctime())
             return False
         
         self.count += 1
@@ -80,7 +98,7 @@ class ProgressBar(object):
         else:
             elapsed = time.time() - self.start
         
-        logging.info("  Ended at", time.asctime())
+        logging.info("  Ended at %s", time.asctime())
         logging.info("%s: %d Completed %s",
                      self.title, self.count + 1,
                      datetime.timedelta(seconds = elapsed))